@@ -26,10 +26,8 @@ import cv2
 import datetime
 import numpy as np
 import math
-from scipy.spatial import distance
 from collections import deque
 import tensorflow as tf
-from tensorflow.keras.models import load_model
 from tensorflow.keras.preprocessing.image import img_to_array
 import pandas as pd
 import seaborn as sb
@@ -67,22 +65,34 @@ class AnalyzeAnimal():
 		self.background=None
 		self.background_low=None
 		self.background_high=None
+		self.arena=None
 		self.skipped_frames=[]
 		self.all_time=[]
 		self.total_analysis_framecount=None
 		self.to_deregister={}
 		self.count_to_deregister=None
 		self.register_counts={}
+		self.animal_tracks={}
 		self.animal_contours={}
 		self.animal_centers={}
 		self.animal_existingcenters={}
+		self.animal_velocities=None
+		self.animal_lastseen=None
 		self.animal_heights={}
+		self.animal_geometries={}
 		self.animal_inners={}
 		self.animal_blobs={}
 		self.animations={}
 		self.pattern_images={}
 		self.event_probability={}
 		self.all_behavior_parameters={}
+		self.single_pass=False
+		self.writer=None
+		self.queue_size=32
+		self.assignment_method='greedy'
+		self.motion_prediction=False
+		self.categorize_stride=1
+		self.inners_released=0
 		self.log=[]
 		
 
@@ -108,7 +118,15 @@ class AnalyzeAnimal():
 		ex_start=0, # the start time point for background extraction
 		ex_end=None, # the end time point for background extraction, if None, use the entire video
 		length=15, # the duration (number of frames) of a behavior example (a behavior episode)
-		animal_vs_bg=0 # 0: animals brighter than the background; 1: animals darker than the background; 2: hard to tell
+		animal_vs_bg=0, # 0: animals brighter than the background; 1: animals darker than the background; 2: hard to tell
+		queue_size=32, # the maximum number of frames decoded ahead in a background thread, if <=0, decode frames in the main thread
+		background_samples=None, # if not None, extract the background from this number of evenly spaced frames between ex_start and ex_end instead of decoding all of them
+		cache_background=True, # whether to cache the extracted backgrounds and animal size on disk (up to 512 MB in ~/.LabGym/backgrounds, the least recently used are deleted beyond it) and reuse them when the same video is analyzed with the same parameters
+		online_background=False, # whether to extract the backgrounds incrementally without keeping the frames in memory
+		path_to_arena=None, # if not None, the path to an arena mask image (the arena in white), the detection only runs within the bounding box of the arena
+		assignment_method='greedy', # how to match the detected animals to the tracked ones in each frame: 'greedy' (the closest pairs first), 'kdtree' (the same as 'greedy' but only sorts the nearby pairs, faster for many animals), or 'hungarian' (the smallest sum of distances)
+		motion_prediction=False, # whether to match the detected animals to the centers predicted from the velocities of the tracked ones (constant velocity) instead of their last seen centers, which helps keep the identities of fast-moving animals
+		categorize_stride=1 # categorize every this many categorizable frames of each animal and interpolate the behavior probabilities of the frames in between, 1 categorizes all of them
 		):
 		
 		print('Preparation started...')
@@ -132,6 +150,11 @@ class AnalyzeAnimal():
 		self.t=t
 		self.duration=duration
 		self.length=length
+		self.queue_size=queue_size
+		self.assignment_method=assignment_method
+		self.motion_prediction=motion_prediction
+		self.categorize_stride=categorize_stride
+		self.inners_released=0
 		os.makedirs(self.results_path,exist_ok=True)
 		capture=cv2.VideoCapture(self.path_to_video)
 		self.fps=round(capture.get(cv2.CAP_PROP_FPS))
@@ -179,7 +202,11 @@ class AnalyzeAnimal():
 			es_start=None
 		else:
 			es_start=self.t
-		constants=estimate_constants(self.path_to_video,self.delta,self.animal_number,framewidth=self.framewidth,frameheight=self.frameheight,stable_illumination=stable_illumination,ex_start=ex_start,ex_end=ex_end,t=es_start,duration=self.duration,animal_vs_bg=self.animal_vs_bg,path_background=path_background,kernel=self.kernel)
+		if cache_background:
+			cache_path=os.path.join(os.path.expanduser('~'),'.LabGym','backgrounds')
+		else:
+			cache_path=None
+		constants=estimate_constants(self.path_to_video,self.delta,self.animal_number,framewidth=self.framewidth,frameheight=self.frameheight,stable_illumination=stable_illumination,ex_start=ex_start,ex_end=ex_end,t=es_start,duration=self.duration,animal_vs_bg=self.animal_vs_bg,path_background=path_background,kernel=self.kernel,queue_size=self.queue_size,background_samples=background_samples,cache_path=cache_path,online_background=online_background)
 		self.animal_area=constants[4]
 		self.log.append('The area of single animal is: '+str(self.animal_area)+'.')
 		self.background=constants[0]
@@ -190,6 +217,14 @@ class AnalyzeAnimal():
 		cv2.imwrite(os.path.join(self.results_path,'background_high.jpg'),constants[2])
 		if self.autofind_t:
 			self.t=constants[3]
+		if path_to_arena is not None:
+			self.arena=load_arena(path_to_arena,self.background.shape[1],self.background.shape[0])
+			if self.arena is None:
+				print('No arena found in: '+path_to_arena+', detecting in the entire frame.')
+				self.log.append('No arena found in: '+path_to_arena+', detecting in the entire frame.')
+			else:
+				print('The detection is restricted to the arena in: '+path_to_arena)
+				self.log.append('The detection is restricted to the arena in: '+path_to_arena)
 
 		if self.categorize_behavior:
 			for behavior_name in names_and_colors:
@@ -203,61 +238,59 @@ class AnalyzeAnimal():
 			for parameter_name in ['acceleration','distance','intensity_area','intensity_length','magnitude_area','magnitude_length','speed','velocity','vigor_area','vigor_length']:
 				self.all_behavior_parameters[parameter_name]={}
 
+		self.animal_velocities=np.zeros((self.animal_number,2))
+		self.animal_lastseen=np.full(self.animal_number,-1)
 		for i in range(self.animal_number):
 			self.to_deregister[i]=0
 			self.register_counts[i]=None
-			self.animal_contours[i]=[None]*self.total_analysis_framecount
-			self.animal_centers[i]=[None]*self.total_analysis_framecount
+			self.animal_tracks[i]=TrackStore(self.total_analysis_framecount)
+			self.animal_contours[i]=self.animal_tracks[i].contours
+			self.animal_centers[i]=self.animal_tracks[i].centers
 			self.animal_existingcenters[i]=(-10000,-10000)
-			self.animal_heights[i]=[None]*self.total_analysis_framecount
+			self.animal_heights[i]=self.animal_tracks[i].heights
+			self.animal_geometries[i]=self.animal_tracks[i].geometries
 			if self.include_bodyparts:
-				self.animal_inners[i]=deque(maxlen=self.length)
+				self.animal_inners[i]=[]
 			if self.animation_analyzer:
-				self.animal_blobs[i]=deque([np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')],maxlen=self.length)*self.length
-				self.animations[i]=[np.zeros((self.length,self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')]*self.total_analysis_framecount
-			self.pattern_images[i]=[np.zeros((self.dim_conv,self.dim_conv,3),dtype='uint8')]*self.total_analysis_framecount
+				self.animal_blobs[i]=AnimationStore(self.length,self.total_analysis_framecount,self.dim_tconv,self.channel)
 
 		print('Preparation completed!')
 		self.log.append('Preparation completed!')
 
 
-	def track_animal(self,frame_count_analyze,contours,centers,heights,inners=None):
+	def track_animal(self,frame_count_analyze,contours,centers,heights,inners=None,geometries=None):
 
 		# frame_count_analyze: the analyzed frame count
 		# contours: the contours of detected animals
 		# centers: the centers of detected animals
 		# heights: the heights of detected animals
 		# inners: the inner contours of detected animals when body parts are included in pattern images
+		# geometries: the (area,center,height,rect) of the contours of detected animals
 
-		unused_existing_indices=list(self.animal_existingcenters)
 		existing_centers=list(self.animal_existingcenters.values())
-		unused_new_indices=list(range(len(centers)))
-		dt_flattened=distance.cdist(existing_centers,centers).flatten()
-		dt_sort_index=dt_flattened.argsort()
-		length=len(centers)
-
-		for idx in dt_sort_index:
-			index_in_existing=int(idx/length)
-			index_in_new=int(idx%length)
-			if index_in_existing in unused_existing_indices:
-				if index_in_new in unused_new_indices:
-					unused_existing_indices.remove(index_in_existing)
-					unused_new_indices.remove(index_in_new)
-					if self.register_counts[index_in_existing] is None:
-						self.register_counts[index_in_existing]=frame_count_analyze
-					self.to_deregister[index_in_existing]=0
-					self.animal_contours[index_in_existing][frame_count_analyze]=contours[index_in_new]
-					center=centers[index_in_new]
-					self.animal_centers[index_in_existing][frame_count_analyze]=center
-					self.animal_existingcenters[index_in_existing]=center
-					self.animal_heights[index_in_existing][frame_count_analyze]=heights[index_in_new]
-					if self.include_bodyparts:
-						self.animal_inners[index_in_existing].append(inners[index_in_new])
-						pattern_image=generate_patternimage(self.background,self.animal_contours[index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],inners=self.animal_inners[index_in_existing],std=self.std)
-					else:
-						pattern_image=generate_patternimage(self.background,self.animal_contours[index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],inners=None,std=0)
-					pattern_image=cv2.resize(pattern_image,(self.dim_conv,self.dim_conv),interpolation=cv2.INTER_AREA)
-					self.pattern_images[index_in_existing][frame_count_analyze]=np.array(pattern_image)
+		if self.motion_prediction:
+			missed_counts=frame_count_analyze-self.animal_lastseen-1
+			predicted_centers=predict_centers(existing_centers,self.animal_velocities,missed_counts)
+		else:
+			predicted_centers=existing_centers
+		(matches,unused_existing_indices)=match_centers(predicted_centers,centers,method=self.assignment_method,radius=math.sqrt(self.animal_area))
+		if self.motion_prediction:
+			update_velocities(self.animal_velocities,existing_centers,centers,matches,missed_counts)
+			self.animal_lastseen[[index_in_existing for index_in_existing,index_in_new in matches]]=frame_count_analyze
+
+		for index_in_existing,index_in_new in matches:
+			if self.register_counts[index_in_existing] is None:
+				self.register_counts[index_in_existing]=frame_count_analyze
+			self.to_deregister[index_in_existing]=0
+			self.animal_contours[index_in_existing][frame_count_analyze]=contours[index_in_new]
+			center=centers[index_in_new]
+			self.animal_centers[index_in_existing][frame_count_analyze]=center
+			self.animal_existingcenters[index_in_existing]=center
+			self.animal_heights[index_in_existing][frame_count_analyze]=heights[index_in_new]
+			if geometries is not None:
+				self.animal_geometries[index_in_existing][frame_count_analyze]=geometries[index_in_new]
+			if self.include_bodyparts:
+				self.animal_inners[index_in_existing].append(inners[index_in_new])
 
 		if len(unused_existing_indices)>0:
 			for i in unused_existing_indices:
@@ -269,18 +302,17 @@ class AnalyzeAnimal():
 					self.animal_inners[i].append(None)
 
 
-	def acquire_information(self,background_free=True,black_background=True):
+	def acquire_information(self,background_free=True,black_background=True,motion_threshold=0):
 
 		# background_free: whether to include background in animations
 		# black_background: whether to set background black
+		# motion_threshold: if >0, when no pixel of the 8-fold downsampled gray frame changes by this gray level or more since the last contoured frame, reuse the contours of that frame
 
 		print('Acquiring information in each frame...')
 		self.log.append('Acquiring information in each frame...')
 		print(datetime.datetime.now())
 		self.log.append(str(datetime.datetime.now()))
 
-		capture=cv2.VideoCapture(self.path_to_video)
-
 		background=self.background
 		background_low=self.background_low
 		background_high=self.background_high
@@ -289,9 +321,9 @@ class AnalyzeAnimal():
 			background_low=np.uint8(255-background_low)
 			background_high=np.uint8(255-background_high)
 
-		frame_count=frame_count_analyze=0
-		temp_frames=deque(maxlen=self.length)
-		animation=deque([np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')],maxlen=self.length)*self.length
+		frame_count_analyze=0
+		motion_reference=None
+		reused_frames=0
 
 		start_t=round((self.t-self.length/self.fps),2)
 		if start_t<0:
@@ -301,6 +333,9 @@ class AnalyzeAnimal():
 		else:
 			end_t=start_t+self.duration
 
+		frame_count=get_start_frame(self.fps,start_t)
+		capture=FrameReader(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,queue_size=self.queue_size,start_frame=frame_count)
+
 		while True:
 
 			retval,frame=capture.read()
@@ -319,12 +354,15 @@ class AnalyzeAnimal():
 					print(datetime.datetime.now())
 					self.log.append(str(datetime.datetime.now()))
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
-				temp_frames.append(frame)
+				if motion_threshold>0:
+					small_frame=downsample_gray(frame)
 
-				(contours,centers,heights,inners)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=self.animation_analyzer,channel=self.channel,kernel=self.kernel,black_background=black_background)
+				if motion_reference is not None and np.max(cv2.absdiff(small_frame,motion_reference))<motion_threshold:
+					reused_frames+=1
+				else:
+					(contours,centers,heights,inners,geometries)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=self.animation_analyzer,channel=self.channel,kernel=self.kernel,black_background=black_background,arena=self.arena)
+					if motion_threshold>0:
+						motion_reference=small_frame
 
 				if len(contours)==0:
 
@@ -333,22 +371,33 @@ class AnalyzeAnimal():
 					for i in self.animal_centers:
 						if self.include_bodyparts:
 							self.animal_inners[i].append(None)
+						if self.animation_analyzer:
+							self.animal_blobs[i].add(None,None)
 
 				else:
 
-					self.track_animal(frame_count_analyze,contours,centers,heights,inners=inners)
+					self.track_animal(frame_count_analyze,contours,centers,heights,inners=inners,geometries=geometries)
 
 					if self.animation_analyzer:
+						# only the blob of this frame is stored, the animations are generated when they are categorized
 						for i in self.animal_centers:
-							for n,f in enumerate(temp_frames):
-								contour=self.animal_contours[i][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1][n]
-								if contour is None:
-									blob=np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')
-								else:
-									blob=extract_blob_background(f,self.animal_contours[i][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],contour=contour,channel=self.channel,background_free=background_free,black_background=black_background)
-									blob=cv2.resize(blob,(self.dim_tconv,self.dim_tconv),interpolation=cv2.INTER_AREA)
-								animation.append(img_to_array(blob))
-							self.animations[i][frame_count_analyze]=np.array(animation)
+							window_contours=self.animal_contours[i][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1]
+							if window_contours[-1] is None:
+								piece=None
+							else:
+								piece=BlobPiece(frame,contours=[window_contours[-1]],channel=self.channel,background_free=background_free,black_background=black_background)
+							if all(contour is None for contour in window_contours):
+								box=None
+							else:
+								box=crop_frame(frame,window_contours)
+							self.animal_blobs[i].add(piece,box)
+
+				if not self.categorize_behavior:
+					# without categorization, no pattern image is generated from the inners of the earlier frames
+					self.release_inners(frame_count_analyze+2-self.length)
+
+				if self.single_pass:
+					self.stream_frame(frame)
 
 				frame_count_analyze+=1
 
@@ -356,14 +405,26 @@ class AnalyzeAnimal():
 
 		capture.release()
 
+		if self.animation_analyzer:
+			for i in self.animal_blobs:
+				self.animal_blobs[i].finish()
+
+		if self.single_pass:
+			self.stream_frame(final=True)
+
+		if motion_threshold>0:
+			print('Frames that reused the contours of the last contoured frame: '+str(reused_frames)+' / '+str(frame_count_analyze)+'.')
+			self.log.append('Frames that reused the contours of the last contoured frame: '+str(reused_frames)+' / '+str(frame_count_analyze)+'.')
+
 		print('Information acquisition completed!')
 		self.log.append('Information acquisition completed!')
 
 
-	def acquire_information_interact_basic(self,background_free=True,black_background=True):
+	def acquire_information_interact_basic(self,background_free=True,black_background=True,motion_threshold=0):
 
 		# background_free: whether to include background in animations
 		# black_background: whether to set background black
+		# motion_threshold: if >0, when no pixel of the 8-fold downsampled gray frame changes by this gray level or more since the last contoured frame, reuse the contours of that frame
 
 		print('Acquiring information in each frame...')
 		self.log.append('Acquiring information in each frame...')
@@ -390,11 +451,12 @@ class AnalyzeAnimal():
 			background_low=np.uint8(255-background_low)
 			background_high=np.uint8(255-background_high)
 
-		capture=cv2.VideoCapture(self.path_to_video)
-		frame_count=frame_count_analyze=0
-		temp_frames=deque(maxlen=self.length)
+		frame_count_analyze=0
+		motion_reference=None
+		reused_frames=0
 		temp_contours=deque(maxlen=self.length)
 		temp_inners=deque(maxlen=self.length)
+		temp_pieces=deque(maxlen=self.length)
 		animation=deque([np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')],maxlen=self.length)*self.length
 
 		start_t=round((self.t-self.length/self.fps),2)
@@ -405,6 +467,9 @@ class AnalyzeAnimal():
 		else:
 			end_t=start_t+self.duration
 
+		frame_count=get_start_frame(self.fps,start_t)
+		capture=FrameReader(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,queue_size=self.queue_size,start_frame=frame_count)
+
 		while True:
 
 			retval,frame=capture.read()
@@ -423,12 +488,15 @@ class AnalyzeAnimal():
 					print(datetime.datetime.now())
 					self.log.append(str(datetime.datetime.now()))
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
-				temp_frames.append(frame)
+				if motion_threshold>0:
+					small_frame=downsample_gray(frame)
 
-				(contours,centers,heights,inners)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=False,channel=self.channel,kernel=self.kernel,black_background=black_background)
+				if motion_reference is not None and np.max(cv2.absdiff(small_frame,motion_reference))<motion_threshold:
+					reused_frames+=1
+				else:
+					(contours,centers,heights,inners,geometries)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=False,channel=self.channel,kernel=self.kernel,black_background=black_background,arena=self.arena)
+					if motion_threshold>0:
+						motion_reference=small_frame
 
 				if len(contours)==0:
 
@@ -436,12 +504,16 @@ class AnalyzeAnimal():
 
 					temp_contours.append(None)
 					temp_inners.append(None)
+					if self.animation_analyzer:
+						temp_pieces.append(None)
 					animation.append(np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8'))
 
 				else:
 
 					temp_contours.append(contours)
 					temp_inners.append(inners)
+					if self.animation_analyzer:
+						temp_pieces.append(BlobPiece(frame,contours=contours,channel=self.channel,background_free=background_free,black_background=black_background))
 
 					if self.register_counts[0] is None:
 						self.register_counts[0]=frame_count_analyze
@@ -457,14 +529,15 @@ class AnalyzeAnimal():
 					self.pattern_images[0][frame_count_analyze]=np.array(cv2.resize(pattern_image,(self.dim_conv,self.dim_conv),interpolation=cv2.INTER_AREA))
 
 					if self.animation_analyzer:
-						for i,f in enumerate(temp_frames):
-							if self.animal_contours[0][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1][i] is None:
-								blob=np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')
+						for piece in temp_pieces:
+							if piece is None:
+								animation.append(img_to_array(np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')))
 							else:
-								blob=extract_blob_all(f,y_bt,y_tp,x_lf,x_rt,contours=temp_contours[i],channel=self.channel,background_free=background_free,black_background=black_background)
-							blob=cv2.resize(blob,(self.dim_tconv,self.dim_tconv),interpolation=cv2.INTER_AREA)
-							animation.append(img_to_array(blob))
-							self.animations[0][frame_count_analyze]=np.array(animation)
+								animation.append(piece.get_blob((y_bt,y_tp,x_lf,x_rt),self.dim_tconv))
+						self.animations[0][frame_count_analyze]=np.array(animation)
+
+				if self.single_pass:
+					self.stream_frame(frame)
 
 				frame_count_analyze+=1
 
@@ -472,10 +545,21 @@ class AnalyzeAnimal():
 
 		capture.release()
 
+		if self.single_pass:
+			self.stream_frame(final=True)
+
+		if motion_threshold>0:
+			print('Frames that reused the contours of the last contoured frame: '+str(reused_frames)+' / '+str(frame_count_analyze)+'.')
+			self.log.append('Frames that reused the contours of the last contoured frame: '+str(reused_frames)+' / '+str(frame_count_analyze)+'.')
+
 		self.animations[0]=self.animations[0][:len(self.all_time)]
 		self.pattern_images[0]=self.pattern_images[0][:len(self.all_time)]
 		self.animal_contours[0]=self.animal_contours[0][:len(self.all_time)]
 		self.animal_centers[0]=self.animal_centers[0][:len(self.all_time)]
+		if 0 in self.event_probability:
+			self.event_probability[0]=self.event_probability[0][:len(self.all_time)]
+			for behavior_name in self.all_behavior_parameters:
+				self.all_behavior_parameters[behavior_name]['probability'][0]=self.all_behavior_parameters[behavior_name]['probability'][0][:len(self.all_time)]
 
 		print('Information acquisition completed!')
 		self.log.append('Information acquisition completed!')
@@ -494,11 +578,7 @@ class AnalyzeAnimal():
 		IDs=list(self.animal_centers.keys())
 
 		for i in IDs:
-			check=0
-			for x in self.animal_heights[i]:
-				if x is not None:
-					check+=1
-			lengths.append(check)
+			lengths.append(self.animal_tracks[i].count())
 			if self.register_counts[i] is None:
 				to_delete.append(i)
 
@@ -509,24 +589,27 @@ class AnalyzeAnimal():
 			if i in to_delete:
 				del self.to_deregister[i]
 				del self.register_counts[i]
+				del self.animal_tracks[i]
 				del self.animal_centers[i]
 				del self.animal_existingcenters[i]
 				del self.animal_contours[i]
 				del self.animal_heights[i]
+				del self.animal_geometries[i]
 				if self.include_bodyparts:
 					del self.animal_inners[i]
 				if self.animation_analyzer:
 					del self.animal_blobs[i]
-					del self.animations[i]
-				del self.pattern_images[i]
+				if i in self.event_probability:
+					del self.event_probability[i]
+					for behavior_name in self.all_behavior_parameters:
+						del self.all_behavior_parameters[behavior_name]['probability'][i]
 
 		for i in self.animal_centers:
-			self.animal_centers[i]=self.animal_centers[i][:length]
-			self.animal_contours[i]=self.animal_contours[i][:length]
-			self.animal_heights[i]=self.animal_heights[i][:length]
-			if self.animation_analyzer:
-				self.animations[i]=self.animations[i][:length]
-			self.pattern_images[i]=self.pattern_images[i][:length]
+			self.animal_tracks[i].truncate(length)
+			if i in self.event_probability:
+				self.event_probability[i]=self.event_probability[i][:length]
+				for behavior_name in self.all_behavior_parameters:
+					self.all_behavior_parameters[behavior_name]['probability'][i]=self.all_behavior_parameters[behavior_name]['probability'][i][:length]
 
 		print('Data crafting completed!')
 		self.log.append('Data crafting completed!')
@@ -543,239 +626,435 @@ class AnalyzeAnimal():
 		print(datetime.datetime.now())
 		self.log.append(str(datetime.datetime.now()))
 
-		IDs=list(self.pattern_images.keys())
+		IDs=list(self.animal_contours.keys())
 
-		if self.animation_analyzer:
-			animations=self.animations[IDs[0]]
-		pattern_images=self.pattern_images[IDs[0]]
-
-		if len(self.pattern_images)>1:
-			for n in IDs[1:]:
-				if self.animation_analyzer:
-					animations+=self.animations[n]
-				pattern_images+=self.pattern_images[n]
-
-		del self.animations
-		del self.pattern_images
-		gc.collect()
-
-		with tf.device('CPU'):
-			if self.animation_analyzer:
-				animations=tf.convert_to_tensor(np.array(animations,dtype='float32')/255.0)
-			pattern_images=tf.convert_to_tensor(np.array(pattern_images,dtype='float32')/255.0)
-
-		if self.animation_analyzer:
-			inputs=[animations,pattern_images]
-		else:
-			inputs=pattern_images
-
-		categorizer=load_model(path_to_categorizer)
-		predictions=categorizer.predict(inputs,batch_size=32)
+		self.uncertain=uncertain
+		categorizer=load_categorizer(path_to_categorizer)
 
 		for behavior_name in self.all_behavior_parameters:
 			for i in IDs:
 				self.all_behavior_parameters[behavior_name]['probability'][i]=[np.nan]*len(self.all_time)
 				self.event_probability[i]=[['NA',-1]]*len(self.all_time)
 
-		idx=0
 		for n in IDs:
-			i=self.length+self.register_counts[n]
-			idx+=i
-			while i<len(self.animal_contours[n]):
-				if self.animal_contours[n][i] is not None:
-					check=0
-					for c in self.animal_contours[n][i-self.length+1:i+1]:
-						if c is None:
-							check+=1
-					if check<=self.length/2:
-						prediction=predictions[idx]
-						behavior_names=list(self.all_behavior_parameters.keys())
-						for behavior_name in behavior_names:
-							if len(behavior_names)==2:
-								if behavior_names.index(behavior_name)==0:
-									probability=1-prediction[0]
-								else:
-									probability=prediction[0]
-							else:
-								probability=prediction[behavior_names.index(behavior_name)]
-							self.all_behavior_parameters[behavior_name]['probability'][n][i]=probability
-						if len(behavior_names)==2:
-							if prediction[0]>0.5:
-								if prediction[0]-(1-prediction[0])>uncertain:
-									self.event_probability[n][i]=[behavior_names[1],prediction[0]]
-							if prediction[0]<0.5:
-								if (1-prediction[0])-prediction[0]>uncertain:
-									self.event_probability[n][i]=[behavior_names[0],1-prediction[0]]		
-						else:
-							if sorted(prediction)[-1]-sorted(prediction)[-2]>uncertain:
-								self.event_probability[n][i]=[behavior_names[np.argmax(prediction)],max(prediction)]
-				idx+=1
-				i+=1
+			frames=get_categorizable_frames(self.animal_contours[n],self.length+self.register_counts[n],len(self.animal_contours[n]),self.length)
+			if len(frames)>0:
+				positions=sample_frames(frames,self.categorize_stride)
+				predictions=[]
+				# the pattern images and animations are generated and categorized in chunks, so that only one chunk is in memory at a time
+				for start in range(0,len(positions),1024):
+					chunk=frames[positions[start:start+1024]]
+					pattern_images=self.get_pattern_images(n,chunk)
+					if self.animation_analyzer:
+						predictions.append(predict_in_chunks(categorizer,pattern_images,animations=self.get_animations(n,chunk)))
+					else:
+						predictions.append(predict_in_chunks(categorizer,pattern_images))
+					del pattern_images
+				self.label_behaviors(n,frames,interpolate_predictions(frames,positions,np.concatenate(predictions,axis=0)))
+				del predictions
 
-		del predictions
+		del self.animations
+		del self.pattern_images
+		self.animal_blobs={}
+		self.release_inners(len(self.all_time))
 		gc.collect()
 
 		if min_length is not None:
 			for n in IDs:
-				i=self.length+self.register_counts[n]
-				continued_length=1
-				while i<len(self.event_probability[n]):
-					if self.event_probability[n][i][0]==self.event_probability[n][i-1][0]:
-						continued_length+=1
-					else:
-						if continued_length<min_length:
-							self.event_probability[n][i-continued_length:i]=[['NA',-1]]*continued_length
-						continued_length=1
-					i+=1
+				start=self.length+self.register_counts[n]-1
+				for (run_start,run_end) in get_short_runs([event[0] for event in self.event_probability[n][start:]],min_length):
+					self.event_probability[n][start+run_start:start+run_end]=[['NA',-1]]*(run_end-run_start)
 
 		print('Behavioral categorization completed!')
 		self.log.append('Behavioral categorization completed!')
 
 
-	def annotate_video(self,behavior_to_include,show_legend=True,interact_all=False):
+	def prepare_annotation(self,behavior_to_include,show_legend=True,interact_all=False):
 
 		# behavior_to_include: behaviors that are included in the annotation
 		# show_legend: whether to show the legend of behavior names in video frames
 		# interact_all: whether is the interactive basic mode
 
-		print('Annotating video...')
-		self.log.append('Annotating video...')
-		print(datetime.datetime.now())
-		self.log.append(str(datetime.datetime.now()))
-
-		text_scl=max(0.5,round((self.background.shape[0]+self.background.shape[1])/1080,1))
-		text_tk=max(1,round((self.background.shape[0]+self.background.shape[1])/540))
+		self.show_legend=show_legend
+		self.interact_all=interact_all
+		self.text_scl=max(0.5,round((self.background.shape[0]+self.background.shape[1])/1080,1))
+		self.text_tk=max(1,round((self.background.shape[0]+self.background.shape[1])/540))
 
 		if self.categorize_behavior:
-			colors={}
+			self.colors={}
 			for behavior_name in self.all_behavior_parameters:
 				if self.all_behavior_parameters[behavior_name]['color'][1][0]!='#':
-					colors[behavior_name]=(255,255,255)
+					self.colors[behavior_name]=(255,255,255)
 				else:
 					hex_color=self.all_behavior_parameters[behavior_name]['color'][1].lstrip('#')
 					color=tuple(int(hex_color[i:i+2],16) for i in (0,2,4))
-					colors[behavior_name]=color[::-1]
+					self.colors[behavior_name]=color[::-1]
 			
 			if len(behavior_to_include)!=len(self.all_behavior_parameters):
 				for behavior_name in self.all_behavior_parameters:
 					if behavior_name not in behavior_to_include:
-						del colors[behavior_name]
+						del self.colors[behavior_name]
 			
-			if show_legend:	
-				scl=self.background.shape[0]/1024
-				if 25*(len(colors)+1)<self.background.shape[0]:
-					intvl=25
+			if self.show_legend:	
+				self.legend_scl=self.background.shape[0]/1024
+				if 25*(len(self.colors)+1)<self.background.shape[0]:
+					self.legend_intvl=25
 				else:
-					intvl=int(self.background.shape[0]/(len(colors)+1))
+					self.legend_intvl=int(self.background.shape[0]/(len(self.colors)+1))
 
-		capture=cv2.VideoCapture(self.path_to_video)
-		writer=None
-		frame_count=frame_count_analyze=index=0
+
+	def annotate_frame(self,frame,frame_count_analyze):
+
+		# frame: the frame to annotate
+		# frame_count_analyze: the analyzed frame count of the frame
+
+		text_scl=self.text_scl
+		text_tk=self.text_tk
+		interact_all=self.interact_all
+
+		if self.categorize_behavior:
+			colors=self.colors
+			if self.show_legend:
+				n=1
+				for i in colors:
+					cv2.putText(frame,i,(10,self.legend_intvl*n),cv2.FONT_HERSHEY_SIMPLEX,self.legend_scl,colors[i],text_tk)
+					n+=1
+
+		if frame_count_analyze not in self.skipped_frames:
+
+			for i in self.animal_contours:
+
+				if frame_count_analyze<len(self.animal_contours[i]):
+
+					if self.animal_contours[i][frame_count_analyze] is not None:
+
+						cx=self.animal_centers[i][frame_count_analyze][0]
+						cy=self.animal_centers[i][frame_count_analyze][1]
+
+						if interact_all is False:
+							cv2.putText(frame,str(i),(cx-10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,(255,255,255),text_tk)
+							cv2.circle(frame,(cx,cy),int(text_tk*3),(255,0,0),-1)
+
+						if self.categorize_behavior:
+							if self.event_probability[i][frame_count_analyze][0]=='NA':
+								if interact_all:
+									cv2.drawContours(frame,self.animal_contours[i][frame_count_analyze],-1,(255,255,255),1)
+								else:
+									cv2.drawContours(frame,[self.animal_contours[i][frame_count_analyze]],0,(255,255,255),1)
+								cv2.putText(frame,'NA',(cx+10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,(255,255,255),text_tk)
+							else:
+								name=self.event_probability[i][frame_count_analyze][0]
+								probability=str(round(self.event_probability[i][frame_count_analyze][1]*100))+'%'
+								if name in colors:
+									color=colors[self.event_probability[i][frame_count_analyze][0]]
+									if interact_all:
+										cv2.drawContours(frame,self.animal_contours[i][frame_count_analyze],-1,color,1)
+									else:
+										cv2.drawContours(frame,[self.animal_contours[i][frame_count_analyze]],0,color,1)
+									cv2.putText(frame,name+' '+probability,(cx+10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,color,text_tk)
+								else:
+									if interact_all:
+										cv2.drawContours(frame,self.animal_contours[i][frame_count_analyze],-1,(255,255,255),1)
+									else:
+										cv2.drawContours(frame,[self.animal_contours[i][frame_count_analyze]],0,(255,255,255),1)
+									cv2.putText(frame,'NA',(cx+10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,(255,255,255),text_tk)
+						else:
+							cv2.drawContours(frame,[self.animal_contours[i][frame_count_analyze]],0,(255,255,255),1)
+
+		if self.writer is None:
+			(h,w)=frame.shape[:2]
+			self.writer=cv2.VideoWriter(os.path.join(self.results_path,'Annotated video.avi'),cv2.VideoWriter_fourcc(*'MJPG'),self.fps,(w,h),True)
+
+		self.writer.write(frame)
+
+
+	def draw_trajectory(self):
 
 		total_animal_number=0
-		df=pd.DataFrame(self.animal_centers,index=self.all_time)
-		df.to_excel(os.path.join(self.results_path,'all_centers.xlsx'),index_label='time/ID')
 		for i in self.animal_centers:
 			total_animal_number+=1
 		if total_animal_number<=0:
 			total_animal_number=1
 		color_diff=int(510/total_animal_number)
 
-		start_t=round((self.t-self.length/self.fps),2)
-		if start_t<0:
-			start_t=0.00
-		if self.duration==0:
-			end_t=float('inf')
-		else:
-			end_t=start_t+self.duration
+		for frame_count_analyze in range(len(self.all_time)):
 
-		while True:
-			retval,frame=capture.read()
-			time=round((frame_count+1)/self.fps,2)
+			current_animal_number=0
 
-			if time>=end_t or frame is None:
-				break
+			if frame_count_analyze not in self.skipped_frames:
 
-			if time>=start_t:
+				for i in self.animal_contours:
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
+					if frame_count_analyze<len(self.animal_contours[i]):
 
-				if self.categorize_behavior:
-					if show_legend:
-						n=1
-						for i in colors:
-							cv2.putText(frame,i,(10,intvl*n),cv2.FONT_HERSHEY_SIMPLEX,scl,colors[i],text_tk)
-							n+=1
+						if self.animal_contours[i][frame_count_analyze] is not None:
 
-				current_animal_number=0
+							cx=self.animal_centers[i][frame_count_analyze][0]
+							cy=self.animal_centers[i][frame_count_analyze][1]
 
-				if frame_count_analyze not in self.skipped_frames:
+							if self.animal_centers[i][max(frame_count_analyze-1,0)] is not None:
+								cxp=self.animal_centers[i][max(frame_count_analyze-1,0)][0]
+								cyp=self.animal_centers[i][max(frame_count_analyze-1,0)][1]
+								cv2.line(self.background,(cx,cy),(cxp,cyp),(abs(int(color_diff*(total_animal_number-current_animal_number)-255)),int(color_diff*current_animal_number/2),int(color_diff*(total_animal_number-current_animal_number)/2)),int(self.text_tk))
+							else:
+								cv2.circle(self.background,(cx,cy),int(self.text_tk),(abs(int(color_diff*(total_animal_number-current_animal_number)-255)),int(color_diff*current_animal_number/2),int(color_diff*(total_animal_number-current_animal_number)/2)),-1)
 
-					for i in self.animal_contours:
+					current_animal_number+=1
 
-						if frame_count_analyze<len(self.animal_contours[i]):
+		cv2.imwrite(os.path.join(self.results_path,'Trajectory.jpg'),self.background)
 
-							if self.animal_contours[i][frame_count_analyze] is not None:
 
-								cx=self.animal_centers[i][frame_count_analyze][0]
-								cy=self.animal_centers[i][frame_count_analyze][1]
+	def prepare_single_pass(self,behavior_to_include,path_to_categorizer=None,uncertain=0,min_length=None,show_legend=True,interact_all=False,buffer_size=64):
 
-								if self.animal_centers[i][max(frame_count_analyze-1,0)] is not None:
-									cxp=self.animal_centers[i][max(frame_count_analyze-1,0)][0]
-									cyp=self.animal_centers[i][max(frame_count_analyze-1,0)][1]
-									cv2.line(self.background,(cx,cy),(cxp,cyp),(abs(int(color_diff*(total_animal_number-current_animal_number)-255)),int(color_diff*current_animal_number/2),int(color_diff*(total_animal_number-current_animal_number)/2)),int(text_tk))
-								else:
-									cv2.circle(self.background,(cx,cy),int(text_tk),(abs(int(color_diff*(total_animal_number-current_animal_number)-255)),int(color_diff*current_animal_number/2),int(color_diff*(total_animal_number-current_animal_number)/2)),-1)
+		# behavior_to_include: behaviors that are included in the annotation
+		# path_to_categorizer: path to the Categorizer, if None, just track animals
+		# uncertain: a threshold between the highest the 2nd highest probablity of behaviors to determine if output an 'NA' in behavior classification
+		# min_length: the minimum length (in frames) a behavior should last, can be used to filter out the brief false positives
+		# show_legend: whether to show the legend of behavior names in video frames
+		# interact_all: whether is the interactive basic mode
+		# buffer_size: the number of frames acquired before the pending frames are categorized and annotated
 
-								if interact_all is False:
-									cv2.putText(frame,str(i),(cx-10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,(255,255,255),text_tk)
-									cv2.circle(frame,(cx,cy),int(text_tk*3),(255,0,0),-1)
+		'''
+		In single-pass mode, the video is decoded only once: the frames are kept in a bounded buffer during
+		information acquisition and are categorized and annotated as soon as their behavior labels are final,
+		so 'categorize_behaviors' is not needed and 'annotate_video' only exports the centers and trajectory.
+		'''
 
-								if self.categorize_behavior:
-									if self.event_probability[i][frame_count_analyze][0]=='NA':
-										if interact_all:
-											cv2.drawContours(frame,self.animal_contours[i][frame_count_analyze],-1,(255,255,255),1)
-										else:
-											cv2.drawContours(frame,[self.animal_contours[i][frame_count_analyze]],0,(255,255,255),1)
-										cv2.putText(frame,'NA',(cx+10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,(255,255,255),text_tk)
-									else:
-										name=self.event_probability[i][frame_count_analyze][0]
-										probability=str(round(self.event_probability[i][frame_count_analyze][1]*100))+'%'
-										if name in colors:
-											color=colors[self.event_probability[i][frame_count_analyze][0]]
-											if interact_all:
-												cv2.drawContours(frame,self.animal_contours[i][frame_count_analyze],-1,color,1)
-											else:
-												cv2.drawContours(frame,[self.animal_contours[i][frame_count_analyze]],0,color,1)
-											cv2.putText(frame,name+' '+probability,(cx+10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,color,text_tk)
-										else:
-											if interact_all:
-												cv2.drawContours(frame,self.animal_contours[i][frame_count_analyze],-1,(255,255,255),1)
-											else:
-												cv2.drawContours(frame,[self.animal_contours[i][frame_count_analyze]],0,(255,255,255),1)
-											cv2.putText(frame,'NA',(cx+10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,(255,255,255),text_tk)
-								else:
-									cv2.drawContours(frame,[self.animal_contours[i][frame_count_analyze]],0,(255,255,255),1)
+		self.single_pass=True
+		self.prepare_annotation(behavior_to_include,show_legend=show_legend,interact_all=interact_all)
+		if path_to_categorizer is not None:
+			self.categorizer=load_categorizer(path_to_categorizer)
+		self.uncertain=uncertain
+		self.min_length=min_length
+		self.buffer_size=buffer_size
+		self.buffered_frames=deque()
+		self.categorized_count=0
+		self.annotated_count=0
+		self.continued_lengths={}
 
-						current_animal_number+=1
 
-					index+=1
+	def get_pattern_images(self,n,frames):
 
-				if writer is None:
-					(h,w)=frame.shape[:2]
-					writer=cv2.VideoWriter(os.path.join(self.results_path,'Annotated video.avi'),cv2.VideoWriter_fourcc(*'MJPG'),self.fps,(w,h),True)
+		# n: the ID of the animal
+		# frames: the analyzed frame counts
 
-				writer.write(frame)
+		'''
+		The pattern images are generated only for the frames to categorize, from the stored contours (and inners),
+		unless they were generated during the information acquisition (in interactive basic mode).
+		'''
 
-				frame_count_analyze+=1
+		if n in self.pattern_images:
+			return [self.pattern_images[n][i] for i in frames]
 
-			frame_count+=1
+		pattern_images=[]
 
-		capture.release()
-		writer.release()
+		for i in frames:
+			start=max(0,i-self.length+1)
+			if self.include_bodyparts:
+				pattern_image=generate_patternimage(self.background,self.animal_contours[n][start:i+1],inners=self.animal_inners[n][start:i+1],std=self.std)
+			else:
+				pattern_image=generate_patternimage(self.background,self.animal_contours[n][start:i+1],inners=None,std=0)
+			pattern_images.append(np.array(cv2.resize(pattern_image,(self.dim_conv,self.dim_conv),interpolation=cv2.INTER_AREA)))
 
-		cv2.imwrite(os.path.join(self.results_path,'Trajectory.jpg'),self.background)
+		return pattern_images
+
+
+	def get_animations(self,n,frames):
+
+		# n: the ID of the animal
+		# frames: the analyzed frame counts (ascending)
+
+		'''
+		The animations are generated only for the frames to categorize, from the stored blobs of each frame,
+		unless they were generated during the information acquisition (in interactive basic mode).
+		'''
+
+		if n in self.animations:
+			return [self.animations[n][i] for i in frames]
+
+		return self.animal_blobs[n].get_animations(frames)
+
+
+	def release_inners(self,start):
+
+		# start: the inners of the frames before this analyzed frame count are released
+
+		'''
+		The inners are kept per frame to generate the pattern images on demand,
+		and are released once no pattern image to be generated includes them.
+		'''
+
+		if self.include_bodyparts:
+			released=max(self.inners_released,start)
+			for n in self.animal_inners:
+				for i in range(self.inners_released,min(len(self.animal_inners[n]),released)):
+					self.animal_inners[n][i]=None
+			self.inners_released=released
+
+
+	def label_behaviors(self,n,frames,predictions):
+
+		# n: the ID of the animal
+		# frames: the analyzed frame counts to label
+		# predictions: the outputs of the Categorizer for animal n at these frames
+
+		behavior_names=list(self.all_behavior_parameters.keys())
+		(probabilities,labeled,winners)=get_behavior_probabilities(predictions,len(behavior_names),uncertain=self.uncertain)
+		frames=list(frames)
+
+		for name_index,behavior_name in enumerate(behavior_names):
+			probability=self.all_behavior_parameters[behavior_name]['probability'][n]
+			for i,p in zip(frames,probabilities[name_index]):
+				probability[i]=p
+
+		event_probability=self.event_probability[n]
+		for position in np.flatnonzero(labeled):
+			event_probability[frames[position]]=[behavior_names[winners[position]],probabilities[winners[position]][position]]
+
+
+	def categorize_frames(self,end):
+
+		# end: the frames before this analyzed frame count are categorized
+
+		# returns the analyzed frame count before which the behavior labels are final
+
+		finalized=end
+		categorized=[]
+		animations=[]
+		pattern_images=[]
+
+		for n in self.animal_contours:
+			if n not in self.event_probability:
+				for behavior_name in self.all_behavior_parameters:
+					self.all_behavior_parameters[behavior_name]['probability'][n]=[np.nan]*len(self.animal_contours[n])
+				self.event_probability[n]=[['NA',-1]]*len(self.animal_contours[n])
+			if self.register_counts[n] is not None:
+				frames=get_categorizable_frames(self.animal_contours[n],max(self.categorized_count,self.length+self.register_counts[n]),end,self.length)
+				positions=sample_frames(frames,self.categorize_stride)
+				categorized.append((n,frames,positions))
+				if self.animation_analyzer:
+					animations+=self.get_animations(n,frames[positions])
+				pattern_images+=self.get_pattern_images(n,frames[positions])
+
+		if len(pattern_images)>0:
+			if self.animation_analyzer:
+				predictions=predict_in_chunks(self.categorizer,pattern_images,animations=animations)
+			else:
+				predictions=predict_in_chunks(self.categorizer,pattern_images)
+			idx=0
+			for (n,frames,positions) in categorized:
+				self.label_behaviors(n,frames,interpolate_predictions(frames,positions,predictions[idx:idx+len(positions)]))
+				idx+=len(positions)
+
+		# only the predictions are kept: the animations and pattern images of the categorized frames are released,
+		# and so are the inners that no later pattern image includes
+		for n in self.pattern_images:
+			self.pattern_images[n][self.categorized_count:end]=[None]*(end-self.categorized_count)
+		if self.animation_analyzer:
+			for n in self.animations:
+				self.animations[n][self.categorized_count:end]=[None]*(end-self.categorized_count)
+			for n in self.animal_blobs:
+				self.animal_blobs[n].release(end-self.length+1)
+		self.release_inners(end-self.length+1)
+
+		if self.min_length is not None:
+			for n in self.animal_contours:
+				if self.register_counts[n] is not None:
+					start=self.length+self.register_counts[n]
+					i=max(self.categorized_count,start)
+					if i<end:
+						if n not in self.continued_lengths:
+							self.continued_lengths[n]=1
+						continued_length=filter_short_runs(self.event_probability[n],i,end,self.continued_lengths[n],self.min_length)
+						self.continued_lengths[n]=continued_length
+						if continued_length<self.min_length:
+							finalized=min(finalized,end-continued_length)
+
+		self.categorized_count=end
+
+		return finalized
+
+
+	def stream_frame(self,frame=None,final=False):
+
+		# frame: the newly acquired frame, which is kept in the buffer until annotated
+		# final: whether the information acquisition is completed
+
+		if frame is not None:
+			self.buffered_frames.append(frame.copy())
+
+		acquired_count=self.annotated_count+len(self.buffered_frames)
+
+		if self.categorize_behavior:
+			if acquired_count-self.categorized_count<self.buffer_size and final is False:
+				return
+			finalized=self.categorize_frames(acquired_count)
+			if final:
+				finalized=acquired_count
+		else:
+			finalized=acquired_count
+
+		while self.annotated_count<finalized:
+			self.annotate_frame(self.buffered_frames.popleft(),self.annotated_count)
+			self.annotated_count+=1
+
+		if final and self.writer is not None:
+			self.writer.release()
+			self.writer=None
+
+
+	def annotate_video(self,behavior_to_include,show_legend=True,interact_all=False):
+
+		# behavior_to_include: behaviors that are included in the annotation
+		# show_legend: whether to show the legend of behavior names in video frames
+		# interact_all: whether is the interactive basic mode
+
+		print('Annotating video...')
+		self.log.append('Annotating video...')
+		print(datetime.datetime.now())
+		self.log.append(str(datetime.datetime.now()))
+
+		df=pd.DataFrame({i:list(self.animal_centers[i]) for i in self.animal_centers},index=self.all_time)
+		df.to_excel(os.path.join(self.results_path,'all_centers.xlsx'),index_label='time/ID')
+
+		if self.single_pass is False:
+
+			self.prepare_annotation(behavior_to_include,show_legend=show_legend,interact_all=interact_all)
+
+			frame_count_analyze=0
+
+			start_t=round((self.t-self.length/self.fps),2)
+			if start_t<0:
+				start_t=0.00
+			if self.duration==0:
+				end_t=float('inf')
+			else:
+				end_t=start_t+self.duration
+
+			frame_count=get_start_frame(self.fps,start_t)
+			capture=FrameReader(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,queue_size=self.queue_size,start_frame=frame_count)
+
+			while True:
+				retval,frame=capture.read()
+				time=round((frame_count+1)/self.fps,2)
+
+				if time>=end_t or frame is None:
+					break
+
+				if time>=start_t:
+
+					self.annotate_frame(frame,frame_count_analyze)
+
+					frame_count_analyze+=1
+
+				frame_count+=1
+
+			capture.release()
+			if self.writer is not None:
+				self.writer.release()
+				self.writer=None
+
+		self.draw_trajectory()
 
 		print('Video annotation completed!')
 		self.log.append('Video annotation completed!')
@@ -921,15 +1200,15 @@ class AnalyzeAnimal():
 									cv2.drawContours(mask,[contour],0,(255,255,255),-1)
 									mask=cv2.cvtColor(mask,cv2.COLOR_BGR2GRAY)
 									area_diffs=[]
-									for ct in self.animal_contours[i][n-self.length+1:n+1]:
+									xlf1,ybt1,w,h=self.animal_geometries[i][n][3]
+									xrt1=xlf1+w
+									ytp1=ybt1+h
+									for ct,geometry in zip(self.animal_contours[i][n-self.length+1:n+1],self.animal_geometries[i][n-self.length+1:n+1]):
 										if ct is not None:
 											prev_mask=np.zeros_like(self.background)
 											cv2.drawContours(prev_mask,[ct],0,(255,255,255),-1)
 											prev_mask=cv2.cvtColor(prev_mask,cv2.COLOR_BGR2GRAY)
-											xlf1,ybt1,w,h=cv2.boundingRect(contour)
-											xrt1=xlf1+w
-											ytp1=ybt1+h
-											xlf2,ybt2,w,h=cv2.boundingRect(ct)
+											xlf2,ybt2,w,h=geometry[3]
 											xrt2=xlf2+w
 											ytp2=ybt2+h
 											xlf=min(xlf1,xlf2)
@@ -1032,15 +1311,15 @@ class AnalyzeAnimal():
 								cv2.drawContours(mask,[contour],0,(255,255,255),-1)
 								mask=cv2.cvtColor(mask,cv2.COLOR_BGR2GRAY)
 								area_diffs=[]
-								for ct in self.animal_contours[i][n-self.length+1:n+1]:
+								xlf1,ybt1,w,h=self.animal_geometries[i][n][3]
+								xrt1=xlf1+w
+								ytp1=ybt1+h
+								for ct,geometry in zip(self.animal_contours[i][n-self.length+1:n+1],self.animal_geometries[i][n-self.length+1:n+1]):
 									if ct is not None:
 										prev_mask=np.zeros_like(self.background)
 										cv2.drawContours(prev_mask,[ct],0,(255,255,255),-1)
 										prev_mask=cv2.cvtColor(prev_mask,cv2.COLOR_BGR2GRAY)
-										xlf1,ybt1,w,h=cv2.boundingRect(contour)
-										xrt1=xlf1+w
-										ytp1=ybt1+h
-										xlf2,ybt2,w,h=cv2.boundingRect(ct)
+										xlf2,ybt2,w,h=geometry[3]
 										xrt2=xlf2+w
 										ytp2=ybt2+h
 										xlf=min(xlf1,xlf2)
@@ -1188,9 +1467,11 @@ class AnalyzeAnimal():
 			background_low=np.uint8(255-background_low)
 			background_high=np.uint8(255-background_high)
 
-		capture=cv2.VideoCapture(self.path_to_video)
-		frame_count=frame_count_analyze=0
+		frame_count_analyze=0
 		temp_frames=deque(maxlen=self.length)
+		if self.include_bodyparts:
+			for i in self.animal_inners:
+				self.animal_inners[i]=deque(maxlen=self.length)
 
 		for i in range(self.animal_number):
 			os.makedirs(os.path.join(self.results_path,'examples',str(i)),exist_ok=True)
@@ -1203,6 +1484,9 @@ class AnalyzeAnimal():
 		else:
 			end_t=start_t+self.duration
 
+		frame_count=get_start_frame(self.fps,start_t)
+		capture=FrameReader(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,queue_size=self.queue_size,start_frame=frame_count)
+
 		while True:
 
 			retval,frame=capture.read()
@@ -1213,16 +1497,13 @@ class AnalyzeAnimal():
 
 			if time>=start_t:
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
 				temp_frames.append(frame)
 
-				(contours,centers,heights,inners)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=False,kernel=self.kernel,black_background=black_background)
+				(contours,centers,heights,inners,geometries)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=False,kernel=self.kernel,black_background=black_background,arena=self.arena)
 
 				if len(contours)>0:
 
-					self.track_animal(frame_count_analyze,contours,centers,heights,inners=inners)
+					self.track_animal(frame_count_analyze,contours,centers,heights,inners=inners,geometries=geometries)
 
 					if frame_count_analyze>=self.length and frame_count_analyze%skip_redundant==0:
 
@@ -1286,8 +1567,7 @@ class AnalyzeAnimal():
 			background_low=np.uint8(255-background_low)
 			background_high=np.uint8(255-background_high)
 
-		capture=cv2.VideoCapture(self.path_to_video)
-		frame_count=frame_count_analyze=0
+		frame_count_analyze=0
 		temp_frames=deque(maxlen=self.length)
 		temp_contours=deque(maxlen=self.length)
 		temp_inners=deque(maxlen=self.length)
@@ -1302,6 +1582,9 @@ class AnalyzeAnimal():
 		else:
 			end_t=start_t+self.duration
 
+		frame_count=get_start_frame(self.fps,start_t)
+		capture=FrameReader(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,queue_size=self.queue_size,start_frame=frame_count)
+
 		while True:
 
 			retval,frame=capture.read()
@@ -1312,12 +1595,9 @@ class AnalyzeAnimal():
 
 			if time>=start_t:
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
 				temp_frames.append(frame)
 
-				(contours,centers,heights,inners)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=False,kernel=self.kernel,black_background=black_background)
+				(contours,centers,heights,inners,geometries)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=False,kernel=self.kernel,black_background=black_background,arena=self.arena)
 
 				if len(contours)==0:
 
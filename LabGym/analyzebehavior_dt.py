@@ -20,7 +20,7 @@ Email: bingye@umich.edu
 
 
 from .tools import *
-from .detector import Detector
+from .detector import get_detector,DetectorWorker
 import os
 import gc
 import cv2
@@ -28,10 +28,8 @@ import torch
 import datetime
 import numpy as np
 import math
-from scipy.spatial import distance
 from collections import deque
 import tensorflow as tf
-from tensorflow.keras.models import load_model
 from tensorflow.keras.preprocessing.image import img_to_array
 import pandas as pd
 import seaborn as sb
@@ -79,7 +77,10 @@ class AnalyzeAnimalDetector():
 		self.animal_other_contours={}
 		self.animal_centers={}
 		self.animal_existingcenters={}
+		self.animal_velocities={}
+		self.animal_lastseen={}
 		self.animal_heights={}
+		self.animal_geometries={}
 		self.animal_inners={}
 		self.animal_other_inners={}
 		self.animal_blobs={}
@@ -88,6 +89,14 @@ class AnalyzeAnimalDetector():
 		self.event_probability={}
 		self.all_behavior_parameters={}
 		self.animal_present={}
+		self.single_pass=False
+		self.writer=None
+		self.queue_size=32
+		self.inference_queue_size=2
+		self.assignment_method='greedy'
+		self.motion_prediction=False
+		self.categorize_stride=1
+		self.inners_released=0
 		self.temp_frames=None
 		self.social_distance=0
 		self.log=[]
@@ -112,7 +121,12 @@ class AnalyzeAnimalDetector():
 		t=0, # start time point
 		duration=5, # the duration for example generation / analysis
 		length=15, # the duration (number of frames) of a behavior example (a behavior episode)
-		social_distance=0 # the distance to determine which two animals / objects form a interactive pair / group
+		social_distance=0, # the distance to determine which two animals / objects form a interactive pair / group
+		queue_size=32, # the maximum number of frames decoded ahead in a background thread, if <=0, decode frames in the main thread
+		inference_queue_size=2, # the maximum number of batches waiting for / after inference by the Detector in a background thread, if <=0, run the Detector in the main thread
+		assignment_method='greedy', # how to match the detected animals / objects to the tracked ones in each frame: 'greedy' (the closest pairs first), 'kdtree' (the same as 'greedy' but only sorts the nearby pairs, faster for many animals / objects), or 'hungarian' (the smallest sum of distances)
+		motion_prediction=False, # whether to match the detected animals / objects to the centers predicted from the velocities of the tracked ones (constant velocity) instead of their last seen centers, which helps keep the identities of fast-moving animals / objects
+		categorize_stride=1 # categorize every this many categorizable frames of each animal / object and interpolate the behavior probabilities of the frames in between, 1 categorizes all of them
 		):
 		
 		print('Preparation started...')
@@ -120,8 +134,7 @@ class AnalyzeAnimalDetector():
 		print(datetime.datetime.now())
 		self.log.append(str(datetime.datetime.now()))
 
-		self.detector=Detector()
-		self.detector.load(path_to_detector,animal_kinds)
+		self.detector=get_detector(path_to_detector,animal_kinds)
 		self.animal_mapping=self.detector.animal_mapping
 		self.path_to_video=path_to_video
 		self.basename=os.path.basename(self.path_to_video)
@@ -140,6 +153,12 @@ class AnalyzeAnimalDetector():
 		self.t=t
 		self.duration=duration
 		self.length=length
+		self.queue_size=queue_size
+		self.inference_queue_size=inference_queue_size
+		self.assignment_method=assignment_method
+		self.motion_prediction=motion_prediction
+		self.categorize_stride=categorize_stride
+		self.inners_released=0
 		self.social_distance=social_distance
 		if self.social_distance==0:
 			self.social_distance=float('inf')
@@ -198,7 +217,10 @@ class AnalyzeAnimalDetector():
 				self.animal_other_contours[animal_name]={}
 			self.animal_centers[animal_name]={}
 			self.animal_existingcenters[animal_name]={}
+			self.animal_velocities[animal_name]=np.zeros((self.animal_number[animal_name],2))
+			self.animal_lastseen[animal_name]=np.full(self.animal_number[animal_name],-1)
 			self.animal_heights[animal_name]={}
+			self.animal_geometries[animal_name]={}
 			self.pattern_images[animal_name]={}
 			if self.include_bodyparts:
 				self.animal_inners[animal_name]={}
@@ -216,14 +238,21 @@ class AnalyzeAnimalDetector():
 				self.animal_centers[animal_name][i]=[None]*self.total_analysis_framecount
 				self.animal_existingcenters[animal_name][i]=(-10000,-10000)
 				self.animal_heights[animal_name][i]=[None]*self.total_analysis_framecount
+				self.animal_geometries[animal_name][i]=[None]*self.total_analysis_framecount
 				if self.include_bodyparts:
-					self.animal_inners[animal_name][i]=deque(maxlen=self.length)
 					if self.behavior_mode==2:
+						self.animal_inners[animal_name][i]=deque(maxlen=self.length)
 						self.animal_other_inners[animal_name][i]=deque(maxlen=self.length)
+					else:
+						self.animal_inners[animal_name][i]=[]
 				if self.animation_analyzer:
-					self.animal_blobs[animal_name][i]=deque([np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')],maxlen=self.length)*self.length
-					self.animations[animal_name][i]=[np.zeros((self.length,self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')]*self.total_analysis_framecount
-				self.pattern_images[animal_name][i]=[np.zeros((self.dim_conv,self.dim_conv,3),dtype='uint8')]*self.total_analysis_framecount
+					if self.behavior_mode==2:
+						self.animal_blobs[animal_name][i]=np.zeros((self.total_analysis_framecount+self.length-1,self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')
+						self.animations[animal_name][i]=[np.zeros((self.length,self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')]*self.total_analysis_framecount
+					elif self.behavior_mode==0:
+						self.animal_blobs[animal_name][i]=AnimationStore(self.length,self.total_analysis_framecount,self.dim_tconv,self.channel)
+				if self.behavior_mode==2:
+					self.pattern_images[animal_name][i]=[np.zeros((self.dim_conv,self.dim_conv,3),dtype='uint8')]*self.total_analysis_framecount
 			self.animal_present[animal_name]=0
 
 		if framesize/total_number<250:
@@ -241,43 +270,39 @@ class AnalyzeAnimalDetector():
 		self.log.append('Preparation completed!')
 
 
-	def track_animal(self,frame_count_analyze,animal_name,contours,centers,heights,inners=None):
+	def track_animal(self,frame_count_analyze,animal_name,contours,centers,heights,inners=None,geometries=None):
 
 		# animal_name: the name of animals / objects that are included in the analysis
 		# contours: the contours of detected animals / objects
 		# centers: the centers of detected animals / objects
 		# heights: the heights of detected animals / objects
 		# inners: the inner contours of detected animals / objects when body parts are included in pattern images
+		# geometries: the (area,center,height,rect) of the contours of detected animals / objects
 
-		unused_existing_indices=list(self.animal_existingcenters[animal_name])
 		existing_centers=list(self.animal_existingcenters[animal_name].values())
-		unused_new_indices=list(range(len(centers)))
-		dt_flattened=distance.cdist(existing_centers,centers).flatten()
-		dt_sort_index=dt_flattened.argsort()
-		length=len(centers)
-
-		for idx in dt_sort_index:
-			index_in_existing=int(idx/length)
-			index_in_new=int(idx%length)
-			if index_in_existing in unused_existing_indices:
-				if index_in_new in unused_new_indices:
-					unused_existing_indices.remove(index_in_existing)
-					unused_new_indices.remove(index_in_new)
-					if self.register_counts[animal_name][index_in_existing] is None:
-						self.register_counts[animal_name][index_in_existing]=frame_count_analyze
-					self.to_deregister[animal_name][index_in_existing]=0
-					self.animal_contours[animal_name][index_in_existing][frame_count_analyze]=contours[index_in_new]
-					center=centers[index_in_new]
-					self.animal_centers[animal_name][index_in_existing][frame_count_analyze]=center
-					self.animal_existingcenters[animal_name][index_in_existing]=center
-					self.animal_heights[animal_name][index_in_existing][frame_count_analyze]=heights[index_in_new]
-					if self.include_bodyparts:
-						self.animal_inners[animal_name][index_in_existing].append(inners[index_in_new])
-						pattern_image=generate_patternimage(self.background,self.animal_contours[animal_name][index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],inners=self.animal_inners[animal_name][index_in_existing],std=self.std)
-					else:
-						pattern_image=generate_patternimage(self.background,self.animal_contours[animal_name][index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],inners=None,std=0)
-					pattern_image=cv2.resize(pattern_image,(self.dim_conv,self.dim_conv),interpolation=cv2.INTER_AREA)
-					self.pattern_images[animal_name][index_in_existing][frame_count_analyze]=np.array(pattern_image)
+		if self.motion_prediction:
+			missed_counts=frame_count_analyze-self.animal_lastseen[animal_name]-1
+			predicted_centers=predict_centers(existing_centers,self.animal_velocities[animal_name],missed_counts)
+		else:
+			predicted_centers=existing_centers
+		(matches,unused_existing_indices)=match_centers(predicted_centers,centers,method=self.assignment_method,radius=math.sqrt(self.animal_area[animal_name]))
+		if self.motion_prediction:
+			update_velocities(self.animal_velocities[animal_name],existing_centers,centers,matches,missed_counts)
+			self.animal_lastseen[animal_name][[index_in_existing for index_in_existing,index_in_new in matches]]=frame_count_analyze
+
+		for index_in_existing,index_in_new in matches:
+			if self.register_counts[animal_name][index_in_existing] is None:
+				self.register_counts[animal_name][index_in_existing]=frame_count_analyze
+			self.to_deregister[animal_name][index_in_existing]=0
+			self.animal_contours[animal_name][index_in_existing][frame_count_analyze]=contours[index_in_new]
+			center=centers[index_in_new]
+			self.animal_centers[animal_name][index_in_existing][frame_count_analyze]=center
+			self.animal_existingcenters[animal_name][index_in_existing]=center
+			self.animal_heights[animal_name][index_in_existing][frame_count_analyze]=heights[index_in_new]
+			if geometries is not None:
+				self.animal_geometries[animal_name][index_in_existing][frame_count_analyze]=geometries[index_in_new]
+			if self.include_bodyparts:
+				self.animal_inners[animal_name][index_in_existing].append(inners[index_in_new])
 
 		if len(unused_existing_indices)>0:
 			for i in unused_existing_indices:
@@ -289,7 +314,7 @@ class AnalyzeAnimalDetector():
 					self.animal_inners[animal_name][i].append(None)
 
 
-	def track_animal_interact(self,frame_count_analyze,contours,other_contours,centers,heights,inners=None,other_inners=None,blobs=None):
+	def track_animal_interact(self,frame_count_analyze,contours,other_contours,centers,heights,inners=None,other_inners=None,blobs=None,geometries=None):
 
 		# frame_count_analyze: the analyzed frame count
 		# contours: the contours of detected animals / objects (main character)
@@ -299,6 +324,7 @@ class AnalyzeAnimalDetector():
 		# inners: the inner contours of detected animals / objects when body parts are included in pattern images (main character)
 		# other_inners: the inner contours of detected animals / objects when body parts are included in pattern images (other characters)
 		# blobs: the blobs of detected animals / objects (main character)
+		# geometries: the (area,center,height,rect) of the contours of detected animals / objects (main character)
 
 		n=0
 
@@ -311,48 +337,52 @@ class AnalyzeAnimalDetector():
 				animal_contours=contours[n:animal_length]
 				animal_other_contours=other_contours[n:animal_length]
 				animal_heights=heights[n:animal_length]
+				if geometries is not None:
+					animal_geometries=geometries[n:animal_length]
 				if self.include_bodyparts:
 					animal_inners=inners[n:animal_length]
 					animal_other_inners=other_inners[n:animal_length]
 				if self.animation_analyzer:
 					animal_blobs=blobs[n:animal_length]
 
-				unused_existing_indices=list(self.animal_existingcenters[animal_name])
 				existing_centers=list(self.animal_existingcenters[animal_name].values())
-				unused_new_indices=list(range(len(animal_centers)))
-				dt_flattened=distance.cdist(existing_centers,animal_centers).flatten()
-				dt_sort_index=dt_flattened.argsort()
-				length=len(animal_centers)
-
-				for idx in dt_sort_index:
-					index_in_existing=int(idx/length)
-					index_in_new=int(idx%length)
-					if index_in_existing in unused_existing_indices:
-						if index_in_new in unused_new_indices:
-							unused_existing_indices.remove(index_in_existing)
-							unused_new_indices.remove(index_in_new)
-							if self.register_counts[animal_name][index_in_existing] is None:
-								self.register_counts[animal_name][index_in_existing]=frame_count_analyze
-							self.to_deregister[animal_name][index_in_existing]=0
-							contour=animal_contours[index_in_new]
-							self.animal_contours[animal_name][index_in_existing][frame_count_analyze]=contour
-							center=animal_centers[index_in_new]
-							self.animal_centers[animal_name][index_in_existing][frame_count_analyze]=center
-							self.animal_existingcenters[animal_name][index_in_existing]=center
-							self.animal_heights[animal_name][index_in_existing][frame_count_analyze]=animal_heights[index_in_new]
-							self.animal_other_contours[animal_name][index_in_existing].append(animal_other_contours[index_in_new])
-							if self.animation_analyzer:
-								blob=img_to_array(cv2.resize(animal_blobs[index_in_new],(self.dim_tconv,self.dim_tconv),interpolation=cv2.INTER_AREA))
-								self.animal_blobs[animal_name][index_in_existing].append(blob)
-								self.animations[animal_name][index_in_existing][frame_count_analyze]=np.array(self.animal_blobs[animal_name][index_in_existing])
-							if self.include_bodyparts:
-								self.animal_inners[animal_name][index_in_existing].append(animal_inners[index_in_new])
-								self.animal_other_inners[animal_name][index_in_existing].append(animal_other_inners[index_in_new])
-								pattern_image=generate_patternimage_interact(self.background,self.animal_contours[animal_name][index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],self.animal_other_contours[animal_name][index_in_existing],inners=self.animal_inners[animal_name][index_in_existing],other_inners=self.animal_other_inners[animal_name][index_in_existing],std=self.std)
-							else:
-								pattern_image=generate_patternimage_interact(self.background,self.animal_contours[animal_name][index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],self.animal_other_contours[animal_name][index_in_existing],inners=None,other_inners=None,std=0)
-							pattern_image=cv2.resize(pattern_image,(self.dim_conv,self.dim_conv),interpolation=cv2.INTER_AREA)
-							self.pattern_images[animal_name][index_in_existing][frame_count_analyze]=np.array(pattern_image)
+				if self.motion_prediction:
+					missed_counts=frame_count_analyze-self.animal_lastseen[animal_name]-1
+					predicted_centers=predict_centers(existing_centers,self.animal_velocities[animal_name],missed_counts)
+				else:
+					predicted_centers=existing_centers
+				(matches,unused_existing_indices)=match_centers(predicted_centers,animal_centers,method=self.assignment_method,radius=math.sqrt(self.animal_area[animal_name]))
+				if self.motion_prediction:
+					update_velocities(self.animal_velocities[animal_name],existing_centers,animal_centers,matches,missed_counts)
+					self.animal_lastseen[animal_name][[index_in_existing for index_in_existing,index_in_new in matches]]=frame_count_analyze
+
+				for index_in_existing,index_in_new in matches:
+					if self.register_counts[animal_name][index_in_existing] is None:
+						self.register_counts[animal_name][index_in_existing]=frame_count_analyze
+					self.to_deregister[animal_name][index_in_existing]=0
+					contour=animal_contours[index_in_new]
+					self.animal_contours[animal_name][index_in_existing][frame_count_analyze]=contour
+					center=animal_centers[index_in_new]
+					self.animal_centers[animal_name][index_in_existing][frame_count_analyze]=center
+					self.animal_existingcenters[animal_name][index_in_existing]=center
+					self.animal_heights[animal_name][index_in_existing][frame_count_analyze]=animal_heights[index_in_new]
+					if geometries is not None:
+						self.animal_geometries[animal_name][index_in_existing][frame_count_analyze]=animal_geometries[index_in_new]
+					self.animal_other_contours[animal_name][index_in_existing].append(animal_other_contours[index_in_new])
+					if self.animation_analyzer:
+						blob=cv2.resize(animal_blobs[index_in_new],(self.dim_tconv,self.dim_tconv),interpolation=cv2.INTER_AREA)
+						if self.channel==1:
+							blob=cv2.cvtColor(blob,cv2.COLOR_BGR2GRAY)
+						self.animal_blobs[animal_name][index_in_existing][frame_count_analyze+self.length-1]=blob.reshape(self.dim_tconv,self.dim_tconv,self.channel)
+						self.animations[animal_name][index_in_existing][frame_count_analyze]=self.animal_blobs[animal_name][index_in_existing][frame_count_analyze:frame_count_analyze+self.length]
+					if self.include_bodyparts:
+						self.animal_inners[animal_name][index_in_existing].append(animal_inners[index_in_new])
+						self.animal_other_inners[animal_name][index_in_existing].append(animal_other_inners[index_in_new])
+						pattern_image=generate_patternimage_interact(self.background,self.animal_contours[animal_name][index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],self.animal_other_contours[animal_name][index_in_existing],inners=self.animal_inners[animal_name][index_in_existing],other_inners=self.animal_other_inners[animal_name][index_in_existing],std=self.std)
+					else:
+						pattern_image=generate_patternimage_interact(self.background,self.animal_contours[animal_name][index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],self.animal_other_contours[animal_name][index_in_existing],inners=None,other_inners=None,std=0)
+					pattern_image=cv2.resize(pattern_image,(self.dim_conv,self.dim_conv),interpolation=cv2.INTER_AREA)
+					self.pattern_images[animal_name][index_in_existing][frame_count_analyze]=np.array(pattern_image)
 
 				if len(unused_existing_indices)>0:
 					for i in unused_existing_indices:
@@ -361,8 +391,6 @@ class AnalyzeAnimalDetector():
 						else:
 							self.animal_existingcenters[animal_name][i]=(-10000,-10000)
 						self.animal_other_contours[animal_name][i].append([None])
-						if self.animation_analyzer:
-							self.animal_blobs[animal_name][i].append(np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8'))
 						if self.include_bodyparts:
 							self.animal_inners[animal_name][i].append(None)
 							self.animal_other_inners[animal_name][i].append([None])
@@ -370,18 +398,19 @@ class AnalyzeAnimalDetector():
 				n+=self.animal_present[animal_name]
 
 
-	def detect_track_individuals(self,frames,batch_size,frame_count_analyze,background_free=True,black_background=True,animation=None):
+	def detect_track_individuals(self,frames,batch_size,frame_count_analyze,background_free=True,black_background=True,outputs=None):
 
 		# frames: frames that the Detector runs on
 		# batch_size: for batch inferencing by the Detector
 		# frame_count_analyze: the analyzed frame count
 		# background_free: whether to include background in animations
 		# black_background: whether to set background black
+		# outputs: the outputs of the Detector on frames if already inferenced (by a DetectorWorker), if None, run the Detector here
 
-		tensor_frames=[torch.as_tensor(frame.astype('float32').transpose(2,0,1)) for frame in frames]
-		inputs=[{'image':tensor_frame} for tensor_frame in tensor_frames]
-
-		outputs=self.detector.inference(inputs)
+		if outputs is None:
+			tensor_frames=[torch.as_tensor(frame.astype('float32').transpose(2,0,1)) for frame in frames]
+			inputs=[{'image':tensor_frame} for tensor_frame in tensor_frames]
+			outputs=self.detector.inference(inputs)
 
 		for batch_count,output in enumerate(outputs):
 
@@ -400,12 +429,12 @@ class AnalyzeAnimalDetector():
 					for i in self.animal_centers[animal_name]:
 						if self.include_bodyparts:
 							self.animal_inners[animal_name][i].append(None)
+						if self.animation_analyzer:
+							self.animal_blobs[animal_name][i].add(None,None)
 
 			else:
 
-				mask_area=np.sum(np.array(masks),axis=(1,2))
-				exclusion_mask=np.zeros(len(masks),dtype=bool)
-				exclusion_mask[np.where((np.sum(np.logical_and(masks[:,None],masks),axis=(2,3))/mask_area[:,None]>0.8) & (mask_area[:,None]<mask_area[None,:]))[0]]=True
+				exclusion_mask=get_exclusion_mask(masks)
 				masks=[m for m,exclude in zip(masks,exclusion_mask) if not exclude]
 				classes=[c for c,exclude in zip(classes,exclusion_mask) if not exclude]
 				classes=[self.animal_mapping[str(x)] for x in classes]
@@ -416,9 +445,12 @@ class AnalyzeAnimalDetector():
 					contours=[]
 					centers=[]
 					goodcontours=[]
+					areas=[]
 					goodmasks=[]
+					goodboxes=[]
 					heights=[]
 					inners=[]
+					geometries=[]
 
 					animal_number=int(self.animal_number[animal_name])
 					animal_masks=[masks[a] for a,name in enumerate(classes) if name==animal_name]
@@ -429,6 +461,8 @@ class AnalyzeAnimalDetector():
 						for i in self.animal_centers[animal_name]:
 							if self.include_bodyparts:
 								self.animal_inners[animal_name][i].append(None)
+							if self.animation_analyzer:
+								self.animal_blobs[animal_name][i].add(None,None)
 
 					else:
 
@@ -436,11 +470,11 @@ class AnalyzeAnimalDetector():
 							sorted_scores_indices=np.argsort(animal_scores)[-int(animal_number*2):]
 							animal_masks=[animal_masks[x] for x in sorted_scores_indices]
 						for mask in animal_masks:
-							mask=cv2.morphologyEx(mask,cv2.MORPH_CLOSE,np.ones((self.kernel,self.kernel),np.uint8))
+							(cnt,area,box)=close_mask(mask,self.kernel)
 							goodmasks.append(mask)
-							cnts,_=cv2.findContours((mask*255).astype(np.uint8),cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_NONE)
-							goodcontours.append(sorted(cnts,key=cv2.contourArea,reverse=True)[0])
-						areas=[cv2.contourArea(ct) for ct in goodcontours]
+							goodboxes.append(box)
+							goodcontours.append(cnt)
+							areas.append(area)
 						sorted_area_indices=np.argsort(np.array(areas))[-animal_number:]
 						areas_sorted=sorted(areas)[-animal_number:]
 						area=sum(areas_sorted)/len(areas_sorted)
@@ -451,41 +485,46 @@ class AnalyzeAnimalDetector():
 						for x in sorted_area_indices:
 							mask=goodmasks[x]
 							cnt=goodcontours[x]
+							geometry=get_contour_geometry(cnt,area=areas[x])
 							contours.append(cnt)
-							centers.append((int(cv2.moments(cnt)['m10']/cv2.moments(cnt)['m00']),int(cv2.moments(cnt)['m01']/cv2.moments(cnt)['m00'])))  
-							(_,_),(w,h),_=cv2.minAreaRect(cnt)
-							heights.append(max(w,h))
+							centers.append(geometry[1])
+							heights.append(geometry[2])
+							geometries.append(geometry)
 							if self.include_bodyparts:
-								masked_frame=cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)*mask
-								inners.append(get_inner(masked_frame,cnt))
+								(y_bt,y_tp,x_lf,x_rt)=goodboxes[x]
+								masked_frame=cv2.cvtColor(frame[y_bt:y_tp,x_lf:x_rt],cv2.COLOR_BGR2GRAY)*mask[y_bt:y_tp,x_lf:x_rt]
+								inners.append(get_inner(masked_frame,cnt,offset=(x_lf,y_bt)))
 
-						self.track_animal(frame_count_analyze+1-batch_size+batch_count,animal_name,contours,centers,heights,inners=inners)
+						self.track_animal(frame_count_analyze+1-batch_size+batch_count,animal_name,contours,centers,heights,inners=inners,geometries=geometries)
 						
 						if self.animation_analyzer:
+							# only the blob of this frame is stored, the animations are generated when they are categorized
 							for i in self.animal_centers[animal_name]:
-								for n,f in enumerate(self.temp_frames):
-									contour=self.animal_contours[animal_name][i][max(0,frame_count_analyze+1-batch_size+batch_count-self.length+1):frame_count_analyze+1-batch_size+batch_count+1][n]
-									if contour is None:
-										blob=np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')
-									else:
-										blob=extract_blob_background(f,self.animal_contours[animal_name][i][max(0,frame_count_analyze+1-batch_size+batch_count-self.length+1):frame_count_analyze+1-batch_size+batch_count+1],contour=contour,channel=self.channel,background_free=background_free,black_background=black_background)
-										blob=cv2.resize(blob,(self.dim_tconv,self.dim_tconv),interpolation=cv2.INTER_AREA)
-									animation.append(img_to_array(blob))
-								self.animations[animal_name][i][frame_count_analyze+1-batch_size+batch_count]=np.array(animation)
+								window_contours=self.animal_contours[animal_name][i][max(0,frame_count_analyze+1-batch_size+batch_count-self.length+1):frame_count_analyze+1-batch_size+batch_count+1]
+								if window_contours[-1] is None:
+									piece=None
+								else:
+									piece=BlobPiece(frame,contours=[window_contours[-1]],channel=self.channel,background_free=background_free,black_background=black_background)
+								if all(contour is None for contour in window_contours):
+									box=None
+								else:
+									box=crop_frame(frame,window_contours)
+								self.animal_blobs[animal_name][i].add(piece,box)
 
 
-	def detect_track_interact(self,frames,batch_size,frame_count_analyze,background_free=True,black_background=True):
+	def detect_track_interact(self,frames,batch_size,frame_count_analyze,background_free=True,black_background=True,outputs=None):
 
 		# frames: frames that the Detector runs on
 		# batch_size: for batch inferencing by the Detector
 		# frame_count_analyze: the analyzed frame count
 		# background_free: whether to include background in animations
 		# black_background: whether to set background black
+		# outputs: the outputs of the Detector on frames if already inferenced (by a DetectorWorker), if None, run the Detector here
 
-		tensor_frames=[torch.as_tensor(frame.astype('float32').transpose(2,0,1)) for frame in frames]
-		inputs=[{'image':tensor_frame} for tensor_frame in tensor_frames]
-
-		outputs=self.detector.inference(inputs)
+		if outputs is None:
+			tensor_frames=[torch.as_tensor(frame.astype('float32').transpose(2,0,1)) for frame in frames]
+			inputs=[{'image':tensor_frame} for tensor_frame in tensor_frames]
+			outputs=self.detector.inference(inputs)
 
 		for batch_count,output in enumerate(outputs):
 
@@ -503,17 +542,13 @@ class AnalyzeAnimalDetector():
 					self.animal_present[animal_name]=0
 					for i in self.animal_centers[animal_name]:
 						self.animal_other_contours[animal_name][i].append([None])
-						if self.animation_analyzer:
-							self.animal_blobs[animal_name][i].append(np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8'))
 						if self.include_bodyparts:
 							self.animal_inners[animal_name][i].append(None)
 							self.animal_other_inners[animal_name][i].append([None])
 
 			else:
 
-				mask_area=np.sum(np.array(masks),axis=(1,2))
-				exclusion_mask=np.zeros(len(masks),dtype=bool)
-				exclusion_mask[np.where((np.sum(np.logical_and(masks[:,None],masks),axis=(2,3))/mask_area[:,None]>0.8) & (mask_area[:,None]<mask_area[None,:]))[0]]=True
+				exclusion_mask=get_exclusion_mask(masks)
 				masks=[m for m,exclude in zip(masks,exclusion_mask) if not exclude]
 				classes=[c for c,exclude in zip(classes,exclusion_mask) if not exclude]
 				classes=[self.animal_mapping[str(x)] for x in classes]
@@ -524,13 +559,16 @@ class AnalyzeAnimalDetector():
 				all_contours=[]
 				all_inners=[]
 				all_heights=[]
+				all_geometries=[]
 				all_blobs=[]
 				average_area=[]
 
 				for animal_name in self.animal_kinds:
 
 					goodmasks=[]
+					goodboxes=[]
 					goodcontours=[]
+					areas=[]
 					animal_number=int(self.animal_number[animal_name])
 					animal_masks=[masks[a] for a,name in enumerate(classes) if name==animal_name]
 					animal_scores=[scores[a] for a,name in enumerate(classes) if name==animal_name]
@@ -539,8 +577,6 @@ class AnalyzeAnimalDetector():
 						self.animal_present[animal_name]=0
 						for i in self.animal_centers[animal_name]:
 							self.animal_other_contours[animal_name][i].append([None])
-							if self.animation_analyzer:
-								self.animal_blobs[animal_name][i].append(np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8'))
 							if self.include_bodyparts:
 								self.animal_inners[animal_name][i].append(None)
 								self.animal_other_inners[animal_name][i].append([None])
@@ -549,11 +585,11 @@ class AnalyzeAnimalDetector():
 							sorted_scores_indices=np.argsort(animal_scores)[-int(animal_number*2):]
 							animal_masks=[animal_masks[x] for x in sorted_scores_indices]
 						for mask in animal_masks:
-							mask=cv2.morphologyEx(mask,cv2.MORPH_CLOSE,np.ones((self.kernel,self.kernel),np.uint8))
+							(cnt,area,box)=close_mask(mask,self.kernel)
 							goodmasks.append(mask)
-							cnts,_=cv2.findContours((mask*255).astype(np.uint8),cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_NONE)
-							goodcontours.append(sorted(cnts,key=cv2.contourArea,reverse=True)[0])
-						areas=[cv2.contourArea(ct) for ct in goodcontours]
+							goodboxes.append(box)
+							goodcontours.append(cnt)
+							areas.append(area)
 						sorted_area_indices=np.argsort(np.array(areas))[-animal_number:]
 						self.animal_present[animal_name]=len(sorted_area_indices)
 						areas_sorted=sorted(areas)[-animal_number:]
@@ -567,13 +603,15 @@ class AnalyzeAnimalDetector():
 							mask=goodmasks[x]
 							all_masks.append(mask)
 							cnt=goodcontours[x]
+							geometry=get_contour_geometry(cnt,area=areas[x])
 							all_contours.append(cnt)
-							all_centers.append((int(cv2.moments(cnt)['m10']/cv2.moments(cnt)['m00']),int(cv2.moments(cnt)['m01']/cv2.moments(cnt)['m00'])))  
-							(_,_),(w,h),_=cv2.minAreaRect(cnt)
-							all_heights.append(max(w,h))
+							all_centers.append(geometry[1])
+							all_heights.append(geometry[2])
+							all_geometries.append(geometry)
 							if self.include_bodyparts:
-								masked_frame=cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)*mask
-								all_inners.append(get_inner(masked_frame,cnt))
+								(y_bt,y_tp,x_lf,x_rt)=goodboxes[x]
+								masked_frame=cv2.cvtColor(frame[y_bt:y_tp,x_lf:x_rt],cv2.COLOR_BGR2GRAY)*mask[y_bt:y_tp,x_lf:x_rt]
+								all_inners.append(get_inner(masked_frame,cnt,offset=(x_lf,y_bt)))
 
 				if len(all_centers)>1:
 
@@ -609,7 +647,7 @@ class AnalyzeAnimalDetector():
 							cv2.drawContours(blob,[contour],0,(255,0,255),2)
 							all_blobs.append(blob[y_bt:y_tp,x_lf:x_rt])
 
-					self.track_animal_interact(frame_count_analyze+1-batch_size+batch_count,all_contours,other_contours,all_centers,all_heights,inners=all_inners,other_inners=other_inners,blobs=all_blobs)
+					self.track_animal_interact(frame_count_analyze+1-batch_size+batch_count,all_contours,other_contours,all_centers,all_heights,inners=all_inners,other_inners=other_inners,blobs=all_blobs,geometries=all_geometries)
 
 				else:
 
@@ -628,7 +666,7 @@ class AnalyzeAnimalDetector():
 							blob=np.uint8(exposure.rescale_intensity(frame,out_range=(0,255)))
 						contour=all_contours[0]
 						cv2.drawContours(blob,[contour],0,(255,0,255),2)
-						x,y,w,h=cv2.boundingRect(contour)
+						x,y,w,h=all_geometries[0][3]
 						difference=int(abs(w-h)/2)+1
 						if w>h:
 							y_bt=max(y-difference-1,0)
@@ -643,7 +681,28 @@ class AnalyzeAnimalDetector():
 						blob=blob[y_bt:y_tp,x_lf:x_rt]
 						all_blobs.append(blob)
 
-						self.track_animal_interact(frame_count_analyze+1-batch_size+batch_count,all_contours,other_contours,all_centers,all_heights,inners=all_inners,other_inners=other_inners,blobs=all_blobs)
+						self.track_animal_interact(frame_count_analyze+1-batch_size+batch_count,all_contours,other_contours,all_centers,all_heights,inners=all_inners,other_inners=other_inners,blobs=all_blobs,geometries=all_geometries)
+
+
+	def process_detections(self,result,batch_size,background_free=True,black_background=True):
+
+		# result: (frames,frame_count_analyze,outputs) returned by a DetectorWorker
+		# batch_size: for batch inferencing by the Detector
+		# background_free: whether to include background in animations
+		# black_background: whether to set background black
+
+		(frames,frame_count_analyze,outputs)=result
+
+		if self.behavior_mode==2:
+			self.detect_track_interact(frames,batch_size,frame_count_analyze,background_free=background_free,black_background=black_background,outputs=outputs)
+		else:
+			self.detect_track_individuals(frames,batch_size,frame_count_analyze,background_free=background_free,black_background=black_background,outputs=outputs)
+			if not self.categorize_behavior:
+				# without categorization, no pattern image is generated from the inners of the earlier frames
+				self.release_inners(frame_count_analyze+2-self.length)
+		if self.single_pass:
+			for f in frames:
+				self.stream_frame(f)
 
 
 	def acquire_information(self,batch_size=1,background_free=True,black_background=True):
@@ -657,10 +716,9 @@ class AnalyzeAnimalDetector():
 		print(datetime.datetime.now())
 		self.log.append(str(datetime.datetime.now()))
 
-		capture=cv2.VideoCapture(self.path_to_video)
 		batch=[]
-		batch_count=frame_count=frame_count_analyze=0
-		animation=deque([np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')],maxlen=self.length)*self.length
+		batch_count=frame_count_analyze=0
+		pending_batches=0
 
 		start_t=round((self.t-self.length/self.fps),2)
 		if start_t<0:
@@ -670,43 +728,64 @@ class AnalyzeAnimalDetector():
 		else:
 			end_t=start_t+self.duration
 
-		while True:
+		frame_count=get_start_frame(self.fps,start_t)
+		capture=FrameReader(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,queue_size=self.queue_size,start_frame=frame_count)
+		worker=DetectorWorker(self.detector,queue_size=self.inference_queue_size)
 
-			retval,frame=capture.read()
-			time=round((frame_count+1)/self.fps,2)
+		try:
 
-			if time>=end_t or frame is None:
-				break
+			while True:
 
-			if time>=start_t:
-
-				self.all_time.append(round((time-start_t),2))
-				
-				if (frame_count_analyze+1)%1000==0:
-					print(str(frame_count_analyze+1)+' frames processed...')
-					self.log.append(str(frame_count_analyze+1)+' frames processed...')
-					print(datetime.datetime.now())
-					self.log.append(str(datetime.datetime.now()))
+				retval,frame=capture.read()
+				time=round((frame_count+1)/self.fps,2)
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
+				if time>=end_t or frame is None:
+					break
 
-				batch.append(frame)
-				batch_count+=1
+				if time>=start_t:
 
-				if batch_count==batch_size:
-					batch_count=0
-					if self.behavior_mode==2:
-						self.detect_track_interact(batch,batch_size,frame_count_analyze,background_free=background_free,black_background=black_background)
-					else:
-						self.detect_track_individuals(batch,batch_size,frame_count_analyze,background_free=background_free,black_background=black_background,animation=animation)
-					batch=[]
-
-				frame_count_analyze+=1
-
-			frame_count+=1
+					self.all_time.append(round((time-start_t),2))
+					
+					if (frame_count_analyze+1)%1000==0:
+						print(str(frame_count_analyze+1)+' frames processed...')
+						self.log.append(str(frame_count_analyze+1)+' frames processed...')
+						print(datetime.datetime.now())
+						self.log.append(str(datetime.datetime.now()))
+
+					batch.append(frame)
+					batch_count+=1
+
+					if batch_count==batch_size:
+						batch_count=0
+						worker.submit(batch,frame_count_analyze)
+						pending_batches+=1
+						batch=[]
+						# post-process the oldest batch while the Detector runs on the newer ones
+						if pending_batches>max(1,self.inference_queue_size):
+							self.process_detections(worker.get(),batch_size,background_free=background_free,black_background=black_background)
+							pending_batches-=1
+
+					frame_count_analyze+=1
+
+				frame_count+=1
+
+			while pending_batches>0:
+				self.process_detections(worker.get(),batch_size,background_free=background_free,black_background=black_background)
+				pending_batches-=1
+
+		finally:
+			capture.release()
+			worker.release()
+
+		if self.animation_analyzer and self.behavior_mode==0:
+			for animal_name in self.animal_kinds:
+				for i in self.animal_blobs[animal_name]:
+					self.animal_blobs[animal_name][i].finish()
 
-		capture.release()
+		if self.single_pass:
+			for f in batch:
+				self.stream_frame(f)
+			self.stream_frame(final=True)
 
 		for animal_name in self.animal_kinds:
 			print('The area of '+str(animal_name)+' is: '+str(self.animal_area[animal_name])+'.')
@@ -744,11 +823,11 @@ class AnalyzeAnimalDetector():
 		self.animal_centers[name]={}
 		self.animal_centers[name][0]=[None]*self.total_analysis_framecount
 
-		capture=cv2.VideoCapture(self.path_to_video)
 		batch=[]
-		batch_count=frame_count=frame_count_analyze=0
+		batch_count=frame_count_analyze=0
 		temp_contours=deque(maxlen=self.length)
 		temp_inners=deque(maxlen=self.length)
+		temp_pieces=deque(maxlen=self.length)
 		animation=deque([np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')],maxlen=self.length)*self.length
 
 		start_t=round((self.t-self.length/self.fps),2)
@@ -759,6 +838,9 @@ class AnalyzeAnimalDetector():
 		else:
 			end_t=start_t+self.duration
 
+		frame_count=get_start_frame(self.fps,start_t)
+		capture=FrameReader(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,queue_size=self.queue_size,start_frame=frame_count)
+
 		while True:
 
 			retval,frame=capture.read()
@@ -777,9 +859,6 @@ class AnalyzeAnimalDetector():
 					print(datetime.datetime.now())
 					self.log.append(str(datetime.datetime.now()))
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
 				batch.append(frame)
 				batch_count+=1
 
@@ -793,7 +872,6 @@ class AnalyzeAnimalDetector():
 					for batch_count,output in enumerate(outputs):
 
 						frame=batch[batch_count]
-						self.temp_frames.append(frame)
 						instances=outputs[batch_count]['instances'].to('cpu')
 						masks=instances.pred_masks.numpy().astype(np.uint8)
 						classes=instances.pred_classes.numpy()
@@ -805,6 +883,8 @@ class AnalyzeAnimalDetector():
 
 							temp_contours.append(None)
 							temp_inners.append(None)
+							if self.animation_analyzer:
+								temp_pieces.append(None)
 							animation.append(np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8'))
 
 						else:
@@ -812,9 +892,7 @@ class AnalyzeAnimalDetector():
 							if self.register_counts[name][0] is None:
 								self.register_counts[name][0]=frame_count_analyze+1-batch_size+batch_count
 
-							mask_area=np.sum(np.array(masks),axis=(1,2))
-							exclusion_mask=np.zeros(len(masks),dtype=bool)
-							exclusion_mask[np.where((np.sum(np.logical_and(masks[:,None],masks),axis=(2,3))/mask_area[:,None]>0.8) & (mask_area[:,None]<mask_area[None,:]))[0]]=True
+							exclusion_mask=get_exclusion_mask(masks)
 							masks=[m for m,exclude in zip(masks,exclusion_mask) if not exclude]
 							classes=[c for c,exclude in zip(classes,exclusion_mask) if not exclude]
 							classes=[self.animal_mapping[str(x)] for x in classes]
@@ -825,7 +903,9 @@ class AnalyzeAnimalDetector():
 
 							for animal_name in self.animal_kinds:
 								goodcontours=[]
+								areas=[]
 								goodmasks=[]
+								goodboxes=[]
 								animal_number=int(self.animal_number[animal_name])
 								animal_masks=[masks[a] for a,n in enumerate(classes) if n==animal_name]
 								animal_scores=[scores[a] for a,n in enumerate(classes) if n==animal_name]
@@ -834,24 +914,27 @@ class AnalyzeAnimalDetector():
 										sorted_scores_indices=np.argsort(animal_scores)[-int(animal_number*2):]
 										animal_masks=[animal_masks[x] for x in sorted_scores_indices]
 									for mask in animal_masks:
-										mask=cv2.morphologyEx(mask,cv2.MORPH_CLOSE,np.ones((self.kernel,self.kernel),np.uint8))
-										cnts,_=cv2.findContours((mask*255).astype(np.uint8),cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_NONE)
-										goodcontours.append(sorted(cnts,key=cv2.contourArea,reverse=True)[0])
+										(cnt,area,box)=close_mask(mask,self.kernel)
+										goodcontours.append(cnt)
+										areas.append(area)
 										goodmasks.append(mask)
-									areas=[cv2.contourArea(ct) for ct in goodcontours]
+										goodboxes.append(box)
 									sorted_area_indices=np.argsort(np.array(areas))[-animal_number:]
 									for x in sorted_area_indices:
 										cnt=goodcontours[x]
 										mask=goodmasks[x]
 										contours.append(cnt)
 										if self.include_bodyparts:
-											masked_frame=cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)*mask
-											inners.append(get_inner(masked_frame,cnt))
+											(y_bt,y_tp,x_lf,x_rt)=goodboxes[x]
+											masked_frame=cv2.cvtColor(frame[y_bt:y_tp,x_lf:x_rt],cv2.COLOR_BGR2GRAY)*mask[y_bt:y_tp,x_lf:x_rt]
+											inners.append(get_inner(masked_frame,cnt,offset=(x_lf,y_bt)))
 
 							self.animal_contours[name][0][frame_count_analyze+1-batch_size+batch_count]=contours
 
 							temp_contours.append(contours)
 							temp_inners.append(inners)
+							if self.animation_analyzer:
+								temp_pieces.append(BlobPiece(frame,contours=contours,channel=self.channel,background_free=background_free,black_background=black_background))
 							(y_bt,y_tp,x_lf,x_rt)=crop_frame(frame,functools.reduce(operator.iconcat,[ct for ct in temp_contours if ct is not None],[]))
 
 							self.animal_centers[name][0][frame_count_analyze+1-batch_size+batch_count]=(x_lf+20,y_bt+10)
@@ -862,15 +945,16 @@ class AnalyzeAnimalDetector():
 								pattern_image=generate_patternimage_all(frame,y_bt,y_tp,x_lf,x_rt,[ct for ct in temp_contours if ct is not None],None,std=0)
 							self.pattern_images[name][0][frame_count_analyze+1-batch_size+batch_count]=np.array(cv2.resize(pattern_image,(self.dim_conv,self.dim_conv),interpolation=cv2.INTER_AREA))
 							if self.animation_analyzer:
-								for i,f in enumerate(self.temp_frames):
-									if self.animal_contours[name][0][max(0,frame_count_analyze+1-batch_size+batch_count-self.length+1):frame_count_analyze+1-batch_size+batch_count+1][i] is None:
-										blob=np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')
+								for piece in temp_pieces:
+									if piece is None:
+										animation.append(img_to_array(np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')))
 									else:
-										blob=extract_blob_all(f,y_bt,y_tp,x_lf,x_rt,contours=temp_contours[i],channel=self.channel,background_free=background_free,black_background=black_background)
-										blob=cv2.resize(blob,(self.dim_tconv,self.dim_tconv),interpolation=cv2.INTER_AREA)
-									animation.append(img_to_array(blob))
-									self.animations[name][0][frame_count_analyze+1-batch_size+batch_count]=np.array(animation)
-					
+										animation.append(piece.get_blob((y_bt,y_tp,x_lf,x_rt),self.dim_tconv))
+								self.animations[name][0][frame_count_analyze+1-batch_size+batch_count]=np.array(animation)
+
+					if self.single_pass:
+						for f in batch:
+							self.stream_frame(f)
 					batch=[]
 					batch_count=0
 
@@ -880,11 +964,20 @@ class AnalyzeAnimalDetector():
 
 		capture.release()
 
+		if self.single_pass:
+			for f in batch:
+				self.stream_frame(f)
+			self.stream_frame(final=True)
+
 		length=len(self.all_time)
 		self.animations[name][0]=self.animations[name][0][:length]
 		self.pattern_images[name][0]=self.pattern_images[name][0][:length]
 		self.animal_contours[name][0]=self.animal_contours[name][0][:length]
 		self.animal_centers[name][0]=self.animal_centers[name][0][:length]
+		if self.categorize_behavior and 0 in self.event_probability[name]:
+			self.event_probability[name][0]=self.event_probability[name][0][:length]
+			for behavior_name in self.all_behavior_parameters[name]:
+				self.all_behavior_parameters[name][behavior_name]['probability'][0]=self.all_behavior_parameters[name][behavior_name]['probability'][0][:length]
 		
 		print('Information acquisition completed!')
 		self.log.append('Information acquisition completed!')
@@ -926,22 +1019,35 @@ class AnalyzeAnimalDetector():
 					if self.behavior_mode==2:
 						del self.animal_other_contours[animal_name][i]
 					del self.animal_heights[animal_name][i]
+					del self.animal_geometries[animal_name][i]
 					if self.include_bodyparts:
 						del self.animal_inners[animal_name][i]
 						if self.behavior_mode==2:
 							del self.animal_other_inners[animal_name][i]
 					if self.animation_analyzer:
 						del self.animal_blobs[animal_name][i]
-						del self.animations[animal_name][i]
-					del self.pattern_images[animal_name][i]
+						if self.behavior_mode==2:
+							del self.animations[animal_name][i]
+					if self.behavior_mode==2:
+						del self.pattern_images[animal_name][i]
+					if self.categorize_behavior and i in self.event_probability[animal_name]:
+						del self.event_probability[animal_name][i]
+						for behavior_name in self.all_behavior_parameters[animal_name]:
+							del self.all_behavior_parameters[animal_name][behavior_name]['probability'][i]
 
 			for i in self.animal_centers[animal_name]:
 				self.animal_centers[animal_name][i]=self.animal_centers[animal_name][i][:length]
 				self.animal_contours[animal_name][i]=self.animal_contours[animal_name][i][:length]
 				self.animal_heights[animal_name][i]=self.animal_heights[animal_name][i][:length]
-				if self.animation_analyzer:
-					self.animations[animal_name][i]=self.animations[animal_name][i][:length]
-				self.pattern_images[animal_name][i]=self.pattern_images[animal_name][i][:length]
+				self.animal_geometries[animal_name][i]=self.animal_geometries[animal_name][i][:length]
+				if self.behavior_mode==2:
+					if self.animation_analyzer:
+						self.animations[animal_name][i]=self.animations[animal_name][i][:length]
+					self.pattern_images[animal_name][i]=self.pattern_images[animal_name][i][:length]
+				if self.categorize_behavior and i in self.event_probability[animal_name]:
+					self.event_probability[animal_name][i]=self.event_probability[animal_name][i][:length]
+					for behavior_name in self.all_behavior_parameters[animal_name]:
+						self.all_behavior_parameters[animal_name][behavior_name]['probability'][i]=self.all_behavior_parameters[animal_name][behavior_name]['probability'][i][:length]
 
 		print('Data crafting completed!')
 		self.log.append('Data crafting completed!')
@@ -958,98 +1064,52 @@ class AnalyzeAnimalDetector():
 		print(datetime.datetime.now())
 		self.log.append(str(datetime.datetime.now()))
 
-		categorizer=load_model(path_to_categorizer)
+		self.uncertain=uncertain
+		categorizer=load_categorizer(path_to_categorizer)
 
 		if self.behavior_mode==1:
 			self.animal_kinds=[self.animal_kinds[0]]
 
 		for animal_name in self.animal_kinds:
 
-			IDs=list(self.pattern_images[animal_name].keys())
-
-			if self.animation_analyzer:
-				animations=self.animations[animal_name][IDs[0]]
-			pattern_images=self.pattern_images[animal_name][IDs[0]]
-
-			if len(self.pattern_images[animal_name])>1:
-				for n in IDs[1:]:
-					if self.animation_analyzer:
-						animations+=self.animations[animal_name][n]
-					pattern_images+=self.pattern_images[animal_name][n]
-
-			if self.animation_analyzer:
-				del self.animations[animal_name]
-			del self.pattern_images[animal_name]
-			gc.collect()
-
-			with tf.device('CPU'):
-				if self.animation_analyzer:
-					animations=tf.convert_to_tensor(np.array(animations,dtype='float32')/255.0)
-				pattern_images=tf.convert_to_tensor(np.array(pattern_images,dtype='float32')/255.0)
-
-			if self.animation_analyzer:
-				inputs=[animations,pattern_images]
-			else:
-				inputs=pattern_images
-
-			predictions=categorizer.predict(inputs,batch_size=32)
+			IDs=list(self.animal_contours[animal_name].keys())
 
 			for behavior_name in self.all_behavior_parameters[animal_name]:
 				for i in IDs:
 					self.all_behavior_parameters[animal_name][behavior_name]['probability'][i]=[np.nan]*len(self.all_time)
 					self.event_probability[animal_name][i]=[['NA',-1]]*len(self.all_time)
 
-			idx=0
 			for n in IDs:
-				i=self.length+self.register_counts[animal_name][n]
-				idx+=i
-				while i<len(self.animal_contours[animal_name][n]):
-					if self.animal_contours[animal_name][n][i] is not None:
-						check=0
-						for c in self.animal_contours[animal_name][n][i-self.length+1:i+1]:
-							if c is None:
-								check+=1
-						if check<=self.length/2:
-							prediction=predictions[idx]
-							behavior_names=list(self.all_behavior_parameters[animal_name].keys())
-							for name_index,behavior_name in enumerate(behavior_names):
-								if len(behavior_names)==2:
-									if name_index==0:
-										probability=1-prediction[0]
-									else:
-										probability=prediction[0]
-								else:
-									probability=prediction[name_index]
-								self.all_behavior_parameters[animal_name][behavior_name]['probability'][n][i]=probability
-							if len(behavior_names)==2:
-								if prediction[0]>0.5:
-									if prediction[0]-(1-prediction[0])>uncertain:
-										self.event_probability[animal_name][n][i]=[behavior_names[1],prediction[0]]
-								if prediction[0]<0.5:
-									if (1-prediction[0])-prediction[0]>uncertain:
-										self.event_probability[animal_name][n][i]=[behavior_names[0],1-prediction[0]]
-							else:
-								if sorted(prediction)[-1]-sorted(prediction)[-2]>uncertain:
-									self.event_probability[animal_name][n][i]=[behavior_names[np.argmax(prediction)],max(prediction)]
-					idx+=1
-					i+=1
+				frames=get_categorizable_frames(self.animal_contours[animal_name][n],self.length+self.register_counts[animal_name][n],len(self.animal_contours[animal_name][n]),self.length)
+				if len(frames)>0:
+					positions=sample_frames(frames,self.categorize_stride)
+					predictions=[]
+					# the pattern images and animations are generated and categorized in chunks, so that only one chunk is in memory at a time
+					for start in range(0,len(positions),1024):
+						chunk=frames[positions[start:start+1024]]
+						pattern_images=self.get_pattern_images(animal_name,n,chunk)
+						if self.animation_analyzer:
+							predictions.append(predict_in_chunks(categorizer,pattern_images,animations=self.get_animations(animal_name,n,chunk)))
+						else:
+							predictions.append(predict_in_chunks(categorizer,pattern_images))
+						del pattern_images
+					self.label_behaviors(animal_name,n,frames,interpolate_predictions(frames,positions,np.concatenate(predictions,axis=0)))
+					del predictions
 
-			del predictions
+			if self.animation_analyzer:
+				del self.animations[animal_name]
+				self.animal_blobs[animal_name]={}
+			del self.pattern_images[animal_name]
 			gc.collect()
 
+		self.release_inners(len(self.all_time))
+
 		if min_length is not None:
 			for animal_name in self.animal_kinds:
 				for n in IDs:
-					i=self.length+self.register_counts[animal_name][n]
-					continued_length=1
-					while i<len(self.event_probability[animal_name][n]):
-						if self.event_probability[animal_name][n][i][0]==self.event_probability[animal_name][n][i-1][0]:
-							continued_length+=1
-						else:
-							if continued_length<min_length:
-								self.event_probability[animal_name][n][i-continued_length:i]=[['NA',-1]]*continued_length
-							continued_length=1
-						i+=1
+					start=self.length+self.register_counts[animal_name][n]-1
+					for (run_start,run_end) in get_short_runs([event[0] for event in self.event_probability[animal_name][n][start:]],min_length):
+						self.event_probability[animal_name][n][start+run_start:start+run_end]=[['NA',-1]]*(run_end-run_start)
 
 		print('Behavioral categorization completed!')
 		self.log.append('Behavioral categorization completed!')
@@ -1088,6 +1148,9 @@ class AnalyzeAnimalDetector():
 									temp=self.animal_heights[animal_name][ID][idx]
 									self.animal_heights[animal_name][ID][idx]=self.animal_heights[animal_name][i][idx]
 									self.animal_heights[animal_name][i][idx]=temp
+									temp=self.animal_geometries[animal_name][ID][idx]
+									self.animal_geometries[animal_name][ID][idx]=self.animal_geometries[animal_name][i][idx]
+									self.animal_geometries[animal_name][i][idx]=temp
 									temp=self.event_probability[animal_name][ID][idx]
 									self.event_probability[animal_name][ID][idx]=self.event_probability[animal_name][i][idx]
 									self.event_probability[animal_name][i][idx]=temp
@@ -1099,160 +1162,423 @@ class AnalyzeAnimalDetector():
 		self.log.append('Identity correction completed!')
 
 
-	def annotate_video(self,animal_to_include,behavior_to_include,show_legend=True):
+	def prepare_annotation(self,animal_to_include,behavior_to_include,show_legend=True):
 
 		# animal_to_include: animals / objects that are included in the annotation
 		# behavior_to_include: behaviors that are included in the annotation
 		# show_legend: whether to show the legend of behavior names in video frames
 
-		print('Annotating video...')
-		self.log.append('Annotating video...')
-		print(datetime.datetime.now())
-		self.log.append(str(datetime.datetime.now()))
-
-		text_scl=max(0.5,round((self.background.shape[0]+self.background.shape[1])/1080,1))
-		text_tk=max(1,round((self.background.shape[0]+self.background.shape[1])/540))
-		background=np.zeros_like(self.background)
-		if self.framewidth is not None:
-			background=cv2.resize(background,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
+		self.animal_to_include=animal_to_include
+		self.show_legend=show_legend
+		self.text_scl=max(0.5,round((self.background.shape[0]+self.background.shape[1])/1080,1))
+		self.text_tk=max(1,round((self.background.shape[0]+self.background.shape[1])/540))
 
 		if self.categorize_behavior:
-			colors={}
+			self.colors={}
 			for behavior_name in self.all_behavior_parameters[self.animal_kinds[0]]:
 				if self.all_behavior_parameters[self.animal_kinds[0]][behavior_name]['color'][1][0]!='#':
-					colors[behavior_name]=(255,255,255)
+					self.colors[behavior_name]=(255,255,255)
 				else:
 					hex_color=self.all_behavior_parameters[self.animal_kinds[0]][behavior_name]['color'][1].lstrip('#')
 					color=tuple(int(hex_color[i:i+2],16) for i in (0,2,4))
-					colors[behavior_name]=color[::-1]
+					self.colors[behavior_name]=color[::-1]
 			
 			if len(behavior_to_include)!=len(self.all_behavior_parameters[self.animal_kinds[0]]):
 				for behavior_name in self.all_behavior_parameters[self.animal_kinds[0]]:
 					if behavior_name not in behavior_to_include:
-						del colors[behavior_name]
+						del self.colors[behavior_name]
 			
-			if show_legend:	
-				scl=self.background.shape[0]/1024
-				if 25*(len(colors)+1)<self.background.shape[0]:
-					intvl=25
+			if self.show_legend:	
+				self.legend_scl=self.background.shape[0]/1024
+				if 25*(len(self.colors)+1)<self.background.shape[0]:
+					self.legend_intvl=25
 				else:
-					intvl=int(self.background.shape[0]/(len(colors)+1))
+					self.legend_intvl=int(self.background.shape[0]/(len(self.colors)+1))
 
-		capture=cv2.VideoCapture(self.path_to_video)
-		writer=None
-		frame_count=frame_count_analyze=0
+
+	def annotate_frame(self,frame,frame_count_analyze):
+
+		# frame: the frame to annotate
+		# frame_count_analyze: the analyzed frame count of the frame
+
+		text_scl=self.text_scl
+		text_tk=self.text_tk
+
+		if self.categorize_behavior:
+			colors=self.colors
+			if self.show_legend:
+				n=1
+				for i in colors:
+					cv2.putText(frame,i,(10,self.legend_intvl*n),cv2.FONT_HERSHEY_SIMPLEX,self.legend_scl,colors[i],text_tk)
+					n+=1
+
+		if frame_count_analyze not in self.skipped_frames:
+
+			for animal_name in self.animal_to_include:
+
+				for i in self.animal_contours[animal_name]:
+
+					if frame_count_analyze<len(self.animal_contours[animal_name][i]):
+
+						if self.animal_contours[animal_name][i][frame_count_analyze] is not None:
+
+							cx=self.animal_centers[animal_name][i][frame_count_analyze][0]
+							cy=self.animal_centers[animal_name][i][frame_count_analyze][1]
+
+							if self.behavior_mode!=1:
+								cv2.circle(frame,(cx,cy),int(text_tk*3),(255,0,0),-1)
+
+							if self.categorize_behavior:
+								if self.behavior_mode!=1:
+									cv2.putText(frame,animal_name+' '+str(i),(cx-10,cy-25),cv2.FONT_HERSHEY_SIMPLEX,text_scl,(255,255,255),text_tk)	
+								if self.event_probability[animal_name][i][frame_count_analyze][0]=='NA':
+									if self.behavior_mode==1:
+										cv2.drawContours(frame,self.animal_contours[animal_name][i][frame_count_analyze],-1,(255,255,255),1)
+									else:
+										cv2.drawContours(frame,[self.animal_contours[animal_name][i][frame_count_analyze]],0,(255,255,255),1)
+									cv2.putText(frame,'NA',(cx-10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,(255,255,255),text_tk)
+								else:
+									name=self.event_probability[animal_name][i][frame_count_analyze][0]
+									probability=str(round(self.event_probability[animal_name][i][frame_count_analyze][1]*100))+'%'
+									if name in colors:
+										color=colors[self.event_probability[animal_name][i][frame_count_analyze][0]]
+										if self.behavior_mode==1:
+											cv2.drawContours(frame,self.animal_contours[animal_name][i][frame_count_analyze],-1,color,1)
+										else:
+											cv2.drawContours(frame,[self.animal_contours[animal_name][i][frame_count_analyze]],0,color,1)
+										cv2.putText(frame,name+' '+probability,(cx-10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,color,text_tk)
+									else:
+										if self.behavior_mode==1:
+											cv2.drawContours(frame,self.animal_contours[animal_name][i][frame_count_analyze],-1,(255,255,255),1)
+										else:
+											cv2.drawContours(frame,[self.animal_contours[animal_name][i][frame_count_analyze]],0,(255,255,255),1)
+										cv2.putText(frame,'NA',(cx-10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,(255,255,255),text_tk)
+							else:
+								cv2.putText(frame,animal_name+' '+str(i),(cx-10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,(255,255,255),text_tk)
+								cv2.drawContours(frame,[self.animal_contours[animal_name][i][frame_count_analyze]],0,(255,255,255),1)
+
+		if self.writer is None:
+			(h,w)=frame.shape[:2]
+			self.writer=cv2.VideoWriter(os.path.join(self.results_path,'Annotated video.avi'),cv2.VideoWriter_fourcc(*'MJPG'),self.fps,(w,h),True)
+
+		self.writer.write(frame)
+
+
+	def draw_trajectory(self):
+
+		background=np.zeros_like(self.background)
+		if self.framewidth is not None:
+			background=cv2.resize(background,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
 
 		total_animal_number=0
 		for animal_name in self.animal_kinds:
-			df=pd.DataFrame(self.animal_centers[animal_name],index=self.all_time)
-			df.to_excel(os.path.join(self.results_path,animal_name+'_'+'all_centers.xlsx'),index_label='time/ID')
 			for i in self.animal_centers[animal_name]:
 				total_animal_number+=1
 		if total_animal_number<=0:
 			total_animal_number=1
 		color_diff=int(510/total_animal_number)
 
-		start_t=round((self.t-self.length/self.fps),2)
-		if start_t<0:
-			start_t=0.00
-		if self.duration==0:
-			end_t=float('inf')
+		for frame_count_analyze in range(len(self.all_time)):
+
+			current_animal_number=0
+
+			if frame_count_analyze not in self.skipped_frames:
+
+				for animal_name in self.animal_to_include:
+
+					for i in self.animal_contours[animal_name]:
+
+						if frame_count_analyze<len(self.animal_contours[animal_name][i]):
+
+							if self.animal_contours[animal_name][i][frame_count_analyze] is not None:
+
+								cx=self.animal_centers[animal_name][i][frame_count_analyze][0]
+								cy=self.animal_centers[animal_name][i][frame_count_analyze][1]
+
+								if self.animal_centers[animal_name][i][max(frame_count_analyze-1,0)] is not None:
+									cxp=self.animal_centers[animal_name][i][max(frame_count_analyze-1,0)][0]
+									cyp=self.animal_centers[animal_name][i][max(frame_count_analyze-1,0)][1]
+									cv2.line(self.background,(cx,cy),(cxp,cyp),(abs(int(color_diff*(total_animal_number-current_animal_number)-255)),int(color_diff*current_animal_number/2),int(color_diff*(total_animal_number-current_animal_number)/2)),int(self.text_tk))
+									cv2.line(background,(cx,cy),(cxp,cyp),(abs(int(color_diff*(total_animal_number-current_animal_number)-255)),int(color_diff*current_animal_number/2),int(color_diff*(total_animal_number-current_animal_number)/2)),int(self.text_tk))
+								else:
+									cv2.circle(self.background,(cx,cy),int(self.text_tk),(abs(int(color_diff*(total_animal_number-current_animal_number)-255)),int(color_diff*current_animal_number/2),int(color_diff*(total_animal_number-current_animal_number)/2)),-1)
+									cv2.circle(background,(cx,cy),int(self.text_tk),(abs(int(color_diff*(total_animal_number-current_animal_number)-255)),int(color_diff*current_animal_number/2),int(color_diff*(total_animal_number-current_animal_number)/2)),-1)
+
+						current_animal_number+=1
+
+		cv2.imwrite(os.path.join(self.results_path,'Trajectory_background.jpg'),self.background)
+		cv2.imwrite(os.path.join(self.results_path,'Trajectory_black.jpg'),background)
+
+
+	def prepare_single_pass(self,animal_to_include,behavior_to_include,path_to_categorizer=None,uncertain=0,min_length=None,show_legend=True,buffer_size=64):
+
+		# animal_to_include: animals / objects that are included in the annotation
+		# behavior_to_include: behaviors that are included in the annotation
+		# path_to_categorizer: path to the Categorizer, if None, just track animals
+		# uncertain: a threshold between the highest the 2nd highest probability of behaviors to determine if output an 'NA' in behavior classification
+		# min_length: the minimum length (in frames) a behavior should last, can be used to filter out the brief false positives
+		# show_legend: whether to show the legend of behavior names in video frames
+		# buffer_size: the number of frames acquired before the pending frames are categorized and annotated
+
+		'''
+		In single-pass mode, the video is decoded only once: the frames are kept in a bounded buffer during
+		information acquisition and are categorized and annotated as soon as their behavior labels are final,
+		so 'categorize_behaviors' is not needed and 'annotate_video' only exports the centers and trajectory.
+		'correct_identity' changes the labels after categorization and thus cannot be used in this mode.
+		'''
+
+		self.single_pass=True
+		self.prepare_annotation(animal_to_include,behavior_to_include,show_legend=show_legend)
+		if path_to_categorizer is not None:
+			self.categorizer=load_categorizer(path_to_categorizer)
+		self.uncertain=uncertain
+		self.min_length=min_length
+		self.buffer_size=buffer_size
+		self.buffered_frames=deque()
+		self.categorized_count=0
+		self.annotated_count=0
+		self.continued_lengths={}
+
+
+	def get_pattern_images(self,animal_name,n,frames):
+
+		# animal_name: the name of the animal / object
+		# n: the ID of the animal
+		# frames: the analyzed frame counts
+
+		'''
+		The pattern images are generated only for the frames to categorize, from the stored contours (and inners),
+		unless they were generated during the information acquisition (in interactive modes).
+		'''
+
+		if n in self.pattern_images[animal_name]:
+			return [self.pattern_images[animal_name][n][i] for i in frames]
+
+		pattern_images=[]
+
+		for i in frames:
+			start=max(0,i-self.length+1)
+			if self.include_bodyparts:
+				pattern_image=generate_patternimage(self.background,self.animal_contours[animal_name][n][start:i+1],inners=self.animal_inners[animal_name][n][start:i+1],std=self.std)
+			else:
+				pattern_image=generate_patternimage(self.background,self.animal_contours[animal_name][n][start:i+1],inners=None,std=0)
+			pattern_images.append(np.array(cv2.resize(pattern_image,(self.dim_conv,self.dim_conv),interpolation=cv2.INTER_AREA)))
+
+		return pattern_images
+
+
+	def get_animations(self,animal_name,n,frames):
+
+		# animal_name: the name of the animal / object
+		# n: the ID of the animal
+		# frames: the analyzed frame counts (ascending)
+
+		'''
+		The animations are generated only for the frames to categorize, from the stored blobs of each frame,
+		unless they were generated during the information acquisition (in interactive modes).
+		'''
+
+		if n in self.animations[animal_name]:
+			return [self.animations[animal_name][n][i] for i in frames]
+
+		return self.animal_blobs[animal_name][n].get_animations(frames)
+
+
+	def release_inners(self,start):
+
+		# start: the inners of the frames before this analyzed frame count are released
+
+		'''
+		The inners are kept per frame to generate the pattern images on demand (in non-interactive mode),
+		and are released once no pattern image to be generated includes them.
+		'''
+
+		if self.include_bodyparts and self.behavior_mode==0:
+			released=max(self.inners_released,start)
+			for animal_name in self.animal_inners:
+				for n in self.animal_inners[animal_name]:
+					for i in range(self.inners_released,min(len(self.animal_inners[animal_name][n]),released)):
+						self.animal_inners[animal_name][n][i]=None
+			self.inners_released=released
+
+
+	def label_behaviors(self,animal_name,n,frames,predictions):
+
+		# animal_name: the name of the animal / object
+		# n: the ID of the animal
+		# frames: the analyzed frame counts to label
+		# predictions: the outputs of the Categorizer for animal n at these frames
+
+		behavior_names=list(self.all_behavior_parameters[animal_name].keys())
+		(probabilities,labeled,winners)=get_behavior_probabilities(predictions,len(behavior_names),uncertain=self.uncertain)
+		frames=list(frames)
+
+		for name_index,behavior_name in enumerate(behavior_names):
+			probability=self.all_behavior_parameters[animal_name][behavior_name]['probability'][n]
+			for i,p in zip(frames,probabilities[name_index]):
+				probability[i]=p
+
+		event_probability=self.event_probability[animal_name][n]
+		for position in np.flatnonzero(labeled):
+			event_probability[frames[position]]=[behavior_names[winners[position]],probabilities[winners[position]][position]]
+
+
+	def categorize_frames(self,end):
+
+		# end: the frames before this analyzed frame count are categorized
+
+		# returns the analyzed frame count before which the behavior labels are final
+
+		finalized=end
+		categorized=[]
+		animations=[]
+		pattern_images=[]
+
+		if self.behavior_mode==1:
+			animal_kinds=[self.animal_kinds[0]]
 		else:
-			end_t=start_t+self.duration
+			animal_kinds=self.animal_kinds
+
+		for animal_name in animal_kinds:
+			for n in self.animal_contours[animal_name]:
+				if n not in self.event_probability[animal_name]:
+					for behavior_name in self.all_behavior_parameters[animal_name]:
+						self.all_behavior_parameters[animal_name][behavior_name]['probability'][n]=[np.nan]*len(self.animal_contours[animal_name][n])
+					self.event_probability[animal_name][n]=[['NA',-1]]*len(self.animal_contours[animal_name][n])
+				if self.register_counts[animal_name][n] is not None:
+					frames=get_categorizable_frames(self.animal_contours[animal_name][n],max(self.categorized_count,self.length+self.register_counts[animal_name][n]),end,self.length)
+					positions=sample_frames(frames,self.categorize_stride)
+					categorized.append((animal_name,n,frames,positions))
+					if self.animation_analyzer:
+						animations+=self.get_animations(animal_name,n,frames[positions])
+					pattern_images+=self.get_pattern_images(animal_name,n,frames[positions])
 
-		while True:
+		if len(pattern_images)>0:
+			if self.animation_analyzer:
+				predictions=predict_in_chunks(self.categorizer,pattern_images,animations=animations)
+			else:
+				predictions=predict_in_chunks(self.categorizer,pattern_images)
+			idx=0
+			for (animal_name,n,frames,positions) in categorized:
+				self.label_behaviors(animal_name,n,frames,interpolate_predictions(frames,positions,predictions[idx:idx+len(positions)]))
+				idx+=len(positions)
+
+		# only the predictions are kept: the animations and pattern images of the categorized frames are released,
+		# and so are the inners that no later pattern image includes
+		for animal_name in animal_kinds:
+			for n in self.pattern_images[animal_name]:
+				self.pattern_images[animal_name][n][self.categorized_count:end]=[None]*(end-self.categorized_count)
+			if self.animation_analyzer:
+				for n in self.animations[animal_name]:
+					self.animations[animal_name][n][self.categorized_count:end]=[None]*(end-self.categorized_count)
+				if self.behavior_mode==0:
+					for n in self.animal_blobs[animal_name]:
+						self.animal_blobs[animal_name][n].release(end-self.length+1)
+		self.release_inners(end-self.length+1)
 
-			retval,frame=capture.read()
-			time=round((frame_count+1)/self.fps,2)
+		if self.min_length is not None:
+			for animal_name in animal_kinds:
+				for n in self.animal_contours[animal_name]:
+					if self.register_counts[animal_name][n] is not None:
+						i=max(self.categorized_count,self.length+self.register_counts[animal_name][n])
+						if i<end:
+							if (animal_name,n) not in self.continued_lengths:
+								self.continued_lengths[(animal_name,n)]=1
+							continued_length=filter_short_runs(self.event_probability[animal_name][n],i,end,self.continued_lengths[(animal_name,n)],self.min_length)
+							self.continued_lengths[(animal_name,n)]=continued_length
+							if continued_length<self.min_length:
+								finalized=min(finalized,end-continued_length)
 
-			if time>=end_t or frame is None:
-				break
+		self.categorized_count=end
 
-			if time>=start_t:
+		return finalized
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
 
-				if self.categorize_behavior:
-					if show_legend:
-						n=1
-						for i in colors:
-							cv2.putText(frame,i,(10,intvl*n),cv2.FONT_HERSHEY_SIMPLEX,scl,colors[i],text_tk)
-							n+=1
+	def stream_frame(self,frame=None,final=False):
 
-				current_animal_number=0
+		# frame: the newly acquired frame, which is kept in the buffer until annotated
+		# final: whether the information acquisition is completed
 
-				if frame_count_analyze not in self.skipped_frames:
+		if frame is not None:
+			self.buffered_frames.append(frame.copy())
 
-					for animal_name in animal_to_include:
+		acquired_count=self.annotated_count+len(self.buffered_frames)
 
-						for i in self.animal_contours[animal_name]:
+		if self.categorize_behavior:
+			if acquired_count-self.categorized_count<self.buffer_size and final is False:
+				return
+			finalized=self.categorize_frames(acquired_count)
+			if final:
+				finalized=acquired_count
+		else:
+			finalized=acquired_count
 
-							if frame_count_analyze<len(self.animal_contours[animal_name][i]):
+		while self.annotated_count<finalized:
+			self.annotate_frame(self.buffered_frames.popleft(),self.annotated_count)
+			self.annotated_count+=1
 
-								if self.animal_contours[animal_name][i][frame_count_analyze] is not None:
+		if final:
+			if self.writer is not None:
+				self.writer.release()
+				self.writer=None
+			if self.categorize_behavior and self.behavior_mode==1:
+				self.animal_kinds=[self.animal_kinds[0]]
 
-									cx=self.animal_centers[animal_name][i][frame_count_analyze][0]
-									cy=self.animal_centers[animal_name][i][frame_count_analyze][1]
 
-									if self.animal_centers[animal_name][i][max(frame_count_analyze-1,0)] is not None:
-										cxp=self.animal_centers[animal_name][i][max(frame_count_analyze-1,0)][0]
-										cyp=self.animal_centers[animal_name][i][max(frame_count_analyze-1,0)][1]
-										cv2.line(self.background,(cx,cy),(cxp,cyp),(abs(int(color_diff*(total_animal_number-current_animal_number)-255)),int(color_diff*current_animal_number/2),int(color_diff*(total_animal_number-current_animal_number)/2)),int(text_tk))
-										cv2.line(background,(cx,cy),(cxp,cyp),(abs(int(color_diff*(total_animal_number-current_animal_number)-255)),int(color_diff*current_animal_number/2),int(color_diff*(total_animal_number-current_animal_number)/2)),int(text_tk))
-									else:
-										cv2.circle(self.background,(cx,cy),int(text_tk),(abs(int(color_diff*(total_animal_number-current_animal_number)-255)),int(color_diff*current_animal_number/2),int(color_diff*(total_animal_number-current_animal_number)/2)),-1)
-										cv2.circle(background,(cx,cy),int(text_tk),(abs(int(color_diff*(total_animal_number-current_animal_number)-255)),int(color_diff*current_animal_number/2),int(color_diff*(total_animal_number-current_animal_number)/2)),-1)
-
-									if self.behavior_mode!=1:
-										cv2.circle(frame,(cx,cy),int(text_tk*3),(255,0,0),-1)
-
-									if self.categorize_behavior:
-										if self.behavior_mode!=1:
-											cv2.putText(frame,animal_name+' '+str(i),(cx-10,cy-25),cv2.FONT_HERSHEY_SIMPLEX,text_scl,(255,255,255),text_tk)	
-										if self.event_probability[animal_name][i][frame_count_analyze][0]=='NA':
-											if self.behavior_mode==1:
-												cv2.drawContours(frame,self.animal_contours[animal_name][i][frame_count_analyze],-1,(255,255,255),1)
-											else:
-												cv2.drawContours(frame,[self.animal_contours[animal_name][i][frame_count_analyze]],0,(255,255,255),1)
-											cv2.putText(frame,'NA',(cx-10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,(255,255,255),text_tk)
-										else:
-											name=self.event_probability[animal_name][i][frame_count_analyze][0]
-											probability=str(round(self.event_probability[animal_name][i][frame_count_analyze][1]*100))+'%'
-											if name in colors:
-												color=colors[self.event_probability[animal_name][i][frame_count_analyze][0]]
-												if self.behavior_mode==1:
-													cv2.drawContours(frame,self.animal_contours[animal_name][i][frame_count_analyze],-1,color,1)
-												else:
-													cv2.drawContours(frame,[self.animal_contours[animal_name][i][frame_count_analyze]],0,color,1)
-												cv2.putText(frame,name+' '+probability,(cx-10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,color,text_tk)
-											else:
-												if self.behavior_mode==1:
-													cv2.drawContours(frame,self.animal_contours[animal_name][i][frame_count_analyze],-1,(255,255,255),1)
-												else:
-													cv2.drawContours(frame,[self.animal_contours[animal_name][i][frame_count_analyze]],0,(255,255,255),1)
-												cv2.putText(frame,'NA',(cx-10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,(255,255,255),text_tk)
-									else:
-										cv2.putText(frame,animal_name+' '+str(i),(cx-10,cy-10),cv2.FONT_HERSHEY_SIMPLEX,text_scl,(255,255,255),text_tk)
-										cv2.drawContours(frame,[self.animal_contours[animal_name][i][frame_count_analyze]],0,(255,255,255),1)
+	def annotate_video(self,animal_to_include,behavior_to_include,show_legend=True):
 
-							current_animal_number+=1
+		# animal_to_include: animals / objects that are included in the annotation
+		# behavior_to_include: behaviors that are included in the annotation
+		# show_legend: whether to show the legend of behavior names in video frames
 
-				if writer is None:
-					(h,w)=frame.shape[:2]
-					writer=cv2.VideoWriter(os.path.join(self.results_path,'Annotated video.avi'),cv2.VideoWriter_fourcc(*'MJPG'),self.fps,(w,h),True)
+		print('Annotating video...')
+		self.log.append('Annotating video...')
+		print(datetime.datetime.now())
+		self.log.append(str(datetime.datetime.now()))
 
-				writer.write(frame)
+		for animal_name in self.animal_kinds:
+			df=pd.DataFrame(self.animal_centers[animal_name],index=self.all_time)
+			df.to_excel(os.path.join(self.results_path,animal_name+'_'+'all_centers.xlsx'),index_label='time/ID')
 
-				frame_count_analyze+=1
+		if self.single_pass is False:
 
-			frame_count+=1
+			self.prepare_annotation(animal_to_include,behavior_to_include,show_legend=show_legend)
 
-		capture.release()
-		writer.release()
+			frame_count_analyze=0
 
-		cv2.imwrite(os.path.join(self.results_path,'Trajectory_background.jpg'),self.background)
-		cv2.imwrite(os.path.join(self.results_path,'Trajectory_black.jpg'),background)
+			start_t=round((self.t-self.length/self.fps),2)
+			if start_t<0:
+				start_t=0.00
+			if self.duration==0:
+				end_t=float('inf')
+			else:
+				end_t=start_t+self.duration
+
+			frame_count=get_start_frame(self.fps,start_t)
+			capture=FrameReader(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,queue_size=self.queue_size,start_frame=frame_count)
+
+			while True:
+
+				retval,frame=capture.read()
+				time=round((frame_count+1)/self.fps,2)
+
+				if time>=end_t or frame is None:
+					break
+
+				if time>=start_t:
+
+					self.annotate_frame(frame,frame_count_analyze)
+
+					frame_count_analyze+=1
+
+				frame_count+=1
+
+			capture.release()
+			if self.writer is not None:
+				self.writer.release()
+				self.writer=None
+
+		self.draw_trajectory()
 
 		print('Video annotation completed!')
 		self.log.append('Video annotation completed!')
@@ -1397,15 +1723,15 @@ class AnalyzeAnimalDetector():
 										cv2.drawContours(mask,[contour],0,(255,255,255),-1)
 										mask=cv2.cvtColor(mask,cv2.COLOR_BGR2GRAY)
 										area_diffs=[]
-										for ct in self.animal_contours[animal_name][i][n-self.length+1:n+1]:
+										xlf1,ybt1,w,h=self.animal_geometries[animal_name][i][n][3]
+										xrt1=xlf1+w
+										ytp1=ybt1+h
+										for ct,geometry in zip(self.animal_contours[animal_name][i][n-self.length+1:n+1],self.animal_geometries[animal_name][i][n-self.length+1:n+1]):
 											if ct is not None:
 												prev_mask=np.zeros_like(self.background)
 												cv2.drawContours(prev_mask,[ct],0,(255,255,255),-1)
 												prev_mask=cv2.cvtColor(prev_mask,cv2.COLOR_BGR2GRAY)
-												xlf1,ybt1,w,h=cv2.boundingRect(contour)
-												xrt1=xlf1+w
-												ytp1=ybt1+h
-												xlf2,ybt2,w,h=cv2.boundingRect(ct)
+												xlf2,ybt2,w,h=geometry[3]
 												xrt2=xlf2+w
 												ytp2=ybt2+h
 												xlf=min(xlf1,xlf2)
@@ -1507,15 +1833,15 @@ class AnalyzeAnimalDetector():
 									cv2.drawContours(mask,[contour],0,(255,255,255),-1)
 									mask=cv2.cvtColor(mask,cv2.COLOR_BGR2GRAY)
 									area_diffs=[]
-									for ct in self.animal_contours[animal_name][i][n-self.length+1:n+1]:
+									xlf1,ybt1,w,h=self.animal_geometries[animal_name][i][n][3]
+									xrt1=xlf1+w
+									ytp1=ybt1+h
+									for ct,geometry in zip(self.animal_contours[animal_name][i][n-self.length+1:n+1],self.animal_geometries[animal_name][i][n-self.length+1:n+1]):
 										if ct is not None:
 											prev_mask=np.zeros_like(self.background)
 											cv2.drawContours(prev_mask,[ct],0,(255,255,255),-1)
 											prev_mask=cv2.cvtColor(prev_mask,cv2.COLOR_BGR2GRAY)
-											xlf1,ybt1,w,h=cv2.boundingRect(contour)
-											xrt1=xlf1+w
-											ytp1=ybt1+h
-											xlf2,ybt2,w,h=cv2.boundingRect(ct)
+											xlf2,ybt2,w,h=geometry[3]
 											xrt2=xlf2+w
 											ytp2=ybt2+h
 											xlf=min(xlf1,xlf2)
@@ -1658,12 +1984,13 @@ class AnalyzeAnimalDetector():
 		print('Generating behavior examples...')
 		print(datetime.datetime.now())
 
-		capture=cv2.VideoCapture(self.path_to_video)
-		frame_count=frame_count_analyze=0
+		frame_count_analyze=0
 		animation=deque(maxlen=self.length)
 		for animal_name in self.animal_kinds:
 			for i in range(self.animal_number[animal_name]):
 				os.makedirs(os.path.join(self.results_path,str(animal_name)+'_'+str(i)),exist_ok=True)
+				if self.include_bodyparts:
+					self.animal_inners[animal_name][i]=deque(maxlen=self.length)
 
 		start_t=round((self.t-self.length/self.fps),2)
 		if start_t<0:
@@ -1673,6 +2000,9 @@ class AnalyzeAnimalDetector():
 		else:
 			end_t=start_t+self.duration
 
+		frame_count=get_start_frame(self.fps,start_t)
+		capture=FrameReader(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,queue_size=self.queue_size,start_frame=frame_count)
+
 		while True:
 
 			retval,frame=capture.read()
@@ -1683,10 +2013,7 @@ class AnalyzeAnimalDetector():
 
 			if time>=start_t:
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
-				self.detect_track_individuals([frame],1,frame_count_analyze,background_free=background_free,black_background=black_background,animation=animation)
+				self.detect_track_individuals([frame],1,frame_count_analyze,background_free=background_free,black_background=black_background)
 
 				for animal_name in self.animal_kinds:
 						
@@ -1744,11 +2071,10 @@ class AnalyzeAnimalDetector():
 		print('Generating behavior examples...')
 		print(datetime.datetime.now())
 
-		frame_count=frame_count_analyze=0
+		frame_count_analyze=0
 		temp_contours=deque(maxlen=self.length)
 		temp_inners=deque(maxlen=self.length)
 		animation=deque(maxlen=self.length)
-		capture=cv2.VideoCapture(self.path_to_video)
 		os.makedirs(os.path.join(self.results_path,'0'),exist_ok=True)
 
 		start_t=round((self.t-self.length/self.fps),2)
@@ -1759,6 +2085,9 @@ class AnalyzeAnimalDetector():
 		else:
 			end_t=start_t+self.duration
 
+		frame_count=get_start_frame(self.fps,start_t)
+		capture=FrameReader(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,queue_size=self.queue_size,start_frame=frame_count)
+
 		while True:
 
 			retval,frame=capture.read()
@@ -1769,9 +2098,6 @@ class AnalyzeAnimalDetector():
 
 			if time>=start_t:
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
 				self.temp_frames.append(frame)
 				tensor_frame=torch.as_tensor(frame.astype('float32').transpose(2,0,1))
 				output=self.detector.inference([{'image':tensor_frame}])
@@ -1788,9 +2114,7 @@ class AnalyzeAnimalDetector():
 
 				else:
 
-					mask_area=np.sum(np.array(masks),axis=(1,2))
-					exclusion_mask=np.zeros(len(masks),dtype=bool)
-					exclusion_mask[np.where((np.sum(np.logical_and(masks[:,None],masks),axis=(2,3))/mask_area[:,None]>0.8) & (mask_area[:,None]<mask_area[None,:]))[0]]=True
+					exclusion_mask=get_exclusion_mask(masks)
 					masks=[m for m,exclude in zip(masks,exclusion_mask) if not exclude]
 					classes=[c for c,exclude in zip(classes,exclusion_mask) if not exclude]
 					classes=[self.animal_mapping[str(x)] for x in classes]
@@ -1801,7 +2125,9 @@ class AnalyzeAnimalDetector():
 
 					for animal_name in self.animal_kinds:
 						goodcontours=[]
+						areas=[]
 						goodmasks=[]
+						goodboxes=[]
 						animal_number=int(self.animal_number[animal_name])
 						animal_masks=[masks[a] for a,name in enumerate(classes) if name==animal_name]
 						animal_scores=[scores[a] for a,name in enumerate(classes) if name==animal_name]
@@ -1810,19 +2136,20 @@ class AnalyzeAnimalDetector():
 								sorted_scores_indices=np.argsort(animal_scores)[-int(animal_number*2):]
 								animal_masks=[animal_masks[x] for x in sorted_scores_indices]
 							for mask in animal_masks:
-								mask=cv2.morphologyEx(mask,cv2.MORPH_CLOSE,np.ones((self.kernel,self.kernel),np.uint8))
-								cnts,_=cv2.findContours((mask*255).astype(np.uint8),cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_NONE)
-								goodcontours.append(sorted(cnts,key=cv2.contourArea,reverse=True)[0])
+								(cnt,area,box)=close_mask(mask,self.kernel)
+								goodcontours.append(cnt)
+								areas.append(area)
 								goodmasks.append(mask)
-							areas=[cv2.contourArea(ct) for ct in goodcontours]
+								goodboxes.append(box)
 							sorted_area_indices=np.argsort(np.array(areas))[-animal_number:]
 							for x in sorted_area_indices:
 								cnt=goodcontours[x]
 								mask=goodmasks[x]
 								contours.append(cnt)
 								if self.include_bodyparts:
-									masked_frame=cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)*mask
-									inners.append(get_inner(masked_frame,cnt))
+									(y_bt,y_tp,x_lf,x_rt)=goodboxes[x]
+									masked_frame=cv2.cvtColor(frame[y_bt:y_tp,x_lf:x_rt],cv2.COLOR_BGR2GRAY)*mask[y_bt:y_tp,x_lf:x_rt]
+									inners.append(get_inner(masked_frame,cnt,offset=(x_lf,y_bt)))
 
 					temp_contours.append(contours)
 					temp_inners.append(inners)
@@ -1880,11 +2207,12 @@ class AnalyzeAnimalDetector():
 		print('Generating behavior examples...')
 		print(datetime.datetime.now())
 
-		capture=cv2.VideoCapture(self.path_to_video)
-		frame_count=frame_count_analyze=0
+		frame_count_analyze=0
 		animation=deque(maxlen=self.length)
 		for animal_name in self.animal_kinds:
 			self.animal_blobs[animal_name]={}
+			self.animal_velocities[animal_name]=np.zeros((self.animal_number[animal_name],2))
+			self.animal_lastseen[animal_name]=np.full(self.animal_number[animal_name],-1)
 			for i in range(self.animal_number[animal_name]):
 				self.to_deregister[animal_name][i]=0
 				self.animal_contours[animal_name][i]=deque(maxlen=self.length)
@@ -1905,6 +2233,9 @@ class AnalyzeAnimalDetector():
 		else:
 			end_t=start_t+self.duration
 
+		frame_count=get_start_frame(self.fps,start_t)
+		capture=FrameReader(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,queue_size=self.queue_size,start_frame=frame_count)
+
 		while True:
 
 			retval,frame=capture.read()
@@ -1915,9 +2246,6 @@ class AnalyzeAnimalDetector():
 
 			if time>=start_t:
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
 				tensor_frame=torch.as_tensor(frame.astype('float32').transpose(2,0,1))
 				output=self.detector.inference([{'image':tensor_frame}])
 				instances=output[0]['instances'].to('cpu')
@@ -1940,9 +2268,7 @@ class AnalyzeAnimalDetector():
 
 				else:
 
-					mask_area=np.sum(np.array(masks),axis=(1,2))
-					exclusion_mask=np.zeros(len(masks),dtype=bool)
-					exclusion_mask[np.where((np.sum(np.logical_and(masks[:,None],masks),axis=(2,3))/mask_area[:,None]>0.8) & (mask_area[:,None]<mask_area[None,:]))[0]]=True
+					exclusion_mask=get_exclusion_mask(masks)
 					masks=[m for m,exclude in zip(masks,exclusion_mask) if not exclude]
 					classes=[c for c,exclude in zip(classes,exclusion_mask) if not exclude]
 					classes=[self.animal_mapping[str(x)] for x in classes]
@@ -1958,7 +2284,9 @@ class AnalyzeAnimalDetector():
 					for animal_name in self.animal_kinds:
 
 						goodmasks=[]
+						goodboxes=[]
 						goodcontours=[]
+						areas=[]
 						animal_number=int(self.animal_number[animal_name])
 						animal_masks=[masks[a] for a,name in enumerate(classes) if name==animal_name]
 						animal_scores=[scores[a] for a,name in enumerate(classes) if name==animal_name]
@@ -1978,11 +2306,11 @@ class AnalyzeAnimalDetector():
 								sorted_scores_indices=np.argsort(animal_scores)[-int(animal_number*2):]
 								animal_masks=[animal_masks[x] for x in sorted_scores_indices]
 							for mask in animal_masks:
-								mask=cv2.morphologyEx(mask,cv2.MORPH_CLOSE,np.ones((self.kernel,self.kernel),np.uint8))
+								(cnt,area,box)=close_mask(mask,self.kernel)
 								goodmasks.append(mask)
-								cnts,_=cv2.findContours((mask*255).astype(np.uint8),cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_NONE)
-								goodcontours.append(sorted(cnts,key=cv2.contourArea,reverse=True)[0])
-							areas=[cv2.contourArea(ct) for ct in goodcontours]
+								goodboxes.append(box)
+								goodcontours.append(cnt)
+								areas.append(area)
 							sorted_area_indices=np.argsort(np.array(areas))[-animal_number:]
 							self.animal_present[animal_name]=len(sorted_area_indices)
 							areas_sorted=sorted(areas)[-animal_number:]
@@ -1997,10 +2325,12 @@ class AnalyzeAnimalDetector():
 								all_masks.append(mask)
 								cnt=goodcontours[x]
 								all_contours.append(cnt)
-								all_centers.append((int(cv2.moments(cnt)['m10']/cv2.moments(cnt)['m00']),int(cv2.moments(cnt)['m01']/cv2.moments(cnt)['m00'])))
+								moments=cv2.moments(cnt)
+								all_centers.append((int(moments['m10']/moments['m00']),int(moments['m01']/moments['m00'])))
 								if self.include_bodyparts:
-									masked_frame=cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)*mask
-									all_inners.append(get_inner(masked_frame,cnt))
+									(y_bt,y_tp,x_lf,x_rt)=goodboxes[x]
+									masked_frame=cv2.cvtColor(frame[y_bt:y_tp,x_lf:x_rt],cv2.COLOR_BGR2GRAY)*mask[y_bt:y_tp,x_lf:x_rt]
+									all_inners.append(get_inner(masked_frame,cnt,offset=(x_lf,y_bt)))
 
 					if len(all_centers)>1:
 
@@ -2061,32 +2391,30 @@ class AnalyzeAnimalDetector():
 								animal_inners=all_inners[n:animal_length]
 								animal_other_inners=other_inners[n:animal_length]
 
-							unused_existing_indices=list(self.animal_existingcenters[animal_name])
 							existing_centers=list(self.animal_existingcenters[animal_name].values())
-							unused_new_indices=list(range(len(animal_centers)))
-							dt_flattened=distance.cdist(existing_centers,animal_centers).flatten()
-							dt_sort_index=dt_flattened.argsort()
-							length=len(animal_centers)
-
-							for idx in dt_sort_index:
-								index_in_existing=int(idx/length)
-								index_in_new=int(idx%length)
-								if index_in_existing in unused_existing_indices:
-									if index_in_new in unused_new_indices:
-										unused_existing_indices.remove(index_in_existing)
-										unused_new_indices.remove(index_in_new)
-										self.to_deregister[animal_name][index_in_existing]=0
-										contour=animal_contours[index_in_new]
-										self.animal_contours[animal_name][index_in_existing].append(contour)
-										center=animal_centers[index_in_new]
-										self.animal_centers[animal_name][index_in_existing].append(center)
-										self.animal_existingcenters[animal_name][index_in_existing]=center
-										self.animal_other_contours[animal_name][index_in_existing].append(animal_other_contours[index_in_new])
-
-										self.animal_blobs[animal_name][index_in_existing].append(animal_blobs[index_in_new])
-										if self.include_bodyparts:
-											self.animal_inners[animal_name][index_in_existing].append(animal_inners[index_in_new])
-											self.animal_other_inners[animal_name][index_in_existing].append(animal_other_inners[index_in_new])
+							if self.motion_prediction:
+								missed_counts=frame_count_analyze-self.animal_lastseen[animal_name]-1
+								predicted_centers=predict_centers(existing_centers,self.animal_velocities[animal_name],missed_counts)
+							else:
+								predicted_centers=existing_centers
+							(matches,unused_existing_indices)=match_centers(predicted_centers,animal_centers,method=self.assignment_method,radius=math.sqrt(self.animal_area[animal_name]))
+							if self.motion_prediction:
+								update_velocities(self.animal_velocities[animal_name],existing_centers,animal_centers,matches,missed_counts)
+								self.animal_lastseen[animal_name][[index_in_existing for index_in_existing,index_in_new in matches]]=frame_count_analyze
+
+							for index_in_existing,index_in_new in matches:
+								self.to_deregister[animal_name][index_in_existing]=0
+								contour=animal_contours[index_in_new]
+								self.animal_contours[animal_name][index_in_existing].append(contour)
+								center=animal_centers[index_in_new]
+								self.animal_centers[animal_name][index_in_existing].append(center)
+								self.animal_existingcenters[animal_name][index_in_existing]=center
+								self.animal_other_contours[animal_name][index_in_existing].append(animal_other_contours[index_in_new])
+
+								self.animal_blobs[animal_name][index_in_existing].append(animal_blobs[index_in_new])
+								if self.include_bodyparts:
+									self.animal_inners[animal_name][index_in_existing].append(animal_inners[index_in_new])
+									self.animal_other_inners[animal_name][index_in_existing].append(animal_other_inners[index_in_new])
 
 							if len(unused_existing_indices)>0:
 								for i in unused_existing_indices:
@@ -2189,8 +2517,7 @@ class AnalyzeAnimalDetector():
 		print('Preparation started...')
 		print(datetime.datetime.now())
 
-		self.detector=Detector()
-		self.detector.load(path_to_detector,animal_kinds)
+		self.detector=get_detector(path_to_detector,animal_kinds)
 		self.animal_mapping=self.detector.animal_mapping
 
 		if social_distance==0:
@@ -2201,7 +2528,7 @@ class AnalyzeAnimalDetector():
 		if generate:
 			print('Generating behavior examples...')
 		else:
-			categorizer=load_model(path_to_categorizer)
+			categorizer=load_categorizer(path_to_categorizer)
 			animal_information={}
 			colors={}
 			for behavior_name in names_and_colors:
@@ -2270,9 +2597,7 @@ class AnalyzeAnimalDetector():
 
 			if len(masks)>0:
 
-				mask_area=np.sum(np.array(masks),axis=(1,2))
-				exclusion_mask=np.zeros(len(masks),dtype=bool)
-				exclusion_mask[np.where((np.sum(np.logical_and(masks[:,None],masks),axis=(2,3))/mask_area[:,None]>0.8) & (mask_area[:,None]<mask_area[None,:]))[0]]=True
+				exclusion_mask=get_exclusion_mask(masks)
 				masks=[m for m,exclude in zip(masks,exclusion_mask) if not exclude]
 				classes=[c for c,exclude in zip(classes,exclusion_mask) if not exclude]
 				classes=[self.animal_mapping[str(x)] for x in classes]
@@ -2286,16 +2611,8 @@ class AnalyzeAnimalDetector():
 				for n,mask in enumerate(masks):
 					score=scores[n]
 					if score>detection_threshold:
-						mask=cv2.morphologyEx(mask,cv2.MORPH_CLOSE,np.ones((kernel,kernel),np.uint8))
-						cnts,_=cv2.findContours((mask*255).astype(np.uint8),cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_NONE)
-						cnt=sorted(cnts,key=cv2.contourArea,reverse=True)[0]
+						(cnt,_,_)=close_mask(mask,kernel)
 						contours.append(cnt)
-						if background_free:
-							masked_image=image*cv2.cvtColor(mask,cv2.COLOR_GRAY2BGR)
-							if black_background is False:
-								masked_image[mask==0]=255
-						else:
-							masked_image=image
 						x,y,w,h=cv2.boundingRect(cnt)
 						difference=int(abs(w-h)/2)+1
 						if w>h:
@@ -2308,7 +2625,12 @@ class AnalyzeAnimalDetector():
 							y_tp=min(y+h+1,image.shape[0])
 							x_lf=max(x-difference-1,0)
 							x_rt=min(x+w+difference+1,image.shape[1])
-						blob=masked_image[y_bt:y_tp,x_lf:x_rt]
+						if background_free:
+							blob=image[y_bt:y_tp,x_lf:x_rt]*cv2.cvtColor(mask[y_bt:y_tp,x_lf:x_rt],cv2.COLOR_GRAY2BGR)
+							if black_background is False:
+								blob[mask[y_bt:y_tp,x_lf:x_rt]==0]=255
+						else:
+							blob=image[y_bt:y_tp,x_lf:x_rt]
 						blob=np.uint8(exposure.rescale_intensity(blob,out_range=(0,255)))
 						if generate:
 							cv2.imwrite(os.path.join(results_path,image_name+'_'+str(n)+'.jpg'),blob)
@@ -20,9 +20,13 @@ Email: bingye@umich.edu
 
 
 import os
+import gc
 import cv2
 import json
 import torch
+import threading
+import queue
+from collections import deque
 try:
 	from detectron2 import model_zoo
 	from detectron2.checkpoint import DetectionCheckpointer
@@ -217,3 +221,156 @@ class Detector():
 		return outputs
 
 
+
+
+class DetectorWorker():
+
+	'''
+	This class runs a Detector on batches of frames in a background thread, between two bounded queues,
+	so that the inference of a batch overlaps with decoding the next frames (by a FrameReader)
+	and with the post-processing (masks to contours, tracking, blobs) of the previous batch.
+	'submit()' queues a batch of frames and 'get()' returns (frames,information,outputs) in the order of submission.
+	An error in the background thread is passed to the calling thread and raised by 'get()'.
+
+	queue_size: the maximum number of batches waiting for / after inference, if <=0, run inference in the calling thread
+	'''
+
+	def __init__(self,detector,queue_size=2):
+
+		self.detector=detector
+		self.queue_size=queue_size
+		self.stopped=threading.Event()
+		self.thread=None
+
+		if self.queue_size>0:
+			self.batches=queue.Queue(maxsize=self.queue_size)
+			self.results=queue.Queue(maxsize=self.queue_size)
+			self.thread=threading.Thread(target=self.infer,daemon=True)
+			self.thread.start()
+		else:
+			self.results=deque()
+
+
+	def run_detector(self,frames):
+
+		tensor_frames=[torch.as_tensor(frame.astype('float32').transpose(2,0,1)) for frame in frames]
+		inputs=[{'image':tensor_frame} for tensor_frame in tensor_frames]
+
+		return self.detector.inference(inputs)
+
+
+	def infer(self):
+
+		try:
+
+			while not self.stopped.is_set():
+
+				try:
+					batch=self.batches.get(timeout=0.1)
+				except queue.Empty:
+					continue
+
+				(frames,information)=batch
+				try:
+					outputs=self.run_detector(frames)
+				except BaseException as error:
+					outputs=error
+
+				self.put_result((frames,information,outputs))
+
+		except BaseException as error:
+			self.put_result((None,None,error))
+
+
+	def put_result(self,result):
+
+		while not self.stopped.is_set():
+			try:
+				self.results.put(result,timeout=0.1)
+				break
+			except queue.Full:
+				continue
+
+
+	def check_thread(self):
+
+		if not self.thread.is_alive():
+			raise RuntimeError('The Detector stopped running in the background thread.')
+
+
+	def submit(self,frames,information=None):
+
+		# frames: a batch of frames
+		# information: anything to return with the outputs of this batch, such as the analyzed frame count
+
+		if self.thread is None:
+			self.results.append((frames,information,self.run_detector(frames)))
+		else:
+			while True:
+				try:
+					self.batches.put((frames,information),timeout=0.1)
+					break
+				except queue.Full:
+					self.check_thread()
+
+
+	def get(self):
+
+		if self.thread is None:
+			return self.results.popleft()
+
+		while True:
+			try:
+				(frames,information,outputs)=self.results.get(timeout=0.1)
+				break
+			except queue.Empty:
+				self.check_thread()
+
+		if isinstance(outputs,BaseException):
+			raise outputs
+
+		return (frames,information,outputs)
+
+
+	def release(self):
+
+		self.stopped.set()
+
+		if self.thread is not None:
+			self.thread.join()
+
+
+loaded_detectors={}
+
+
+def get_detector(path_to_detector,animal_kinds):
+
+	# path_to_detector: the path to the Detector
+	# animal_kinds: the catgories of animals / objects to be analyzed
+
+	# returns a loaded Detector that is shared by the analyses in this process: the Detector is built and its weights
+	# are loaded only once per path, until it is modified or released by 'release_detectors'
+
+	path=os.path.abspath(path_to_detector)
+	modified_time=os.path.getmtime(os.path.join(path,'model_final.pth'))
+
+	if path not in loaded_detectors or loaded_detectors[path][0]!=modified_time:
+		detector=Detector()
+		detector.load(path,animal_kinds)
+		loaded_detectors[path]=(modified_time,detector)
+
+	return loaded_detectors[path][1]
+
+
+def release_detectors(path_to_detector=None):
+
+	# path_to_detector: the path to the Detector to release, if None, release all the loaded Detectors
+
+	if path_to_detector is None:
+		loaded_detectors.clear()
+	else:
+		loaded_detectors.pop(os.path.abspath(path_to_detector),None)
+
+	gc.collect()
+	if torch.cuda.is_available():
+		torch.cuda.empty_cache()
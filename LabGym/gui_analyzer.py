@@ -28,6 +28,7 @@ import torch
 import json
 from .analyzebehavior import AnalyzeAnimal
 from .analyzebehavior_dt import AnalyzeAnimalDetector
+from .detector import release_detectors
 from .tools import plot_events,parse_all_events_file,calculate_distances
 from .minedata import data_mining
 
@@ -84,6 +85,7 @@ class WindowLv2_AnalyzeBehaviors(wx.Frame):
 		self.detection_threshold=0 # only for 'static images' behavior mode
 		self.animal_kinds=[] # the total categories of animals / objects in a Detector
 		self.background_path=None # if not None, load background images from path in 'background subtraction' detection method
+		self.path_to_arena=None # if not None, the arena mask image that restricts the 'background subtraction' detection to the arena
 		self.model_path=None # the 'LabGym/models' folder, which stores all the trained Categorizers
 		self.path_to_categorizer=None # path to the Categorizer
 		self.path_to_videos=None # path to a batch of videos for analysis
@@ -472,6 +474,15 @@ class WindowLv2_AnalyzeBehaviors(wx.Frame):
 								self.stable_illumination=True
 							dialog3.Destroy()
 					dialog2.Destroy()
+					dialog2=wx.MessageDialog(self,'Restrict the detection to an arena mask?\nSelect "No" if dont know what it is.','(Optional) restrict to an arena?',wx.YES_NO|wx.ICON_QUESTION)
+					if dialog2.ShowModal()==wx.ID_YES:
+						dialog3=wx.FileDialog(self,'Select the arena mask image (the arena in white), such as the "arena_mask.png" stored when drawing markers.','',wildcard='Image files (*.png;*.jpg)|*.png;*.jpg',style=wx.FD_OPEN)
+						if dialog3.ShowModal()==wx.ID_OK:
+							self.path_to_arena=dialog3.GetPath()
+						dialog3.Destroy()
+					else:
+						self.path_to_arena=None
+					dialog2.Destroy()
 
 					if self.background_path is None:
 						ex_methods=['Use the entire duration (default but NOT recommended)','Decode from filenames: "_xst_" and "_xet_"','Enter two time points']
@@ -852,6 +863,7 @@ class WindowLv2_AnalyzeBehaviors(wx.Frame):
 						generate=False,animal_to_include=self.animal_to_include,behavior_to_include=self.behavior_to_include,names_and_colors=self.behaviornames_and_colors,
 						imagewidth=self.framewidth,dim_conv=self.dim_conv,channel=self.channel,detection_threshold=self.detection_threshold,uncertain=self.uncertain,
 						background_free=self.background_free,black_background=self.black_background,social_distance=0)
+					release_detectors()
 
 			else:
 
@@ -921,15 +933,18 @@ class WindowLv2_AnalyzeBehaviors(wx.Frame):
 							framewidth=self.framewidth,stable_illumination=self.stable_illumination,dim_tconv=self.dim_tconv,dim_conv=self.dim_conv,channel=self.channel,
 							include_bodyparts=self.include_bodyparts,std=self.std,categorize_behavior=categorize_behavior,animation_analyzer=self.animation_analyzer,
 							path_background=self.background_path,autofind_t=self.autofind_t,t=self.t,duration=self.duration,ex_start=self.ex_start,ex_end=self.ex_end,
-							length=self.length,animal_vs_bg=self.animal_vs_bg)
+							length=self.length,animal_vs_bg=self.animal_vs_bg,path_to_arena=self.path_to_arena)
+						if self.behavior_mode==0:
+							interact_all=False
+						else:
+							interact_all=True
+						AA.prepare_single_pass(self.behavior_to_include,path_to_categorizer=self.path_to_categorizer,uncertain=self.uncertain,min_length=self.min_length,show_legend=self.show_legend,interact_all=interact_all)
 						if self.behavior_mode==0:
 							AA.acquire_information(background_free=self.background_free,black_background=self.black_background)
 							AA.craft_data()
-							interact_all=False
 						else:
 							AA.acquire_information_interact_basic(background_free=self.background_free,black_background=self.black_background)
-							interact_all=True
-						if self.path_to_categorizer is not None:
+						if AA.single_pass is False and self.path_to_categorizer is not None:
 							AA.categorize_behaviors(self.path_to_categorizer,uncertain=self.uncertain,min_length=self.min_length)
 						AA.annotate_video(self.behavior_to_include,show_legend=self.show_legend,interact_all=interact_all)
 						AA.export_results(normalize_distance=self.normalize_distance,parameter_to_analyze=self.parameter_to_analyze)
@@ -947,13 +962,15 @@ class WindowLv2_AnalyzeBehaviors(wx.Frame):
 							names_and_colors=self.behaviornames_and_colors,framewidth=self.framewidth,dim_tconv=self.dim_tconv,dim_conv=self.dim_conv,channel=self.channel,
 							include_bodyparts=self.include_bodyparts,std=self.std,categorize_behavior=categorize_behavior,animation_analyzer=self.animation_analyzer,
 							t=self.t,duration=self.duration,length=self.length,social_distance=self.social_distance)
+						if self.correct_ID is False:
+							AAD.prepare_single_pass(self.animal_to_include,self.behavior_to_include,path_to_categorizer=self.path_to_categorizer,uncertain=self.uncertain,min_length=self.min_length,show_legend=self.show_legend)
 						if self.behavior_mode==1:
 							AAD.acquire_information_interact_basic(batch_size=self.detector_batch,background_free=self.background_free,black_background=self.black_background)
 						else:
 							AAD.acquire_information(batch_size=self.detector_batch,background_free=self.background_free,black_background=self.black_background)
 						if self.behavior_mode!=1:
 							AAD.craft_data()
-						if self.path_to_categorizer is not None:
+						if AAD.single_pass is False and self.path_to_categorizer is not None:
 							AAD.categorize_behaviors(self.path_to_categorizer,uncertain=self.uncertain,min_length=self.min_length)
 						if self.correct_ID:
 							AAD.correct_identity(self.specific_behaviors)
@@ -966,6 +983,9 @@ class WindowLv2_AnalyzeBehaviors(wx.Frame):
 									all_events[animal_name][len(all_events[animal_name])]=AAD.event_probability[animal_name][n]
 							if len(all_time)<len(AAD.all_time):
 								all_time=AAD.all_time
+
+				if self.use_detector:
+					release_detectors()
 					
 				if self.path_to_categorizer is not None:
 
@@ -28,6 +28,7 @@ import cv2
 import numpy as np
 from .analyzebehavior import AnalyzeAnimal
 from .analyzebehavior_dt import AnalyzeAnimalDetector
+from .detector import release_detectors
 from .categorizer import Categorizers
 from .tools import sort_examples_from_csv
 
@@ -581,6 +582,7 @@ class WindowLv2_GenerateExamples(wx.Frame):
 				else:
 					AAD=AnalyzeAnimalDetector()
 					AAD.analyze_images_individuals(self.path_to_detector,self.path_to_videos,self.result_path,self.animal_kinds,generate=True,imagewidth=self.framewidth,detection_threshold=self.detection_threshold,background_free=self.background_free,black_background=self.black_background)
+					release_detectors()
 
 			else:
 
@@ -658,6 +660,9 @@ class WindowLv2_GenerateExamples(wx.Frame):
 							else:
 								AAD.generate_data_interact_advance(background_free=self.background_free,black_background=self.black_background,skip_redundant=self.skip_redundant)
 
+					if self.use_detector:
+						release_detectors()
+
 
 
 class WindowLv2_SortBehaviors(wx.Frame):
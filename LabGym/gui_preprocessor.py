@@ -682,6 +682,18 @@ class WindowLv3_DrawMarkers(wx.Frame):
 
 		else:
 
+			arena_mask=np.zeros(self.image.shape[:2],dtype='uint8')
+			for circle in self.circles:
+				start=circle['start']
+				end=circle['end']
+				radius=int(((end[0]-start[0])**2+(end[1]-start[1])**2)**0.5)
+				cv2.circle(arena_mask,start,radius,255,-1)
+			if len(self.lines)>2:
+				cv2.fillPoly(arena_mask,[np.array([line['start'] for line in self.lines],dtype='int32')],255)
+			if np.max(arena_mask)>0:
+				cv2.imwrite(os.path.join(self.result_path,'arena_mask.png'),arena_mask)
+				print('The arena mask (circles, or the polygon formed by the start points of the lines) is stored in: '+os.path.join(self.result_path,'arena_mask.png'))
+
 			for i in self.path_to_videos:
 
 				capture=cv2.VideoCapture(i)
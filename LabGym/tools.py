@@ -25,6 +25,8 @@ import cv2
 import numpy as np
 import datetime
 from skimage import exposure
+import tensorflow as tf
+from tensorflow.keras.models import load_model
 from tensorflow.keras.preprocessing.image import img_to_array
 from collections import deque
 import matplotlib.pyplot as plt
@@ -36,20 +38,394 @@ import functools
 import operator
 import math
 import shutil
+import threading
+import queue
+import hashlib
+from scipy.spatial import distance,cKDTree
+from scipy.optimize import linear_sum_assignment
 
 
 
+class FrameReader():
+
+	'''
+	This class reads the frames of a video in a background thread and puts them in a bounded queue,
+	so that decoding (and resizing) the frames overlaps with the processing of the frames.
+	It can replace 'cv2.VideoCapture' in the frame-reading loops: 'read()' returns (retval,frame) and 'release()' stops it.
+	The index of the last frame returned by 'read()' is in 'frame_index'.
+	An error in the background thread is passed to the calling thread and raised by 'read()'.
+
+	framewidth, frameheight: if framewidth is not None, the frames are resized to (framewidth,frameheight)
+	queue_size: the maximum number of decoded frames waiting in the queue, if <=0, read frames in the calling thread
+	start_frame: the index of the first frame to read, the frames before it are skipped by seeking
+	frame_indices: if not None, only read the frames at these (ascending) indices by seeking to each of them
+	'''
+
+	def __init__(self,path_to_video,framewidth=None,frameheight=None,queue_size=32,start_frame=0,frame_indices=None):
+
+		self.path_to_video=path_to_video
+		self.capture=cv2.VideoCapture(self.path_to_video)
+		self.position=0
+		self.seekable=True
+		if start_frame>0:
+			self.seek(start_frame)
+		self.framewidth=framewidth
+		self.frameheight=frameheight
+		self.queue_size=queue_size
+		self.frame_indices=frame_indices
+		self.sample_count=0
+		self.frame_index=None
+		self.finished=False
+		self.stopped=threading.Event()
+		self.thread=None
+
+		if self.queue_size>0:
+			self.frames=queue.Queue(maxsize=self.queue_size)
+			self.thread=threading.Thread(target=self.decode,daemon=True)
+			self.thread.start()
+
+
+	def seek(self,frame_index):
+
+		# jump to the keyframe before frame_index and decode forward from there
+		# if the reached frame index does not match frame_index, the video is not seekable: skip the frames one by one instead,
+		# forward from the current position, and reopen the video only to go backwards
+
+		if self.seekable:
+			self.capture.set(cv2.CAP_PROP_POS_FRAMES,frame_index)
+			if int(self.capture.get(cv2.CAP_PROP_POS_FRAMES))==frame_index:
+				self.position=frame_index
+				return
+			self.seekable=False
+			self.position=None
+
+		if self.position is None or frame_index<self.position:
+			self.capture.release()
+			self.capture=cv2.VideoCapture(self.path_to_video)
+			self.position=0
+
+		for i in range(self.position,frame_index):
+			if not self.capture.grab():
+				break
+
+		self.position=frame_index
+
+
+	def read_frame(self):
+
+		if self.frame_indices is None:
+
+			retval,frame=self.capture.read()
+			index=self.position
+			self.position+=1
+
+		else:
+
+			retval,frame,index=False,None,None
+
+			while self.sample_count<len(self.frame_indices):
+				sample_index=self.frame_indices[self.sample_count]
+				self.sample_count+=1
+				if sample_index!=self.position:
+					self.seek(sample_index)
+				retval,frame=self.capture.read()
+				self.position=sample_index+1
+				if frame is not None:
+					index=sample_index
+					break
+
+		if frame is not None and self.framewidth is not None:
+			frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
+
+		return retval,frame,index
+
+
+	def decode(self):
+
+		try:
+
+			while not self.stopped.is_set():
+
+				retval,frame,index=self.read_frame()
+				self.put_frame((retval,frame,index))
+
+				if frame is None:
+					break
+
+		except BaseException as error:
+			self.put_frame(error)
+
+
+	def put_frame(self,item):
+
+		while not self.stopped.is_set():
+			try:
+				self.frames.put(item,timeout=0.1)
+				break
+			except queue.Full:
+				continue
+
+
+	def check_thread(self):
+
+		if not self.thread.is_alive() and self.frames.empty():
+			raise RuntimeError('The FrameReader stopped reading in the background thread.')
+
+
+	def read(self):
+
+		if self.finished:
+			return False,None
+
+		if self.thread is None:
+			retval,frame,index=self.read_frame()
+		else:
+			while True:
+				try:
+					item=self.frames.get(timeout=0.1)
+					break
+				except queue.Empty:
+					self.check_thread()
+			if isinstance(item,BaseException):
+				self.finished=True
+				raise item
+			retval,frame,index=item
+
+		if frame is None:
+			self.finished=True
+		else:
+			self.frame_index=index
+
+		return retval,frame
+
+
+	def release(self):
+
+		self.stopped.set()
+
+		if self.thread is not None:
+			while self.thread.is_alive():
+				try:
+					self.frames.get(timeout=0.1)
+				except queue.Empty:
+					continue
+			self.thread.join()
+
+		self.capture.release()
+
+
+def get_start_frame(fps,start_t):
+
+	'''
+	This function finds the index of the first frame to analyze, which is the first frame
+	whose time point 'round((frame_count+1)/fps,2)' is no earlier than start_t,
+	so that the reading can start from this frame instead of decoding and discarding the frames before it.
+	'''
+
+	frame_count=max(0,int(start_t*fps))
+
+	while frame_count>0 and round(frame_count/fps,2)>=start_t:
+		frame_count-=1
+
+	while round((frame_count+1)/fps,2)<start_t:
+		frame_count+=1
+
+	return frame_count
+
+
+class OnlineBackground():
+
+	'''
+	This class is used in 'background subtraction based detection method',
+	which extracts the static background of a video incrementally, as an alternative to
+	stacking the frames for 'extract_background'. The frames are taken in one at a time by 'append()'
+	and are not kept: only the running minimum / maximum, and for unstable illumination or animal_vs_bg==2,
+	the running sum and sum of squares of the (at most 4) overlapping 100-frame windows are kept.
+	An OnlineBackground can be passed to 'extract_background' in place of the list of frames.
+
+	animal_vs_bg: 0--animals brighter than the background
+				  1--animals darker than the background
+				  2--hard to tell
+	'''
+
+	def __init__(self,stable_illumination=True,animal_vs_bg=0):
+
+		self.stable_illumination=stable_illumination
+		self.animal_vs_bg=animal_vs_bg
+		self.clear()
+
+
+	def __len__(self):
+
+		return self.count
+
+
+	def clear(self):
+
+		self.count=0
+		self.minimum=None
+		self.maximum=None
+		self.total=None
+		self.first_frames=[]
+		self.windows={}
+		self.completed_windows=deque()
+		self.window_means=[]
+		self.window_stds=[]
+		self.best_check=None
+		self.best_mean=None
+
+
+	def append(self,frame):
+
+		index=self.count
+		self.count+=1
+
+		if self.minimum is None:
+			self.minimum=frame.copy()
+			self.maximum=frame.copy()
+		else:
+			np.minimum(self.minimum,frame,out=self.minimum)
+			np.maximum(self.maximum,frame,out=self.maximum)
+
+		if self.stable_illumination and self.animal_vs_bg!=2:
+			return
+
+		if self.animal_vs_bg==2:
+			if self.total is None:
+				self.total=np.zeros(frame.shape,dtype='int64')
+			self.total+=frame
+			# the median of all frames is the background when there are no more than 101 frames
+			if self.count<=101:
+				self.first_frames.append(frame.copy())
+			else:
+				self.first_frames=[]
+
+		frame=frame.astype('int32')
+		square=frame*frame
+
+		if index%30==0:
+			self.windows[index]=[np.zeros(frame.shape,dtype='int32'),np.zeros(frame.shape,dtype='int32')]
+
+		for start in list(self.windows):
+			self.windows[start][0]+=frame
+			self.windows[start][1]+=square
+			if index==start+99:
+				self.completed_windows.append([start]+self.windows[start])
+				del self.windows[start]
+
+		# a window starting at frame n is used only when there are more than n+101 frames
+		while len(self.completed_windows)>0 and self.count>=self.completed_windows[0][0]+102:
+			self.add_window(*self.completed_windows.popleft()[1:])
+
+
+	def add_window(self,total,total_square):
+
+		(mean,std)=get_window_statistics(total,total_square,100)
+
+		if self.animal_vs_bg==2:
+			self.window_means.append(mean)
+			self.window_stds.append(std)
+			return
+
+		if self.animal_vs_bg==1:
+			check=(25500-total).astype('float32')/np.float32(100)+std
+		else:
+			check=mean+std
+
+		if self.best_check is None:
+			self.best_check=check
+			self.best_mean=mean
+		else:
+			better=check<self.best_check
+			self.best_check=np.where(better,check,self.best_check)
+			self.best_mean=np.where(better,mean,self.best_mean)
+
+
+	def get_background(self):
+
+		if self.count<=3:
+			return None
+
+		if self.animal_vs_bg==2:
+			if self.count>101:
+				mean_overall=self.total.astype('float32')/np.float32(self.count)
+				best_check=best_mean=None
+				for mean,std in zip(self.window_means,self.window_stds):
+					check=abs(mean-mean_overall)+std
+					if best_check is None:
+						best_check=check
+						best_mean=mean
+					else:
+						better=check<best_check
+						best_check=np.where(better,check,best_check)
+						best_mean=np.where(better,mean,best_mean)
+				return np.uint8(best_mean)
+			else:
+				return np.uint8(np.median(np.array(self.first_frames,dtype='float32'),axis=0))
+
+		if self.stable_illumination or self.count<=101:
+			if self.animal_vs_bg==1:
+				return self.maximum.copy()
+			else:
+				return self.minimum.copy()
+
+		return np.uint8(self.best_mean)
+
+
+def get_window_statistics(total,total_square,length):
+
+	'''
+	This function computes the mean and standard deviation of windows of frames
+	from the exact integer sums (total) and sums of squares (total_square) of the pixel values in each window.
+
+	length: the number of frames in a window
+	'''
+
+	mean=total.astype('float32')/np.float32(length)
+	std=np.float32(np.sqrt(length*total_square.astype('float64')-np.square(total.astype('float64')))/length)
+
+	return mean,std
+
+
+def sum_windows(frames):
+
+	'''
+	This function sums the pixel values and their squares in each 100-frame window
+	[n,n+100) of the frames for n=0,30,60... while n<len(frames)-101, as used in 'extract_background'.
+	The frames are summed in 10-frame blocks, and each window is the sum of 10 consecutive blocks,
+	taken as a strided view every 3 blocks, so that the windows are never stacked.
+	'''
+
+	number_windows=len(range(0,len(frames)-101,30))
+	blocks=frames[:(number_windows-1)*30+100].reshape((-1,10)+frames.shape[1:])
+	block_total=blocks.sum(axis=1,dtype='int32')
+	block_total_square=np.square(blocks,dtype='uint16').sum(axis=1,dtype='int32')
+
+	total=np.lib.stride_tricks.sliding_window_view(block_total,10,axis=0)[::3].sum(axis=-1)
+	total_square=np.lib.stride_tricks.sliding_window_view(block_total_square,10,axis=0)[::3].sum(axis=-1)
+
+	return total,total_square
+
+
 def extract_background(frames,stable_illumination=True,animal_vs_bg=0):
 
 	'''
 	This function is used in 'background subtraction based detection method', 
 	which extract the static background of a video.
 
+	frames: a list of frames, or an OnlineBackground that has taken in the frames one by one
 	animal_vs_bg: 0--animals brighter than the background
 				  1--animals darker than the background
 				  2--hard to tell
+
+	When the illumination is unstable or animal_vs_bg==2, the frames are divided into 100-frame windows (every 30 frames),
+	and for each pixel, the mean of the window with the smallest (mean + std) is used as the background.
+	The window sums are obtained from 10-frame block sums over strided views of the frames, and the window is selected by argmin.
 	'''
 
+	if isinstance(frames,OnlineBackground):
+		return frames.get_background()
+
 	len_frames=len(frames)
 	
 	if len_frames<=3:
@@ -58,85 +434,103 @@ def extract_background(frames,stable_illumination=True,animal_vs_bg=0):
 
 	else:
 
-		frames=np.array(frames,dtype='float32')
+		frames=np.array(frames,dtype='uint8')
 
 		if animal_vs_bg==2:
 
 			if len_frames>101:
 
-				frames_mean=[]
-				check_frames=[]
-				mean_overall=frames.mean(0)
-				n=0
-
-				while n<len_frames-101:
-					frames_temp=frames[n:n+100]
-					mean=frames_temp.mean(0)
-					frames_mean.append(mean)	
-					check_frames.append(abs(mean-mean_overall)+frames_temp.std(0))
-					n+=30
-
-				frames_mean=np.array(frames_mean,dtype='float32')
-				check_frames=np.array(check_frames,dtype='float32')
-				background=np.uint8(np.take_along_axis(frames_mean,np.argsort(check_frames,axis=0),axis=0)[0])
+				mean_overall=frames.sum(0,dtype='int64').astype('float32')/np.float32(len_frames)
+				(total,total_square)=sum_windows(frames)
+				(frames_mean,std)=get_window_statistics(total,total_square,100)
+				check_frames=abs(frames_mean-mean_overall)+std
+				background=np.uint8(np.take_along_axis(frames_mean,np.argmin(check_frames,axis=0)[None],axis=0)[0])
 
 				del frames_mean
 				del check_frames
-				del frames_temp
 				gc.collect()
 
 			else:
 
-				background=np.uint8(np.median(frames,axis=0))	
+				background=np.uint8(np.median(np.array(frames,dtype='float32'),axis=0))	
 
 		else:
 
 			if stable_illumination:
 
 				if animal_vs_bg==1:
-					background=np.uint8(frames.max(0))
+					background=frames.max(0)
 				else:
-					background=np.uint8(frames.min(0))
+					background=frames.min(0)
 
 			else:
 
 				if len_frames>101:
 
-					frames_mean=[]
-					check_frames=[]
-					n=0
-
-					while n<len_frames-101:
-						frames_temp=frames[n:n+100]
-						mean=frames_temp.mean(0)
-						frames_mean.append(mean)
-						if animal_vs_bg==1:
-							frames_temp_inv=255-frames_temp
-							check_frames.append(frames_temp_inv.mean(0)+frames_temp_inv.std(0))
-						else:
-							check_frames.append(mean+frames_temp.std(0))
-						n+=30
-
-					frames_mean=np.array(frames_mean,dtype='float32')
-					check_frames=np.array(check_frames,dtype='float32')
-					background=np.uint8(np.take_along_axis(frames_mean,np.argsort(check_frames,axis=0),axis=0)[0])
+					(total,total_square)=sum_windows(frames)
+					(frames_mean,std)=get_window_statistics(total,total_square,100)
+					if animal_vs_bg==1:
+						check_frames=(25500-total).astype('float32')/np.float32(100)+std
+					else:
+						check_frames=frames_mean+std
+					background=np.uint8(np.take_along_axis(frames_mean,np.argmin(check_frames,axis=0)[None],axis=0)[0])
 
 					del frames_mean
 					del check_frames
-					del frames_temp
 					gc.collect()
 
 				else:
 
 					if animal_vs_bg==1:
-						background=np.uint8(frames.max(0))
+						background=frames.max(0)
 					else:
-						background=np.uint8(frames.min(0))
+						background=frames.min(0)
 	
 	return background
 
 
-def estimate_constants(path_to_video,delta,animal_number,framewidth=None,frameheight=None,stable_illumination=True,ex_start=0,ex_end=None,t=None,duration=10,animal_vs_bg=0,path_background=None,kernel=3):
+def fingerprint_video(path_to_video,chunk_size=1048576):
+
+	'''
+	This function computes a fingerprint of a video file from its size, its modification time and the bytes
+	at its beginning, middle and end, which is fast even for very large videos. A video file that is replaced
+	or modified gets a new modification time and thus a new fingerprint, unless its modification time is restored
+	with the same size and the same bytes at these positions.
+	'''
+
+	size=os.path.getsize(path_to_video)
+	fingerprint=hashlib.sha1((str(size)+'_'+str(os.path.getmtime(path_to_video))).encode())
+
+	with open(path_to_video,'rb') as video_file:
+		for position in (0,max(0,int(size/2)-int(chunk_size/2)),max(0,size-chunk_size)):
+			video_file.seek(position)
+			fingerprint.update(video_file.read(chunk_size))
+
+	return fingerprint.hexdigest()
+
+
+def prune_cache(cache_path,max_size):
+
+	'''
+	This function deletes the least recently used files in the cache folder
+	until the total size of the files left is no larger than max_size (in bytes).
+	'''
+
+	cache_files=[os.path.join(cache_path,i) for i in os.listdir(cache_path) if i.endswith('.npz')]
+	cache_files=[(os.path.getmtime(i),os.path.getsize(i),i) for i in cache_files if os.path.isfile(i)]
+	total_size=sum(size for (modified_time,size,i) in cache_files)
+
+	for (modified_time,size,i) in sorted(cache_files):
+		if total_size<=max_size:
+			break
+		try:
+			os.remove(i)
+		except OSError:
+			continue
+		total_size-=size
+
+
+def estimate_constants(path_to_video,delta,animal_number,framewidth=None,frameheight=None,stable_illumination=True,ex_start=0,ex_end=None,t=None,duration=10,animal_vs_bg=0,path_background=None,kernel=3,queue_size=32,background_samples=None,cache_path=None,cache_size=536870912,online_background=False):
 
 	'''
 	This function is in 'background subtraction based detection method',
@@ -147,37 +541,80 @@ def estimate_constants(path_to_video,delta,animal_number,framewidth=None,framehe
 	ex_start and ex_end: determines the time window (in second) for extracting background
 	path_to_background: the path to the extracted background, which can be reused for background subtraction
 	kernel: determines how fine the erosion or dilation operation is
+	queue_size: the maximum number of frames decoded ahead by the FrameReader
+	background_samples: if not None, extract the background from this number of evenly spaced frames in the time window instead of all the frames
+	cache_path: if not None, the folder to store the results, which are reused when the same video is analyzed with the same parameters
+	cache_size: the maximum total size (in bytes) of the files in cache_path, the least recently used ones are deleted beyond it
+	online_background: whether to extract the backgrounds incrementally by OnlineBackground instead of keeping up to 1000 frames in memory
 	'''
 
+	if path_background is None and cache_path is not None:
+		parameters=(framewidth,frameheight,ex_start,ex_end,delta,stable_illumination,animal_vs_bg,animal_number,t,duration,kernel,background_samples,online_background)
+		cache_key=hashlib.sha1((fingerprint_video(path_to_video)+str(parameters)).encode()).hexdigest()
+		cache_file=os.path.join(cache_path,cache_key+'.npz')
+		if os.path.isfile(cache_file):
+			print('Loading the cached background and animal size...')
+			with np.load(cache_file) as cache:
+				constants=(cache['background'],cache['background_low'],cache['background_high'],cache['stim_t'].item(),cache['animal_area'].item())
+			os.utime(cache_file)
+			print('Single animal size: '+str(constants[4]))
+			return constants
+		constants=estimate_constants(path_to_video,delta,animal_number,framewidth=framewidth,frameheight=frameheight,stable_illumination=stable_illumination,ex_start=ex_start,ex_end=ex_end,t=t,duration=duration,animal_vs_bg=animal_vs_bg,kernel=kernel,queue_size=queue_size,background_samples=background_samples,online_background=online_background)
+		os.makedirs(cache_path,exist_ok=True)
+		temp_file=os.path.join(cache_path,cache_key+'_temp.npz')
+		np.savez_compressed(temp_file,background=constants[0],background_low=constants[1],background_high=constants[2],stim_t=constants[3],animal_area=constants[4])
+		os.replace(temp_file,cache_file)
+		prune_cache(cache_path,cache_size)
+		return constants
+
 	capture=cv2.VideoCapture(path_to_video)
 	fps=round(capture.get(cv2.CAP_PROP_FPS))
+	num_frames=capture.get(cv2.CAP_PROP_FRAME_COUNT)
 	capture.release()
 	frame_initial=None
 	stim_t=None
+	stim_search=None
 
 	if path_background is None:
 
 		print('Extracting the static background...')
 
-		capture=cv2.VideoCapture(path_to_video)
-
-		if ex_start>=capture.get(cv2.CAP_PROP_FRAME_COUNT)/fps:
+		if ex_start>=num_frames/fps:
 			print('The beginning time for background extraction is later than the end of the video!')
 			print('Will use the 1st second of the video as the beginning time for background extraction!')
 			ex_start=0
 		if ex_start==ex_end:
 			ex_end=ex_start+1
 
-		frames=deque(maxlen=1000)
-		frames_low=deque(maxlen=1000)
-		frames_high=deque(maxlen=1000)
+		start_frame=max(0,math.ceil(ex_start*fps)-1)
+		if start_frame>0:
+			capture=FrameReader(path_to_video,framewidth=framewidth,frameheight=frameheight,queue_size=0)
+			retval,frame_initial=capture.read()
+			capture.release()
+		if background_samples is None:
+			frame_indices=None
+		else:
+			end_frame=int(num_frames)
+			if ex_end is not None:
+				end_frame=min(end_frame,max(0,math.ceil(ex_end*fps)-1))
+			frame_indices=sorted(set(np.linspace(start_frame,max(start_frame,end_frame-1),int(background_samples)).astype(int).tolist()))
+		capture=FrameReader(path_to_video,framewidth=framewidth,frameheight=frameheight,queue_size=queue_size,start_frame=start_frame,frame_indices=frame_indices)
+
+		if online_background:
+			frames=OnlineBackground(stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+			frames_low=OnlineBackground(stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+			frames_high=OnlineBackground(stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+		else:
+			frames=deque(maxlen=1000)
+			frames_low=deque(maxlen=1000)
+			frames_high=deque(maxlen=1000)
 		backgrounds=deque(maxlen=1000)
 		backgrounds_low=deque(maxlen=1000)
 		backgrounds_high=deque(maxlen=1000)
-		frame_number=1
 		frame_count=1
 		frame_low_count=1
 		frame_high_count=1
+		previous_frame_number=0
 
 		while True:
 
@@ -186,20 +623,17 @@ def estimate_constants(path_to_video,delta,animal_number,framewidth=None,framehe
 			if frame is None:
 				break
 
+			frame_number=capture.frame_index+1
+
 			if ex_end is not None:
 				if frame_number>=ex_end*fps:
 					break
 
 			if frame_initial is None:
 				frame_initial=frame
-				if framewidth is not None:
-					frame_initial=cv2.resize(frame,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
 
 			if frame_number>=ex_start*fps:
 
-				if framewidth is not None:
-					frame=cv2.resize(frame,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
-
 				if np.mean(frame)<np.mean(frame_initial)/delta:
 					if stim_t is None:
 						stim_t=frame_number/fps
@@ -214,22 +648,30 @@ def estimate_constants(path_to_video,delta,animal_number,framewidth=None,framehe
 					frames.append(frame)
 					frame_count+=1
 
+			if stim_t is not None and stim_search is None:
+				stim_search=(previous_frame_number,frame_number)
+			previous_frame_number=frame_number
+
 			if frame_count==1001:
 				frame_count=1
 				background=extract_background(frames,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
 				backgrounds.append(background)
+				if online_background:
+					frames.clear()
 
 			if frame_low_count==1001:
 				frame_low_count=1
 				background_low=extract_background(frames_low,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
 				backgrounds_low.append(background_low)
+				if online_background:
+					frames_low.clear()
 
 			if frame_high_count==1001:
 				frame_high_count=1
 				background_high=extract_background(frames_high,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
 				backgrounds_high.append(background_high)
-
-			frame_number+=1
+				if online_background:
+					frames_high.clear()
 
 		capture.release()
 
@@ -313,259 +755,1009 @@ def estimate_constants(path_to_video,delta,animal_number,framewidth=None,framehe
 
 	else:
 
-		background=cv2.imread(os.path.join(path_background,'background.jpg'))
-		background_low=cv2.imread(os.path.join(path_background,'background_low.jpg'))
-		background_high=cv2.imread(os.path.join(path_background,'background_high.jpg'))
-		if framewidth is not None:
-			background=cv2.resize(background,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
-			background_low=cv2.resize(background_low,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
-			background_high=cv2.resize(background_high,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
+		background=cv2.imread(os.path.join(path_background,'background.jpg'))
+		background_low=cv2.imread(os.path.join(path_background,'background_low.jpg'))
+		background_high=cv2.imread(os.path.join(path_background,'background_high.jpg'))
+		if framewidth is not None:
+			background=cv2.resize(background,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
+			background_low=cv2.resize(background_low,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
+			background_high=cv2.resize(background_high,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
+
+		frame_initial=background
+
+	print('Estimating the animal size...')
+	print(datetime.datetime.now())
+
+	if delta<10000:
+		
+		if ex_start!=0 or path_background is not None:
+
+			capture=FrameReader(path_to_video,framewidth=framewidth,frameheight=frameheight,queue_size=queue_size)
+			frame_count=1
+
+			while True:
+
+				retval,frame=capture.read()
+
+				if frame is None:
+					break
+
+				if frame_initial is None:
+					frame_initial=frame
+				else:
+					if np.mean(frame)<np.mean(frame_initial)/delta:
+						stim_t=frame_count/fps
+						break
+					if np.mean(frame)>delta*np.mean(frame_initial):
+						stim_t=frame_count/fps
+						break
+						
+				frame_count+=1
+
+			capture.release()
+
+		elif background_samples is not None and stim_search is not None:
+
+			# the illumination changes between two sampled frames, only the frames in between are checked for the stimulation start time
+			capture=FrameReader(path_to_video,framewidth=framewidth,frameheight=frameheight,queue_size=queue_size,start_frame=stim_search[0])
+			frame_count=stim_search[0]+1
+
+			while frame_count<stim_search[1]:
+
+				retval,frame=capture.read()
+
+				if frame is None:
+					break
+
+				if np.mean(frame)<np.mean(frame_initial)/delta or np.mean(frame)>delta*np.mean(frame_initial):
+					stim_t=frame_count/fps
+					break
+
+				frame_count+=1
+
+			capture.release()
+
+	if t is None:
+		if stim_t is None:
+			es_start=0
+		else:
+			es_start=stim_t
+	else:
+		es_start=t
+
+	if duration>30 or duration<=0:
+		duration=30
+	es_end=es_start+duration
+
+	start_frame=max(0,math.ceil(es_start*fps)-1)
+	capture=FrameReader(path_to_video,framewidth=framewidth,frameheight=frameheight,queue_size=queue_size,start_frame=start_frame)
+	total_contour_area=[]
+	frame_count=start_frame+1
+	min_area=(background.shape[1]/100)*(background.shape[0]/100)
+	max_area=(background.shape[1]*background.shape[0])*3/4
+
+	if animal_vs_bg==1:
+		background_estimation=np.uint8(255-background)
+		background_low_estimation=np.uint8(255-background_low)
+		background_high_estimation=np.uint8(255-background_high)
+	else:
+		background_estimation=background
+		background_low_estimation=background_low
+		background_high_estimation=background_high
+
+	while True:
+
+		retval,frame=capture.read()
+
+		if frame_initial is None:
+			frame_initial=frame
+
+		if frame is None:
+			break
+
+		if es_end is not None:
+			if frame_count>=es_end*fps:
+				break
+
+		if frame_count>=es_start*fps:
+
+			if animal_vs_bg==1:
+				frame=np.uint8(255-frame)
+
+			contour_area=0
+
+			if np.mean(frame)<np.mean(frame_initial)/delta:
+				if animal_vs_bg==2:
+					foreground=cv2.absdiff(frame,background_low_estimation)
+				else:
+					foreground=cv2.subtract(frame,background_low_estimation)
+			elif np.mean(frame)>delta*np.mean(frame_initial):
+				if animal_vs_bg==2:
+					foreground=cv2.absdiff(frame,background_high_estimation)
+				else:
+					foreground=cv2.subtract(frame,background_high_estimation)
+			else:
+				if animal_vs_bg==2:
+					foreground=cv2.absdiff(frame,background_estimation)
+				else:
+					foreground=cv2.subtract(frame,background_estimation)
+
+			foreground=cv2.cvtColor(foreground,cv2.COLOR_BGR2GRAY)
+			thred=cv2.threshold(foreground,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)[1]
+			thred=cv2.morphologyEx(thred,cv2.MORPH_CLOSE,np.ones((kernel,kernel),np.uint8))
+
+			if animal_vs_bg==2:
+				kernel_erode=max(kernel-4,1)
+				thred=cv2.erode(thred,np.ones((kernel_erode,kernel_erode),np.uint8))
+			contours,_=cv2.findContours(thred,cv2.RETR_LIST,cv2.CHAIN_APPROX_NONE)
+
+			for i in contours:
+				area=cv2.contourArea(i)
+				if min_area<area<max_area:
+					contour_area+=area
+			total_contour_area.append(contour_area)
+
+		frame_count+=1
+
+	capture.release()
+
+	print('Estimation completed!')
+
+	if len(total_contour_area)>0:
+		if animal_number==0:
+			print('Animal number is 0. Please enter the correct animal number!')
+			animal_area=1
+		else:
+			animal_area=(sum(total_contour_area)/len(total_contour_area))/animal_number
+	else:
+		print('No animal detected!')
+		animal_area=1
+
+	print('Single animal size: '+str(animal_area))
+
+	if stim_t is None:
+		stim_t=2
+
+	return (background,background_low,background_high,stim_t,animal_area)
+
+
+def crop_frame(frame,contours):
+
+	'''
+	This function is used to crop a frame to fit
+	the border of a list of contours.
+	'''
+
+	lfbt=np.array([contours[i].min(0) for i in range(len(contours)) if contours[i] is not None]).min(0)[0]
+	x_lf=lfbt[0]
+	y_bt=lfbt[1]
+	rttp=np.array([contours[i].max(0) for i in range(len(contours)) if contours[i] is not None]).max(0)[0]
+	x_rt=rttp[0]
+	y_tp=rttp[1]
+
+	w=x_rt-x_lf+1
+	h=y_tp-y_bt+1
+
+	difference=int(abs(w-h)/2)+1
+
+	if w>h:
+		y_bt=max(y_bt-difference-1,0)
+		y_tp=min(y_tp+difference+1,frame.shape[0])
+		x_lf=max(x_lf-1,0)
+		x_rt=min(x_rt+1,frame.shape[1])
+	if w<h:
+		y_bt=max(y_bt-1,0)
+		y_tp=min(y_tp+1,frame.shape[0])
+		x_lf=max(x_lf-difference-1,0)
+		x_rt=min(x_rt+difference+1,frame.shape[1])
+
+	return (y_bt,y_tp,x_lf,x_rt)
+
+
+class BlobPiece():
+
+	'''
+	This class keeps the pixels of one frame that are inside a list of contours,
+	cropped to the bounding rectangle of the contours, so that the blob of this frame
+	is extracted only once and re-projected into the crop of each window that includes it.
+	If not background_free, the whole frame is kept.
+
+	channel: 1--gray scale blob
+			 3--RGB scale blob
+	black_background: whether to set background black
+	'''
+
+	def __init__(self,frame,contours=None,channel=1,background_free=False,black_background=True):
+
+		self.channel=channel
+		self.black_background=black_background
+		self.box=None
+		self.blob=None
+		self.dtype=None
+
+		if background_free:
+			if len(contours)==0:
+				self.x=self.y=0
+				self.piece=np.zeros((0,0,frame.shape[2]))
+			else:
+				(self.x,self.y,w,h)=cv2.boundingRect(np.concatenate(contours))
+				mask=np.zeros((h,w,frame.shape[2]),dtype=frame.dtype)
+				cv2.drawContours(mask,contours,-1,(255,255,255),-1,offset=(-self.x,-self.y))
+				self.piece=frame[self.y:self.y+h,self.x:self.x+w]*(mask/255.0)
+				if black_background is False:
+					self.piece[mask==0]=255
+		else:
+			self.x=self.y=0
+			self.piece=frame
+
+		self.dtype=self.piece.dtype
+
+
+	def trim(self,y_bt,y_tp,x_lf,x_rt):
+
+		# y_bt,y_tp,x_lf,x_rt: the union of the crops of all the windows that include this blob
+		# only the pixels inside it are kept (as uint8, the pixels are frame values or 0 / 255), which does not change the reprojected blobs
+
+		(h,w)=self.piece.shape[:2]
+		top=max(self.y,y_bt)
+		bottom=max(min(self.y+h,y_tp),top)
+		left=max(self.x,x_lf)
+		right=max(min(self.x+w,x_rt),left)
+
+		self.piece=np.array(self.piece[top-self.y:bottom-self.y,left-self.x:right-self.x],dtype='uint8')
+		self.x=left
+		self.y=top
+
+
+	def reproject(self,y_bt,y_tp,x_lf,x_rt):
+
+		# y_bt,y_tp,x_lf,x_rt: the crop of the window
+		# returns the same blob as masking the whole frame and cropping it
+
+		(h,w)=self.piece.shape[:2]
+
+		if self.x<=x_lf and self.y<=y_bt and self.x+w>=x_rt and self.y+h>=y_tp:
+			blob=self.piece[y_bt-self.y:y_tp-self.y,x_lf-self.x:x_rt-self.x]
+		else:
+			if self.black_background:
+				blob=np.zeros((y_tp-y_bt,x_rt-x_lf,self.piece.shape[2]),dtype=self.piece.dtype)
+			else:
+				blob=np.full((y_tp-y_bt,x_rt-x_lf,self.piece.shape[2]),255,dtype=self.piece.dtype)
+			top=max(self.y,y_bt)
+			bottom=min(self.y+h,y_tp)
+			left=max(self.x,x_lf)
+			right=min(self.x+w,x_rt)
+			if bottom>top and right>left:
+				blob[top-y_bt:bottom-y_bt,left-x_lf:right-x_lf]=self.piece[top-self.y:bottom-self.y,left-self.x:right-self.x]
+
+		blob=blob.astype(self.dtype,copy=False)
+		blob=np.uint8(exposure.rescale_intensity(blob,out_range=(0,255)))
+
+		if self.channel==1:
+			blob=cv2.cvtColor(blob,cv2.COLOR_BGR2GRAY)
+			blob=img_to_array(blob)
+
+		return blob
+
+
+	def get_blob(self,box,dim):
+
+		# box: the crop (y_bt,y_tp,x_lf,x_rt) of the window
+		# dim: the dimension the blob is resized to
+		# the resized blob is reused while the crop of the window stays the same
+
+		if self.box!=box:
+			self.blob=img_to_array(cv2.resize(self.reproject(*box),(dim,dim),interpolation=cv2.INTER_AREA))
+			self.box=box
+
+		return self.blob
+
+
+class AnimationStore():
+
+	'''
+	This class stores the blobs of one animal / object as one BlobPiece per analyzed frame,
+	instead of one animation (the blobs in the last 'length' frames) per frame, and generates the animations on demand.
+	Each BlobPiece is trimmed to the crops of the windows that include it, once the last of these windows is added.
+
+	length: the number of frames in an animation
+	total_length: the number of analyzed frames
+	dim: the dimension the blobs are resized to
+	channel: the number of channels of the blobs
+	'''
+
+	def __init__(self,length,total_length,dim,channel):
+
+		self.length=length
+		self.dim=dim
+		self.channel=channel
+		self.pieces=[None]*total_length
+		self.boxes=[None]*total_length
+		self.regions=deque(maxlen=length)
+		self.count=0
+		self.released=0
+
+
+	def add(self,piece,box):
+
+		# piece: the BlobPiece of the next frame, None if the animal / object is not detected
+		# box: the crop (y_bt,y_tp,x_lf,x_rt) of the window that ends at this frame, None if the window has no blob
+
+		if len(self.regions)==self.length:
+			self.trim(self.count-self.length,self.regions[0])
+
+		self.regions.append(None)
+		if box is not None:
+			for n,region in enumerate(self.regions):
+				if region is None:
+					self.regions[n]=box
+				else:
+					self.regions[n]=(min(region[0],box[0]),max(region[1],box[1]),min(region[2],box[2]),max(region[3],box[3]))
+
+		self.pieces[self.count]=piece
+		self.boxes[self.count]=box
+		self.count+=1
+
+
+	def trim(self,n,region):
+
+		if self.pieces[n] is not None and region is not None:
+			self.pieces[n].trim(*region)
+
+
+	def finish(self):
+
+		# trims the blobs of the last frames, after all the frames are added
+
+		for n,region in enumerate(self.regions):
+			self.trim(self.count-len(self.regions)+n,region)
+		self.regions.clear()
+
+
+	def get_animations(self,frames):
+
+		# frames: the analyzed frame counts (ascending) that the animations end at
+		# returns the animations (length x dim x dim x channel), the same as stacking the blobs of each window
+
+		animations=[]
+
+		for i in frames:
+			box=self.boxes[i]
+			animation=[]
+			for n in range(i-self.length+1,i+1):
+				if n<0 or self.pieces[n] is None:
+					animation.append(img_to_array(np.zeros((self.dim,self.dim,self.channel),dtype='uint8')))
+				else:
+					animation.append(self.pieces[n].get_blob(box,self.dim))
+			animations.append(np.array(animation))
+
+		# the resized blobs are only reused within these windows
+		if len(frames)>0:
+			for n in range(max(0,frames[0]-self.length+1),frames[-1]+1):
+				if self.pieces[n] is not None:
+					self.pieces[n].box=self.pieces[n].blob=None
+
+		return animations
+
+
+	def release(self,start):
+
+		# start: the blobs of the frames before this analyzed frame count are released
+
+		for n in range(self.released,min(start,len(self.pieces))):
+			self.pieces[n]=None
+		self.released=max(self.released,start)
+
+
+def extract_blob_background(frame,contours,contour=None,channel=1,background_free=False,black_background=True):
+
+	'''
+	This function is used to keep the pixels for the area
+	inside a contour, and crop the frame to fit a list of 
+	contours. It can also include background pixels.
+
+	channel: 1--gray scale blob
+			 3--RGB scale blob
+	black_background: whether to set background black
+	'''
+
+	(y_bt,y_tp,x_lf,x_rt)=crop_frame(frame,contours)
+
+	return BlobPiece(frame,contours=[contour],channel=channel,background_free=background_free,black_background=black_background).reproject(y_bt,y_tp,x_lf,x_rt)
+
+
+def extract_blob_all(frame,y_bt,y_tp,x_lf,x_rt,contours=None,channel=1,background_free=False,black_background=True):
+
+	'''
+	This function is used to keep the pixels for the area
+	inside a list of contours, and crop the frame to fit 
+	the y_bt,y_tp,x_lf,x_rt coordinates.
+
+	channel: 1--gray scale blob
+			 3--RGB scale blob
+	black_background: whether to set background black
+	'''
+
+	return BlobPiece(frame,contours=contours,channel=channel,background_free=background_free,black_background=black_background).reproject(y_bt,y_tp,x_lf,x_rt)
+
+
+def get_exclusion_mask(masks,threshold=0.8):
+
+	'''
+	This function finds the masks (of detected animals / objects) that mostly overlap with a larger mask:
+	more than 'threshold' of the area of the mask is inside the larger mask.
+	Only the pairs of masks whose bounding boxes intersect are compared, and only within the intersection of the boxes,
+	instead of stacking the full-frame overlap of every pair of masks.
+
+	masks: the masks (N x H x W, 0 or 1)
+
+	Returns a boolean array that is True for the masks to exclude
+	'''
+
+	number=len(masks)
+	exclusion_mask=np.zeros(number,dtype=bool)
+
+	if number<2:
+		return exclusion_mask
+
+	areas=np.count_nonzero(masks.reshape(number,-1),axis=1)
+	rows=masks.any(axis=2)
+	columns=masks.any(axis=1)
+	top=np.argmax(rows,axis=1)
+	bottom=rows.shape[1]-np.argmax(rows[:,::-1],axis=1)
+	left=np.argmax(columns,axis=1)
+	right=columns.shape[1]-np.argmax(columns[:,::-1],axis=1)
+
+	y_tp=np.maximum(top[:,None],top[None,:])
+	y_bt=np.minimum(bottom[:,None],bottom[None,:])
+	x_lf=np.maximum(left[:,None],left[None,:])
+	x_rt=np.minimum(right[:,None],right[None,:])
+	candidates=(areas[:,None]>0)&(areas[:,None]<areas[None,:])&(y_bt>y_tp)&(x_rt>x_lf)
+
+	# the overlap of each candidate pair is counted within the intersection of their boxes, which is usually much smaller
+	# than a box enclosing all the compared masks, so this is faster than counting all pairs at once over such a box
+	for i,j in np.argwhere(candidates):
+		if not exclusion_mask[i]:
+			overlap=np.count_nonzero(np.logical_and(masks[i,y_tp[i,j]:y_bt[i,j],x_lf[i,j]:x_rt[i,j]],masks[j,y_tp[i,j]:y_bt[i,j],x_lf[i,j]:x_rt[i,j]]))
+			if overlap/areas[i]>threshold:
+				exclusion_mask[i]=True
+
+	return exclusion_mask
+
+
+def get_largest_contour(cnts):
+
+	'''
+	This function returns the contour with the largest area and its area,
+	computing the area of each contour only once.
+	'''
+
+	areas=[cv2.contourArea(i) for i in cnts]
+	index=int(np.argmax(areas))
+
+	return cnts[index],areas[index]
+
+
+def close_mask(mask,kernel):
+
+	'''
+	This function closes the mask of a detected animal / object and finds its largest contour,
+	working only on the bounding box of the mask plus a margin instead of the whole frame,
+	so that the cost scales with the size of the animal rather than the size of the frame.
+	The closing never reaches beyond the margin, so the closed crop is written back into 'mask'.
+
+	mask: the mask (H x W, 0 or 1) of a detected animal / object, which is modified in place
+	kernel: the size of the kernel for the closing
+
+	Returns (contour,area,box): the largest contour (in frame coordinates), its area, and the box (y_bt,y_tp,x_lf,x_rt)
+	that contains the closed mask with a blank border, which can be used to crop the frame for 'get_inner'
+	'''
+
+	(x,y,w,h)=cv2.boundingRect(mask)
+
+	if w==0 or h==0:
+		(y_bt,y_tp,x_lf,x_rt)=(0,mask.shape[0],0,mask.shape[1])
+	else:
+		margin=kernel+3
+		y_bt=max(y-margin,0)
+		y_tp=min(y+h+margin,mask.shape[0])
+		x_lf=max(x-margin,0)
+		x_rt=min(x+w+margin,mask.shape[1])
+
+	mask[y_bt:y_tp,x_lf:x_rt]=cv2.morphologyEx(mask[y_bt:y_tp,x_lf:x_rt],cv2.MORPH_CLOSE,np.ones((kernel,kernel),np.uint8))
+	cnts,_=cv2.findContours((mask[y_bt:y_tp,x_lf:x_rt]*255).astype(np.uint8),cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_NONE,offset=(x_lf,y_bt))
+	(contour,area)=get_largest_contour(cnts)
+
+	return (contour,area,(y_bt,y_tp,x_lf,x_rt))
+
+
+def get_contour_geometry(contour,area=None):
+
+	'''
+	This function computes the geometry of a contour once, so that it is not recomputed downstream.
+
+	area: the area of the contour if already computed by 'cv2.contourArea', otherwise it is taken from the moments
+
+	Returns (area,center,height,rect): the area, the center from the moments, the height (the longer side of the
+	minimum area rectangle) and the bounding rectangle (x,y,w,h) of the contour
+	'''
+
+	moments=cv2.moments(contour)
+	if area is None:
+		area=moments['m00']
+	center=(int(moments['m10']/moments['m00']),int(moments['m01']/moments['m00']))
+	(_,_),(w,h),_=cv2.minAreaRect(contour)
+
+	return (area,center,max(w,h),cv2.boundingRect(contour))
+
+
+class TrackField():
+
+	'''
+	This class is a list-like view of one kind of information in a TrackStore:
+	'view[n]', 'view[a:b]' (a list), 'view[n]=value', len() and iteration work as with a Python list,
+	and None is returned for the frames without the information.
+	'''
+
+	def __init__(self,track,field):
+
+		self.track=track
+		self.field=field
+
+
+	def __len__(self):
+
+		return self.track.length
+
+
+	def __iter__(self):
+
+		for n in range(self.track.length):
+			yield self.track.get(self.field,n)
+
+
+	def __getitem__(self,index):
+
+		if isinstance(index,slice):
+			return [self.track.get(self.field,n) for n in range(*index.indices(self.track.length))]
+
+		return self.track.get(self.field,self.track.check_index(index))
+
+
+	def __setitem__(self,index,value):
+
+		self.track.set(self.field,self.track.check_index(index),value)
+
+
+	def present(self,start=0,end=None):
+
+		return self.track.present(self.field,start=start,end=end)
+
+
+class TrackStore():
+
+	'''
+	This class stores the track of one animal / object over the analyzed frames in NumPy arrays,
+	instead of Python lists of length 'total_analysis_framecount' filled with None and tuples:
+	the centers (float32, N x 2), the heights and areas (float32), the bounding rectangles (int32, N x 4),
+	a validity bitmask per frame, and the contours in a ragged int16 point buffer indexed by offsets
+	(pixel coordinates of video frames fit in int16, the contours are returned as int32 for OpenCV).
+
+	'centers', 'heights', 'contours' and 'geometries' are TrackField views that work like the lists they replace,
+	so the analyzers can keep indexing them, for example 'self.animal_centers[i]=track.centers'.
+	The centers are returned as integer pixel coordinates (as computed from the moments),
+	and the geometries as (area,center,height,rect) from 'get_contour_geometry', sharing the center and height of the frame.
+
+	length: the number of analyzed frames
+	'''
+
+	CENTER=1
+	HEIGHT=2
+	CONTOUR=4
+	GEOMETRY=8
+
+	def __init__(self,length):
+
+		self.length=length
+		self.valid=np.zeros(length,dtype='uint8')
+		self.center_array=np.zeros((length,2),dtype='float32')
+		self.height_array=np.zeros(length,dtype='float32')
+		self.area_array=np.zeros(length,dtype='float32')
+		self.rect_array=np.zeros((length,4),dtype='int32')
+		self.contour_offsets=np.zeros(length,dtype='int64')
+		self.contour_sizes=np.zeros(length,dtype='int32')
+		self.points=np.zeros((1024,2),dtype='int16')
+		self.points_used=0
+
+		self.centers=TrackField(self,'center')
+		self.heights=TrackField(self,'height')
+		self.contours=TrackField(self,'contour')
+		self.geometries=TrackField(self,'geometry')
+
+
+	def check_index(self,n):
+
+		if n<0:
+			n+=self.length
+		if n<0 or n>=self.length:
+			raise IndexError('track index out of range')
+
+		return n
+
+
+	def get(self,field,n):
+
+		if field=='center':
+			if self.valid[n]&self.CENTER:
+				return (int(self.center_array[n,0]),int(self.center_array[n,1]))
+		elif field=='height':
+			if self.valid[n]&self.HEIGHT:
+				return float(self.height_array[n])
+		elif field=='contour':
+			if self.valid[n]&self.CONTOUR:
+				offset=self.contour_offsets[n]
+				return self.points[offset:offset+self.contour_sizes[n]].astype('int32').reshape(-1,1,2)
+		else:
+			if self.valid[n]&self.GEOMETRY:
+				return (float(self.area_array[n]),(int(self.center_array[n,0]),int(self.center_array[n,1])),float(self.height_array[n]),tuple(int(x) for x in self.rect_array[n]))
+
+		return None
+
+
+	def set(self,field,n,value):
+
+		if field=='center':
+			bit=self.CENTER
+			if value is not None:
+				self.center_array[n]=value
+		elif field=='height':
+			bit=self.HEIGHT
+			if value is not None:
+				self.height_array[n]=value
+		elif field=='contour':
+			bit=self.CONTOUR
+			if value is not None:
+				points=np.asarray(value).reshape(-1,2)
+				if self.points_used+len(points)>len(self.points):
+					new_points=np.zeros((max(2*len(self.points),self.points_used+len(points)),2),dtype='int16')
+					new_points[:self.points_used]=self.points[:self.points_used]
+					self.points=new_points
+				self.points[self.points_used:self.points_used+len(points)]=points
+				self.contour_offsets[n]=self.points_used
+				self.contour_sizes[n]=len(points)
+				self.points_used+=len(points)
+		else:
+			bit=self.GEOMETRY
+			if value is not None:
+				(area,center,height,rect)=value
+				self.area_array[n]=area
+				self.center_array[n]=center
+				self.height_array[n]=height
+				self.rect_array[n]=rect
+				self.valid[n]|=self.CENTER|self.HEIGHT
+
+		if value is None:
+			self.valid[n]&=~np.uint8(bit)
+		else:
+			self.valid[n]|=bit
+
+
+	def present(self,field='height',start=0,end=None):
+
+		# whether each frame from start to end (excluded) has the information, as a boolean array
+
+		bits={'center':self.CENTER,'height':self.HEIGHT,'contour':self.CONTOUR,'geometry':self.GEOMETRY}
+
+		if end is None:
+			end=self.length
+
+		return (self.valid[start:min(end,self.length)]&bits[field])!=0
+
+
+	def count(self,field='height'):
+
+		# the number of frames that have the information
+
+		return int(np.count_nonzero(self.present(field)))
+
+
+	def truncate(self,length):
+
+		# keep only the first 'length' frames, and compact the contour point buffer
+
+		length=min(length,self.length)
+		self.length=length
+		self.valid=self.valid[:length].copy()
+		self.center_array=self.center_array[:length].copy()
+		self.height_array=self.height_array[:length].copy()
+		self.area_array=self.area_array[:length].copy()
+		self.rect_array=self.rect_array[:length].copy()
+
+		has_contour=(self.valid&self.CONTOUR)!=0
+		offsets=self.contour_offsets[:length]
+		sizes=np.where(has_contour,self.contour_sizes[:length],0).astype('int32')
+		new_offsets=np.zeros(length,dtype='int64')
+		if length>0:
+			new_offsets[1:]=np.cumsum(sizes,dtype='int64')[:-1]
+		total=int(sizes.sum())
+		self.points=self.points[np.arange(total)+np.repeat(offsets-new_offsets,sizes)]
+		self.points_used=total
+		self.contour_offsets=new_offsets
+		self.contour_sizes=sizes
+
+
+	def nbytes(self):
+
+		# the memory used by the arrays of the track
+
+		return self.valid.nbytes+self.center_array.nbytes+self.height_array.nbytes+self.area_array.nbytes+self.rect_array.nbytes+self.contour_offsets.nbytes+self.contour_sizes.nbytes+self.points.nbytes
+
+
+def get_categorizable_frames(contours,start,end,length):
+
+	'''
+	This function returns the analyzed frame counts from start to end (excluded) at which
+	an animal is present and is absent in no more than half of the 'length' frames that end there,
+	which are the frames whose behaviors are categorized. The absent frames in each window are
+	counted from a cumulative sum instead of rescanning the window (start should not be less than length-1).
+
+	contours: the contours of the animal in each analyzed frame (None if absent), a list or a TrackField
+	'''
+
+	if end<=start:
+		return np.zeros(0,dtype='int64')
+
+	first=start-length+1
+	if isinstance(contours,TrackField):
+		presence=contours.present(start=first,end=end)
+	else:
+		presence=np.array([c is not None for c in contours[first:end]],dtype=bool)
+	absent=np.concatenate(([0],np.cumsum(~presence)))
+	positions=np.arange(length-1,len(presence))
+	absent_in_window=absent[positions+1]-absent[positions-length+1]
+
+	return positions[presence[positions]&(absent_in_window<=length/2)]+first
+
+
+def sample_frames(frames,stride):
+
+	'''
+	This function is used to categorize only every 'stride' categorizable frames of an animal,
+	returning the positions (in 'frames') of the frames to categorize, which always include the last one.
+	'''
+
+	positions=np.arange(0,len(frames),max(1,int(stride)))
 
-		frame_initial=background
+	if len(frames)>0 and positions[-1]!=len(frames)-1:
+		positions=np.append(positions,len(frames)-1)
 
-	print('Estimating the animal size...')
-	print(datetime.datetime.now())
+	return positions
 
-	if delta<10000:
-		
-		if ex_start!=0 or path_background is not None:
 
-			capture=cv2.VideoCapture(path_to_video)
-			frame_count=1
+def interpolate_predictions(frames,positions,predictions):
 
-			while True:
+	'''
+	This function linearly interpolates (along the analyzed frame counts) the outputs of the Categorizer
+	for the frames at 'positions' (from 'sample_frames') to all the frames in 'frames'.
+	'''
 
-				retval,frame=capture.read()
+	if len(positions)==len(frames):
+		return predictions
 
-				if frame is None:
-					break
+	frames=np.asarray(frames)
+	sampled_frames=frames[positions]
+	interpolated=[np.interp(frames,sampled_frames,predictions[:,i]) for i in range(predictions.shape[1])]
 
-				if framewidth is not None:
-					frame=cv2.resize(frame,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
+	return np.stack(interpolated,axis=1).astype(predictions.dtype)
 
-				if frame_initial is None:
-					frame_initial=frame
-				else:
-					if np.mean(frame)<np.mean(frame_initial)/delta:
-						stim_t=frame_count/fps
-						break
-					if np.mean(frame)>delta*np.mean(frame_initial):
-						stim_t=frame_count/fps
-						break
-						
-				frame_count+=1
 
-			capture.release()
+def get_behavior_probabilities(predictions,behavior_number,uncertain=0):
 
-	if t is None:
-		if stim_t is None:
-			es_start=0
-		else:
-			es_start=stim_t
-	else:
-		es_start=t
+	'''
+	This function converts the outputs of the Categorizer for a batch of frames into the probability of each behavior,
+	and finds the behavior of each frame whose probability is higher than the 2nd highest by more than 'uncertain'.
 
-	if duration>30 or duration<=0:
-		duration=30
-	es_end=es_start+duration
+	predictions: the outputs of the Categorizer (frames x 1 if there are 2 behaviors, otherwise frames x behavior_number)
+	behavior_number: the number of behaviors
 
-	capture=cv2.VideoCapture(path_to_video)
-	total_contour_area=[]
-	frame_count=1
-	min_area=(background.shape[1]/100)*(background.shape[0]/100)
-	max_area=(background.shape[1]*background.shape[0])*3/4
+	Returns (probabilities,labeled,winners): a list of the probabilities of each behavior in the frames,
+	whether a behavior is assigned to each frame, and the index of the most probable behavior in each frame
+	'''
 
-	if animal_vs_bg==1:
-		background_estimation=np.uint8(255-background)
-		background_low_estimation=np.uint8(255-background_low)
-		background_high_estimation=np.uint8(255-background_high)
+	if behavior_number==2:
+		# as in scalar NumPy arithmetic, 1-prediction is computed in float64
+		probability=predictions[:,0]
+		complement=1-probability.astype('float64')
+		probabilities=[complement,probability]
+		labeled=(probability!=0.5)&(np.abs(probability-complement)>uncertain)
+		winners=(probability>0.5).astype('int64')
 	else:
-		background_estimation=background
-		background_low_estimation=background_low
-		background_high_estimation=background_high
+		probabilities=[predictions[:,i] for i in range(behavior_number)]
+		top_two=np.sort(predictions,axis=1)[:,-2:]
+		labeled=(top_two[:,1]-top_two[:,0])>uncertain
+		winners=np.argmax(predictions,axis=1)
 
-	while True:
+	return (probabilities,labeled,winners)
 
-		retval,frame=capture.read()
 
-		if frame_initial is None:
-			frame_initial=frame
+def get_short_runs(labels,min_length):
 
-		if frame is None:
-			break
+	'''
+	This function finds the runs of identical consecutive labels that are shorter than min_length,
+	except the last run, which may continue. Returns a list of (start,end) positions (end excluded).
+	'''
 
-		if es_end is not None:
-			if frame_count>=es_end*fps:
-				break
+	labels=np.array(labels)
+	if len(labels)<2:
+		return []
 
-		if frame_count>=es_start*fps:
+	changes=np.flatnonzero(labels[1:]!=labels[:-1])+1
+	starts=np.concatenate(([0],changes[:-1]))
+	short=(changes-starts)<min_length
 
-			if framewidth is not None:
-				frame=cv2.resize(frame,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
+	return list(zip(starts[short].tolist(),changes[short].tolist()))
 
-			if animal_vs_bg==1:
-				frame=np.uint8(255-frame)
 
-			contour_area=0
+def filter_short_runs(event_probability,start,end,continued_length,min_length):
 
-			if np.mean(frame)<np.mean(frame_initial)/delta:
-				if animal_vs_bg==2:
-					foreground=cv2.absdiff(frame,background_low_estimation)
-				else:
-					foreground=cv2.subtract(frame,background_low_estimation)
-			elif np.mean(frame)>delta*np.mean(frame_initial):
-				if animal_vs_bg==2:
-					foreground=cv2.absdiff(frame,background_high_estimation)
-				else:
-					foreground=cv2.subtract(frame,background_high_estimation)
-			else:
-				if animal_vs_bg==2:
-					foreground=cv2.absdiff(frame,background_estimation)
-				else:
-					foreground=cv2.subtract(frame,background_estimation)
+	'''
+	This function labels the runs of identical behaviors in event_probability[start:end] that are shorter than min_length as 'NA',
+	when the frames are categorized batch by batch. The first run continues the last run of the previous batch,
+	which is continued_length frames long, and the last run is not labeled since it may continue in the next batch.
+	Returns the length of the last run, to be continued by the next batch.
+	'''
 
-			foreground=cv2.cvtColor(foreground,cv2.COLOR_BGR2GRAY)
-			thred=cv2.threshold(foreground,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)[1]
-			thred=cv2.morphologyEx(thred,cv2.MORPH_CLOSE,np.ones((kernel,kernel),np.uint8))
+	first=start-continued_length
+	labels=[event[0] for event in event_probability[first:end]]
 
-			if animal_vs_bg==2:
-				kernel_erode=max(kernel-4,1)
-				thred=cv2.erode(thred,np.ones((kernel_erode,kernel_erode),np.uint8))
-			contours,_=cv2.findContours(thred,cv2.RETR_LIST,cv2.CHAIN_APPROX_NONE)
+	for (run_start,run_end) in get_short_runs(labels,min_length):
+		event_probability[first+run_start:first+run_end]=[['NA',-1]]*(run_end-run_start)
 
-			for i in contours:
-				if min_area<cv2.contourArea(i)<max_area:
-					contour_area+=cv2.contourArea(i)
-			total_contour_area.append(contour_area)
+	changes=np.flatnonzero(np.array(labels[1:])!=np.array(labels[:-1]))
 
-		frame_count+=1
+	if len(changes)==0:
+		return len(labels)
 
-	capture.release()
+	return len(labels)-changes[-1]-1
 
-	print('Estimation completed!')
 
-	if len(total_contour_area)>0:
-		if animal_number==0:
-			print('Animal number is 0. Please enter the correct animal number!')
-			animal_area=1
-		else:
-			animal_area=(sum(total_contour_area)/len(total_contour_area))/animal_number
-	else:
-		print('No animal detected!')
-		animal_area=1
+def greedy_match(distances,unused_existing,unused_new,matches):
 
-	print('Single animal size: '+str(animal_area))
+	'''
+	This function matches the closest pair of (existing,new) centers first, then the next closest pair
+	among the unmatched ones, and so on, until either all existing or all new centers are matched.
 
-	if stim_t is None:
-		stim_t=2
+	distances: the distance matrix (existing x new)
+	unused_existing / unused_new: boolean arrays of the unmatched existing / new centers, updated in place
+	matches: the list of (index_in_existing,index_in_new) pairs to append to
+	'''
 
-	return (background,background_low,background_high,stim_t,animal_area)
+	length=distances.shape[1]
+	remaining=min(np.count_nonzero(unused_existing),np.count_nonzero(unused_new))
 
+	for idx in distances.flatten().argsort():
+		if remaining==0:
+			break
+		index_in_existing=int(idx//length)
+		index_in_new=int(idx%length)
+		if unused_existing[index_in_existing] and unused_new[index_in_new]:
+			unused_existing[index_in_existing]=False
+			unused_new[index_in_new]=False
+			matches.append((index_in_existing,index_in_new))
+			remaining-=1
 
-def crop_frame(frame,contours):
+
+def match_centers(existing_centers,centers,method='greedy',radius=None):
 
 	'''
-	This function is used to crop a frame to fit
-	the border of a list of contours.
-	'''
+	This function matches the centers of the animals detected in a frame to the existing centers of the tracked animals.
 
-	lfbt=np.array([contours[i].min(0) for i in range(len(contours)) if contours[i] is not None]).min(0)[0]
-	x_lf=lfbt[0]
-	y_bt=lfbt[1]
-	rttp=np.array([contours[i].max(0) for i in range(len(contours)) if contours[i] is not None]).max(0)[0]
-	x_rt=rttp[0]
-	y_tp=rttp[1]
+	method: 'greedy': match the closest pair first, then the next closest pair among the unmatched ones, and so on
+		'kdtree': the same matches as 'greedy' (ties are broken by index), but only the pairs within 'radius' are found (by a KD-tree) and sorted,
+			and the centers that remain unmatched are then matched by 'greedy', which is much faster when there are many animals
+		'hungarian': the matches with the smallest sum of distances (the linear sum assignment)
+	radius: the gating radius for 'kdtree', such as the size of an animal, if None, 'greedy' is used
 
-	w=x_rt-x_lf+1
-	h=y_tp-y_bt+1
+	Returns (matches,unused_existing_indices): the list of (index_in_existing,index_in_new) pairs, and the indices of the existing centers that are not matched
+	'''
 
-	difference=int(abs(w-h)/2)+1
+	existing_centers=np.array(existing_centers,dtype='float64').reshape(-1,2)
+	centers=np.array(centers,dtype='float64').reshape(-1,2)
+	unused_existing=np.ones(len(existing_centers),dtype=bool)
+	unused_new=np.ones(len(centers),dtype=bool)
+	matches=[]
+
+	if len(existing_centers)>0 and len(centers)>0:
+
+		if method=='hungarian':
+
+			rows,columns=linear_sum_assignment(distance.cdist(existing_centers,centers))
+			for index_in_existing,index_in_new in zip(rows,columns):
+				unused_existing[index_in_existing]=False
+				matches.append((int(index_in_existing),int(index_in_new)))
+
+		elif method=='kdtree' and radius is not None:
+
+			length=len(centers)
+			pairs=cKDTree(existing_centers).sparse_distance_matrix(cKDTree(centers),radius,output_type='ndarray')
+			candidates_existing=pairs['i'].astype('int64')
+			candidates_new=pairs['j'].astype('int64')
+			candidates_distances=np.sqrt(np.sum((existing_centers[candidates_existing]-centers[candidates_new])**2,axis=1))
+			order=np.lexsort((candidates_existing*length+candidates_new,candidates_distances))
+			for index_in_existing,index_in_new in zip(candidates_existing[order],candidates_new[order]):
+				if unused_existing[index_in_existing] and unused_new[index_in_new]:
+					unused_existing[index_in_existing]=False
+					unused_new[index_in_new]=False
+					matches.append((int(index_in_existing),int(index_in_new)))
+			existing_left=np.flatnonzero(unused_existing)
+			new_left=np.flatnonzero(unused_new)
+			if len(existing_left)>0 and len(new_left)>0:
+				left_matches=[]
+				greedy_match(distance.cdist(existing_centers[existing_left],centers[new_left]),unused_existing[existing_left],unused_new[new_left],left_matches)
+				for index_in_existing,index_in_new in left_matches:
+					unused_existing[existing_left[index_in_existing]]=False
+					matches.append((int(existing_left[index_in_existing]),int(new_left[index_in_new])))
 
-	if w>h:
-		y_bt=max(y_bt-difference-1,0)
-		y_tp=min(y_tp+difference+1,frame.shape[0])
-		x_lf=max(x_lf-1,0)
-		x_rt=min(x_rt+1,frame.shape[1])
-	if w<h:
-		y_bt=max(y_bt-1,0)
-		y_tp=min(y_tp+1,frame.shape[0])
-		x_lf=max(x_lf-difference-1,0)
-		x_rt=min(x_rt+difference+1,frame.shape[1])
+		else:
 
-	return (y_bt,y_tp,x_lf,x_rt)
+			greedy_match(distance.cdist(existing_centers,centers),unused_existing,unused_new,matches)
 
+	return (matches,[int(i) for i in np.flatnonzero(unused_existing)])
 
-def extract_blob_background(frame,contours,contour=None,channel=1,background_free=False,black_background=True):
 
-	'''
-	This function is used to keep the pixels for the area
-	inside a contour, and crop the frame to fit a list of 
-	contours. It can also include background pixels.
+def predict_centers(existing_centers,velocities,missed_counts):
 
-	channel: 1--gray scale blob
-			 3--RGB scale blob
-	black_background: whether to set background black
 	'''
+	This function predicts the centers of the tracked animals in the current frame with a constant velocity model:
+	each last seen center moves with its velocity for the frames since it was last seen.
+	The animals that are not registered yet or were deregistered (at (-10000,-10000)) stay where they are.
 
-	(y_bt,y_tp,x_lf,x_rt)=crop_frame(frame,contours)
-	if background_free:
-		mask=np.zeros_like(frame)
-		cv2.drawContours(mask,[contour],0,(255,255,255),-1)
-		masked_frame=frame*(mask/255.0)
-		if black_background is False:
-			masked_frame[mask==0]=255
-	else:
-		masked_frame=frame
-	blob=masked_frame[y_bt:y_tp,x_lf:x_rt]
-	blob=np.uint8(exposure.rescale_intensity(blob,out_range=(0,255)))
+	velocities: the velocities (N x 2, in pixels per frame) of the tracked animals
+	missed_counts: the number of consecutive frames each tracked animal was missed
 
-	if channel==1:
-		blob=cv2.cvtColor(blob,cv2.COLOR_BGR2GRAY)
-		blob=img_to_array(blob)
+	Returns the predicted centers (N x 2)
+	'''
 
-	return blob
+	existing_centers=np.array(existing_centers,dtype='float64').reshape(-1,2)
+	registered=np.any(existing_centers!=-10000,axis=1)
 
+	return existing_centers+velocities*(np.array(missed_counts,dtype='float64')[:,None]+1)*registered[:,None]
 
-def extract_blob_all(frame,y_bt,y_tp,x_lf,x_rt,contours=None,channel=1,background_free=False,black_background=True):
 
-	'''
-	This function is used to keep the pixels for the area
-	inside a list of contours, and crop the frame to fit 
-	the y_bt,y_tp,x_lf,x_rt coordinates.
+def update_velocities(velocities,existing_centers,centers,matches,missed_counts,smoothing=0.5):
 
-	channel: 1--gray scale blob
-			 3--RGB scale blob
-	black_background: whether to set background black
 	'''
+	This function updates (in place) the velocities of the tracked animals that are matched in the current frame,
+	from their displacements since they were last seen, exponentially smoothed over frames.
+	The animals that were not registered yet or were deregistered (at (-10000,-10000)) restart from 0.
 
-	if background_free:
-		mask=np.zeros_like(frame)
-		cv2.drawContours(mask,contours,-1,(255,255,255),-1)
-		masked_frame=frame*(mask/255.0)
-		if black_background is False:
-			masked_frame[mask==0]=255
-	else:
-		masked_frame=frame
-	blob=masked_frame[y_bt:y_tp,x_lf:x_rt]
-	blob=np.uint8(exposure.rescale_intensity(blob,out_range=(0,255)))
+	smoothing: the weight of the previous velocity
+	'''
 
-	if channel==1:
-		blob=cv2.cvtColor(blob,cv2.COLOR_BGR2GRAY)
-		blob=img_to_array(blob)
+	if len(matches)>0:
 
-	return blob
+		matches=np.array(matches)
+		existing_indices=matches[:,0]
+		existing_centers=np.array(existing_centers,dtype='float64').reshape(-1,2)[existing_indices]
+		centers=np.array(centers,dtype='float64').reshape(-1,2)[matches[:,1]]
+		frames=np.array(missed_counts,dtype='float64')[existing_indices]+1
+		measured=(centers-existing_centers)/frames[:,None]
+		restart=np.all(existing_centers==-10000,axis=1)
+		velocities[existing_indices]=np.where(restart[:,None],0,smoothing*velocities[existing_indices]+(1-smoothing)*measured)
 
 
-def get_inner(masked_frame_gray,contour):
+def get_inner(masked_frame_gray,contour,offset=(0,0)):
 
 	'''
 	This function is used to get the inner contours, which is used
 	when body parts are inlcuded in the pattern images.
+
+	offset: added to the inner contours when 'masked_frame_gray' is a crop of the frame
 	'''
 
 	blur=cv2.GaussianBlur(masked_frame_gray,(3,3),0)
 	edges=cv2.Canny(blur,20,75,apertureSize=3,L2gradient=True)
-	cnts,_=cv2.findContours(edges,cv2.RETR_CCOMP,cv2.CHAIN_APPROX_NONE)
+	cnts,_=cv2.findContours(edges,cv2.RETR_CCOMP,cv2.CHAIN_APPROX_NONE,offset=offset)
 
 	if len(cnts)>3:
 		inner=sorted(cnts,key=cv2.contourArea,reverse=True)[2:]
@@ -575,7 +1767,49 @@ def get_inner(masked_frame_gray,contour):
 	return inner
 
 
-def contour_frame(frame,animal_number,background,background_low,background_high,delta,contour_area,animal_vs_bg=0,include_bodyparts=False,animation_analyzer=False,channel=1,kernel=5,black_background=True):
+def load_arena(path_to_arena,framewidth,frameheight):
+
+	'''
+	This function loads an arena mask image (the arena in white, the rest in black),
+	such as the 'arena_mask.png' stored when drawing markers in videos,
+	and crops it to the bounding box of the arena for 'contour_frame'.
+
+	framewidth, frameheight: the size of the analyzed frames, to which the mask is resized
+
+	Returns (x_lf,y_tp,arena_mask): the left-top corner of the bounding box and the mask within it,
+	or None if the mask cannot be read or is empty.
+	'''
+
+	arena_mask=cv2.imread(path_to_arena,cv2.IMREAD_GRAYSCALE)
+
+	if arena_mask is None:
+		return None
+
+	if arena_mask.shape[0]!=frameheight or arena_mask.shape[1]!=framewidth:
+		arena_mask=cv2.resize(arena_mask,(framewidth,frameheight),interpolation=cv2.INTER_NEAREST)
+	arena_mask=np.uint8(arena_mask>0)*255
+
+	(x_lf,y_tp,w,h)=cv2.boundingRect(arena_mask)
+
+	if w==0 or h==0:
+		return None
+
+	return (x_lf,y_tp,arena_mask[y_tp:y_tp+h,x_lf:x_lf+w])
+
+
+def downsample_gray(frame,factor=8):
+
+	'''
+	This function shrinks a frame by 'factor' in each dimension and converts it to gray scale,
+	which is used to cheaply detect whether anything has changed between frames.
+	'''
+
+	small=cv2.resize(frame,(max(1,frame.shape[1]//factor),max(1,frame.shape[0]//factor)),interpolation=cv2.INTER_AREA)
+
+	return cv2.cvtColor(small,cv2.COLOR_BGR2GRAY)
+
+
+def contour_frame(frame,animal_number,background,background_low,background_high,delta,contour_area,animal_vs_bg=0,include_bodyparts=False,animation_analyzer=False,channel=1,kernel=5,black_background=True,arena=None):
 
 	'''
 	This function is used in 'background subtraction based detection method',
@@ -590,8 +1824,22 @@ def contour_frame(frame,animal_number,background,background_low,background_high,
 			 3--RGB scale blob
 	kernel: determines how fine the erosion or dilation operation is
 	black_background: whether to set background black
+	arena: if not None, (x_lf,y_tp,arena_mask) from 'load_arena', the detection only runs within the bounding box of the arena
+		   and the returned contours are in the coordinates of the full frame
+
+	Returns (contours,centers,heights,inners,geometries), geometries are the (area,center,height,rect) of the contours from 'get_contour_geometry'
 	'''
 
+	if arena is not None:
+		(x_lf,y_tp,arena_mask)=arena
+		(h,w)=arena_mask.shape
+		frame=frame[y_tp:y_tp+h,x_lf:x_lf+w]
+		background=background[y_tp:y_tp+h,x_lf:x_lf+w]
+		background_low=background_low[y_tp:y_tp+h,x_lf:x_lf+w]
+		background_high=background_high[y_tp:y_tp+h,x_lf:x_lf+w]
+	else:
+		x_lf=y_tp=0
+
 	if animal_vs_bg==1:
 		frame_dt=np.uint8(255-frame)
 	else:
@@ -614,40 +1862,153 @@ def contour_frame(frame,animal_number,background,background_low,background_high,
 			foreground=cv2.subtract(frame_dt,background)
 			
 	foreground=cv2.cvtColor(foreground,cv2.COLOR_BGR2GRAY)
+	if arena is not None:
+		foreground=cv2.bitwise_and(foreground,arena_mask)
 	thred=cv2.threshold(foreground,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)[1]
 	thred=cv2.morphologyEx(thred,cv2.MORPH_CLOSE,np.ones((kernel,kernel),np.uint8))
 	if animal_vs_bg==2:
 		kernel_erode=max(kernel-4,1)
 		thred=cv2.erode(thred,np.ones((kernel_erode,kernel_erode),np.uint8))
-	cnts,_=cv2.findContours(thred,cv2.RETR_LIST,cv2.CHAIN_APPROX_NONE)
+	cnts,_=cv2.findContours(thred,cv2.RETR_LIST,cv2.CHAIN_APPROX_NONE,offset=(x_lf,y_tp))
 
 	contours=[]
 	centers=[]
 	heights=[]
 	inners=[]
+	geometries=[]
+
+	areas=[cv2.contourArea(i) for i in cnts]
 
 	if animal_number>1:
-		for i in cnts:
-			if contour_area*0.2<cv2.contourArea(i)<contour_area*1.5:
-				contours.append(i)
-		contours=sorted(contours,key=cv2.contourArea)[-animal_number:]
+		candidates=[(area,i) for area,i in zip(areas,cnts) if contour_area*0.2<area<contour_area*1.5]
+		candidates=sorted(candidates,key=lambda x:x[0])[-animal_number:]
 	else:
-		contours=[sorted(cnts,key=cv2.contourArea,reverse=True)[0]]
-
-	if len(contours)>0:
-		for i in contours:
-			centers.append((int(cv2.moments(i)['m10']/cv2.moments(i)['m00']),int(cv2.moments(i)['m01']/cv2.moments(i)['m00'])))
-			(_,_),(w,h),_=cv2.minAreaRect(i)
-			heights.append(max(w,h))
+		candidates=[sorted(zip(areas,cnts),key=lambda x:x[0],reverse=True)[0]]
+
+	if len(candidates)>0:
+		for area,i in candidates:
+			geometry=get_contour_geometry(i,area=area)
+			contours.append(i)
+			centers.append(geometry[1])
+			heights.append(geometry[2])
+			geometries.append(geometry)
 			if include_bodyparts:
 				mask=np.zeros_like(frame)
-				cv2.drawContours(mask,[i],0,(255,255,255),-1)
+				cv2.drawContours(mask,[i],0,(255,255,255),-1,offset=(-x_lf,-y_tp))
 				mask=cv2.dilate(mask,np.ones((5,5),np.uint8))
 				masked_frame=frame_dt*(mask/255)
 				gray=cv2.cvtColor(np.uint8(masked_frame),cv2.COLOR_BGR2GRAY)
-				inners.append(get_inner(gray,i))
+				inners.append(get_inner(gray,i,offset=(x_lf,y_tp)))
 
-	return (contours,centers,heights,inners)
+	return (contours,centers,heights,inners,geometries)
+
+
+loaded_categorizers={}
+
+
+def get_modified_time(path):
+
+	'''
+	This function returns the latest modification time of a file,
+	or of any file in a folder (such as a Categorizer saved in the SavedModel format).
+	'''
+
+	modified_time=os.path.getmtime(path)
+
+	if os.path.isdir(path):
+		for root,folders,files in os.walk(path):
+			for name in folders+files:
+				modified_time=max(modified_time,os.path.getmtime(os.path.join(root,name)))
+
+	return modified_time
+
+
+def load_categorizer(path_to_categorizer):
+
+	'''
+	This function loads a Categorizer once per process. The loaded model is kept in 'loaded_categorizers'
+	by its path and modification time, so the videos / images analyzed in a batch share one model,
+	together with the predict function that Keras traces on its first 'predict' call.
+	The Categorizer is loaded again only if it has been modified since.
+	'''
+
+	path=os.path.abspath(path_to_categorizer)
+	modified_time=get_modified_time(path)
+
+	if path not in loaded_categorizers or loaded_categorizers[path][0]!=modified_time:
+		loaded_categorizers[path]=(modified_time,load_model(path))
+
+	return loaded_categorizers[path][1]
+
+
+def predict_in_chunks(categorizer,pattern_images,animations=None,chunk_size=1024,batch_size=32):
+
+	'''
+	Run a Categorizer over lists of pattern images (and animations) without stacking them all at once
+
+	categorizer: the loaded Categorizer
+	pattern_images: the list of pattern images (uint8 or float32 arrays, 0-255)
+	animations: the list of animations matching pattern_images, None if the Categorizer has no Animation Analyzer
+	chunk_size: how many samples are converted to a normalized float32 array at a time; a multiple of batch_size keeps the batches identical to a single predict call
+	batch_size: the batch size passed to predict
+
+	Returns the predictions of all samples concatenated in the input order
+	'''
+
+	predictions=[]
+
+	for start in range(0,len(pattern_images),chunk_size):
+		end=start+chunk_size
+		with tf.device('CPU'):
+			pattern_batch=tf.convert_to_tensor(np.array(pattern_images[start:end],dtype='float32')/255.0)
+			if animations is not None:
+				animation_batch=tf.convert_to_tensor(np.array(animations[start:end],dtype='float32')/255.0)
+		if animations is not None:
+			inputs=[animation_batch,pattern_batch]
+		else:
+			inputs=pattern_batch
+		predictions.append(categorizer.predict(inputs,batch_size=batch_size,verbose=0))
+
+	return np.concatenate(predictions,axis=0)
+
+
+def get_canvas(frame,y_bt,y_tp,x_lf,x_rt,margin):
+
+	'''
+	This function is used to draw contours on a canvas that only covers a crop of the frame,
+	instead of on a canvas as large as the frame. The canvas extends the crop by 'margin' (within the frame),
+	so that contours drawn with a thickness up to 'margin' are the same inside the crop as if drawn on the frame.
+
+	Returns (shape,offset,crop): the shape of the canvas, the offset to draw the contours on the canvas,
+	and the crop (y_bt:y_tp,x_lf:x_rt) in the coordinates of the canvas
+	'''
+
+	canvas_bt=max(y_bt-margin,0)
+	canvas_tp=min(y_tp+margin,frame.shape[0])
+	canvas_lf=max(x_lf-margin,0)
+	canvas_rt=min(x_rt+margin,frame.shape[1])
+
+	shape=(canvas_tp-canvas_bt,canvas_rt-canvas_lf)+frame.shape[2:]
+	offset=(-canvas_lf,-canvas_bt)
+	crop=(slice(y_bt-canvas_bt,y_tp-canvas_bt),slice(x_lf-canvas_lf,x_rt-canvas_lf))
+
+	return (shape,offset,crop)
+
+
+def get_std_mask(std_counts,std_number,std):
+
+	'''
+	This function finds the pixels where the standard deviation of 'std_number' masks of the inners
+	(255 inside the inners and 0 elsewhere) is lower than 'std', from the number of masks covering each pixel ('std_counts'),
+	without stacking the masks: for such masks, the running sum is 255*std_counts and the running sum of squares is 255*255*std_counts,
+	so the variance is 255*255*std_counts*(std_number-std_counts)/std_number**2.
+	The comparison is done on the squares in integers, so it is exact for any number of masks (any window length).
+	'''
+
+	std_number=max(std_number,1)
+	std_counts=std_counts.astype('int64')
+
+	return 65025*std_counts*(std_number-std_counts)<(std*std_number)**2
 
 
 def generate_patternimage(frame,outlines,inners=None,std=0):
@@ -660,67 +2021,67 @@ def generate_patternimage(frame,outlines,inners=None,std=0):
 	std: a integer between 0 and 255, higher std, less inners are included in the pattern images
 	'''
 
+	(y_bt,y_tp,x_lf,x_rt)=crop_frame(frame,outlines)
+	p_size=int(max(abs(y_bt-y_tp),abs(x_lf-x_rt))/150+1)
+	(shape,offset,crop)=get_canvas(frame,y_bt,y_tp,x_lf,x_rt,2*p_size+2)
+
 	if inners is not None:
-		background_inners=np.zeros_like(frame)
-		background_outers=np.zeros_like(frame)
+		background_inners=np.zeros(shape,dtype=frame.dtype)
+		background_outers=np.zeros(shape,dtype=frame.dtype)
 
-	background_outlines=np.zeros_like(frame)
+	background_outlines=np.zeros(shape,dtype=frame.dtype)
 
 	if std>0:
-		backgrounds_std=[]
-
-	(y_bt,y_tp,x_lf,x_rt)=crop_frame(frame,outlines)
+		std_mask=np.zeros(shape[:2],dtype='uint8')
+		std_counts=np.zeros(shape[:2],dtype='int32')
+		std_number=0
 
 	length=len(outlines)
-	p_size=int(max(abs(y_bt-y_tp),abs(x_lf-x_rt))/150+1)
 
 	for n,outline in enumerate(outlines):
 
 		if outline is not None:
 
 			if std>0:
-				background_std=np.zeros_like(frame)
 				if inners is not None:
-					cv2.drawContours(background_std,inners[n],-1,(255,255,255),-1)
-					backgrounds_std.append(background_std)
+					std_mask[:]=0
+					cv2.drawContours(std_mask,inners[n],-1,1,-1,offset=offset)
+					std_counts+=std_mask
+					std_number+=1
 
 			if n<length/4:
 				d=n*int((255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255,d,0),p_size)
+				cv2.drawContours(background_outlines,[outline],0,(255,d,0),p_size,offset=offset)
 				if inners is not None:
-					cv2.drawContours(background_inners,inners[n],-1,(255,d,0),p_size)	
+					cv2.drawContours(background_inners,inners[n],-1,(255,d,0),p_size,offset=offset)	
 			elif n<length/2:
 				d=int((n-length/4)*(255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255,255,d),p_size)
+				cv2.drawContours(background_outlines,[outline],0,(255,255,d),p_size,offset=offset)
 				if inners is not None:
-					cv2.drawContours(background_inners,inners[n],-1,(255,255,d),p_size)
+					cv2.drawContours(background_inners,inners[n],-1,(255,255,d),p_size,offset=offset)
 			elif n<3*length/4:
 				d=int((n-length/2)*(255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255,255-d,255),p_size)
+				cv2.drawContours(background_outlines,[outline],0,(255,255-d,255),p_size,offset=offset)
 				if inners is not None:
-					cv2.drawContours(background_inners,inners[n],-1,(255,255-d,255),p_size)
+					cv2.drawContours(background_inners,inners[n],-1,(255,255-d,255),p_size,offset=offset)
 			else:
 				d=int((n-3*length/4)*(255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255-d,0,255),p_size)
+				cv2.drawContours(background_outlines,[outline],0,(255-d,0,255),p_size,offset=offset)
 				if inners is not None:
-					cv2.drawContours(background_inners,inners[n],-1,(255-d,0,255),p_size)
+					cv2.drawContours(background_inners,inners[n],-1,(255-d,0,255),p_size,offset=offset)
 
 			if inners is not None:
-				cv2.drawContours(background_outers,[outline],0,(255,255,255),int(2*p_size))
+				cv2.drawContours(background_outers,[outline],0,(255,255,255),int(2*p_size),offset=offset)
 
-	outlines_image=background_outlines[y_bt:y_tp,x_lf:x_rt]
+	outlines_image=background_outlines[crop]
 
 	if inners is not None:
-		inners_image=background_inners[y_bt:y_tp,x_lf:x_rt]
-		outers_image=background_outers[y_bt:y_tp,x_lf:x_rt]
+		inners_image=background_inners[crop]
+		outers_image=background_outers[crop]
 		inners_image=cv2.subtract(inners_image,outers_image)
 
 	if std>0:
-		backgrounds_std=np.array(backgrounds_std,dtype='float32')
-		std_images=backgrounds_std[:,y_bt:y_tp,x_lf:x_rt]
-		std_image=std_images.std(0)
-
-		inners_image[std_image<std]=0
+		inners_image[get_std_mask(std_counts[crop],std_number,std)]=0
 
 	if inners is not None:
 		pattern_image=cv2.add(inners_image,outlines_image)
@@ -747,68 +2108,69 @@ def generate_patternimage_all(frame,y_bt,y_tp,x_lf,x_rt,outlines_list,inners_lis
 	else:
 		inners_length=len(inners_list[0])
 
+	p_size=int(max(abs(y_bt-y_tp),abs(x_lf-x_rt))/150+1)
+	(shape,offset,crop)=get_canvas(frame,y_bt,y_tp,x_lf,x_rt,2*p_size+2)
+
 	if inners_length>0:
-		background_inners=np.zeros_like(frame)
-		background_outers=np.zeros_like(frame)
+		background_inners=np.zeros(shape,dtype=frame.dtype)
+		background_outers=np.zeros(shape,dtype=frame.dtype)
 
-	background_outlines=np.zeros_like(frame)
+	background_outlines=np.zeros(shape,dtype=frame.dtype)
 
 	if std>0:
-		backgrounds_std=[]
+		std_mask=np.zeros(shape[:2],dtype='uint8')
+		std_counts=np.zeros(shape[:2],dtype='int32')
+		std_number=0
 
 	length=len(outlines_list)
-	p_size=int(max(abs(y_bt-y_tp),abs(x_lf-x_rt))/150+1)
 
 	for n,outlines in enumerate(outlines_list):
 
 		if std>0:
-			background_std=np.zeros_like(frame)
 			if inners_length>0:
+				std_mask[:]=0
 				for inners in inners_list[n]:
-					cv2.drawContours(background_std,inners,-1,(255,255,255),-1)
-				backgrounds_std.append(background_std)
+					cv2.drawContours(std_mask,inners,-1,1,-1,offset=offset)
+				std_counts+=std_mask
+				std_number+=1
 
 		if n<length/4:
 			d=n*int((255*4/length))
-			cv2.drawContours(background_outlines,outlines,-1,(255,d,0),p_size)
+			cv2.drawContours(background_outlines,outlines,-1,(255,d,0),p_size,offset=offset)
 			if inners_length>0:
 				for inners in inners_list[n]:
-					cv2.drawContours(background_inners,inners,-1,(255,d,0),p_size)	
+					cv2.drawContours(background_inners,inners,-1,(255,d,0),p_size,offset=offset)	
 		elif n<length/2:
 			d=int((n-length/4)*(255*4/length))
-			cv2.drawContours(background_outlines,outlines,-1,(255,255,d),p_size)
+			cv2.drawContours(background_outlines,outlines,-1,(255,255,d),p_size,offset=offset)
 			if inners_length>0:
 				for inners in inners_list[n]:
-					cv2.drawContours(background_inners,inners,-1,(255,255,d),p_size)
+					cv2.drawContours(background_inners,inners,-1,(255,255,d),p_size,offset=offset)
 		elif n<3*length/4:
 			d=int((n-length/2)*(255*4/length))
-			cv2.drawContours(background_outlines,outlines,-1,(255,255-d,255),p_size)
+			cv2.drawContours(background_outlines,outlines,-1,(255,255-d,255),p_size,offset=offset)
 			if inners_length>0:
 				for inners in inners_list[n]:
-					cv2.drawContours(background_inners,inners,-1,(255,255-d,255),p_size)
+					cv2.drawContours(background_inners,inners,-1,(255,255-d,255),p_size,offset=offset)
 		else:
 			d=int((n-3*length/4)*(255*4/length))
-			cv2.drawContours(background_outlines,outlines,-1,(255-d,0,255),p_size)
+			cv2.drawContours(background_outlines,outlines,-1,(255-d,0,255),p_size,offset=offset)
 			if inners_length>0:
 				for inners in inners_list[n]:
-					cv2.drawContours(background_inners,inners,-1,(255-d,0,255),p_size)
+					cv2.drawContours(background_inners,inners,-1,(255-d,0,255),p_size,offset=offset)
 
 		if inners_length>0:
-			cv2.drawContours(background_outers,outlines,-1,(255,255,255),int(2*p_size))
+			cv2.drawContours(background_outers,outlines,-1,(255,255,255),int(2*p_size),offset=offset)
 
-	outlines_image=background_outlines[y_bt:y_tp,x_lf:x_rt]
+	outlines_image=background_outlines[crop]
 
 	if inners_length>0:
-		inners_image=background_inners[y_bt:y_tp,x_lf:x_rt]
-		outers_image=background_outers[y_bt:y_tp,x_lf:x_rt]
+		inners_image=background_inners[crop]
+		outers_image=background_outers[crop]
 		inners_image=cv2.subtract(inners_image,outers_image)
 
 	if std>0:
-		backgrounds_std=np.array(backgrounds_std,dtype='float32')
-		std_images=backgrounds_std[:,y_bt:y_tp,x_lf:x_rt]
-		std_image=std_images.std(0)
-
-		inners_image[std_image<std]=0
+		inners_image[get_std_mask(std_counts[crop],std_number,std)]=0
 
 	if inners_length>0:
 		pattern_image=cv2.add(inners_image,outlines_image)
@@ -832,25 +2194,28 @@ def generate_patternimage_interact(frame,outlines,other_outlines,inners=None,oth
 	total_outlines=functools.reduce(operator.iconcat,[ol for ol in other_outlines if ol is not None],[])
 	total_outlines+=outlines
 	(y_bt,y_tp,x_lf,x_rt)=crop_frame(frame,total_outlines)
+	p_size=int(max(abs(y_bt-y_tp),abs(x_lf-x_rt))/150+1)
+	(shape,offset,crop)=get_canvas(frame,y_bt,y_tp,x_lf,x_rt,2*p_size+2)
 
 	if inners is not None:
-		background_inners=np.zeros_like(frame)
-		background_outers=np.zeros_like(frame)
+		background_inners=np.zeros(shape,dtype=frame.dtype)
+		background_outers=np.zeros(shape,dtype=frame.dtype)
 
-	background_outlines=np.zeros_like(frame)
+	background_outlines=np.zeros(shape,dtype=frame.dtype)
 
 	if std>0:
-		backgrounds_std=[]
+		std_mask=np.zeros(shape[:2],dtype='uint8')
+		std_counts=np.zeros(shape[:2],dtype='int32')
+		std_number=0
 
 	length=len(outlines)
-	p_size=int(max(abs(y_bt-y_tp),abs(x_lf-x_rt))/150+1)
 
 	for n,outline in enumerate(outlines):
 
 		other_outline=other_outlines[n]
 		if len(other_outline)>0:
 			if other_outline[0] is not None:
-				cv2.drawContours(background_outlines,other_outline,-1,(150,150,150),p_size)
+				cv2.drawContours(background_outlines,other_outline,-1,(150,150,150),p_size,offset=offset)
 
 		if outline is not None:
 
@@ -858,57 +2223,54 @@ def generate_patternimage_interact(frame,outlines,other_outlines,inners=None,oth
 				inner=inners[n]
 				other_inner=functools.reduce(operator.iconcat,[ir for ir in other_inners[n] if ir is not None],[])
 				if other_inner is not None:
-					cv2.drawContours(background_inners,other_inner,-1,(150,150,150),p_size)
+					cv2.drawContours(background_inners,other_inner,-1,(150,150,150),p_size,offset=offset)
 				if std>0:
-					background_std=np.zeros_like(frame)
+					std_mask[:]=0
 					if inner is not None:
-						cv2.drawContours(background_std,inner,-1,(255,255,255),-1)
+						cv2.drawContours(std_mask,inner,-1,1,-1,offset=offset)
 					if other_inner is not None:
-						cv2.drawContours(background_std,other_inner,-1,(255,255,255),-1)
-					backgrounds_std.append(background_std)
+						cv2.drawContours(std_mask,other_inner,-1,1,-1,offset=offset)
+					std_counts+=std_mask
+					std_number+=1
 			else:
 				inner=None
 
 			if n<length/4:
 				d=n*int((255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255,d,0),p_size)
+				cv2.drawContours(background_outlines,[outline],0,(255,d,0),p_size,offset=offset)
 				if inner is not None:
-					cv2.drawContours(background_inners,inner,-1,(255,d,0),p_size)
+					cv2.drawContours(background_inners,inner,-1,(255,d,0),p_size,offset=offset)
 			elif n<length/2:
 				d=int((n-length/4)*(255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255,255,d),p_size)
+				cv2.drawContours(background_outlines,[outline],0,(255,255,d),p_size,offset=offset)
 				if inner is not None:
-					cv2.drawContours(background_inners,inner,-1,(255,255,d),p_size)
+					cv2.drawContours(background_inners,inner,-1,(255,255,d),p_size,offset=offset)
 			elif n<3*length/4:
 				d=int((n-length/2)*(255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255,255-d,255),p_size)
+				cv2.drawContours(background_outlines,[outline],0,(255,255-d,255),p_size,offset=offset)
 				if inner is not None:
-					cv2.drawContours(background_inners,inner,-1,(255,255-d,255),p_size)
+					cv2.drawContours(background_inners,inner,-1,(255,255-d,255),p_size,offset=offset)
 			else:
 				d=int((n-3*length/4)*(255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255-d,0,255),p_size)
+				cv2.drawContours(background_outlines,[outline],0,(255-d,0,255),p_size,offset=offset)
 				if inner is not None:
-					cv2.drawContours(background_inners,inner,-1,(255-d,0,255),p_size)
+					cv2.drawContours(background_inners,inner,-1,(255-d,0,255),p_size,offset=offset)
 
 			if inners is not None:
-				cv2.drawContours(background_outers,[outline],0,(255,255,255),int(2*p_size))
+				cv2.drawContours(background_outers,[outline],0,(255,255,255),int(2*p_size),offset=offset)
 				if len(other_outline)>0:
 					if other_outline[0] is not None:
-						cv2.drawContours(background_outers,other_outline,-1,(150,150,150),int(2*p_size))
+						cv2.drawContours(background_outers,other_outline,-1,(150,150,150),int(2*p_size),offset=offset)
 
-	outlines_image=background_outlines[y_bt:y_tp,x_lf:x_rt]
+	outlines_image=background_outlines[crop]
 
 	if inners is not None:
-		inners_image=background_inners[y_bt:y_tp,x_lf:x_rt]
-		outers_image=background_outers[y_bt:y_tp,x_lf:x_rt]
+		inners_image=background_inners[crop]
+		outers_image=background_outers[crop]
 		inners_image=cv2.subtract(inners_image,outers_image)
 
 	if std>0:
-		backgrounds_std=np.array(backgrounds_std,dtype='float32')
-		std_images=backgrounds_std[:,y_bt:y_tp,x_lf:x_rt]
-		std_image=std_images.std(0)
-
-		inners_image[std_image<std]=0
+		inners_image[get_std_mask(std_counts[crop],std_number,std)]=0
 
 	if inners is not None:
 		pattern_image=cv2.add(inners_image,outlines_image)
@@ -1047,7 +2409,7 @@ def extract_frames(path_to_video,out_path,framewidth=None,start_t=0,duration=0,s
 	print('The image examples stored in: '+out_path)
 
 
-def preprocess_video(path_to_video,out_folder,framewidth,trim_video=False,time_windows=[[0,10]],enhance_contrast=True,contrast=1.0,crop_frame=True,left=0,right=0,top=0,bottom=0,fps_new=None):
+def preprocess_video(path_to_video,out_folder,framewidth,trim_video=False,time_windows=[[0,10]],enhance_contrast=True,contrast=1.0,crop_frame=True,left=0,right=0,top=0,bottom=0,fps_new=None,queue_size=32):
 
 	'''
 	This function is used to preprocess a video.
@@ -1055,6 +2417,7 @@ def preprocess_video(path_to_video,out_folder,framewidth,trim_video=False,time_w
 	time_windows: if trim_video is True, the time_windows will form a new, trimmed video
 	contrast: only valide if enhance_contrast is True
 	left...bottom: the edges defining the cropped frame if crop_frame is True
+	queue_size: the maximum number of frames decoded ahead by the FrameReader
 	'''
 
 	capture=cv2.VideoCapture(path_to_video)
@@ -1064,9 +2427,13 @@ def preprocess_video(path_to_video,out_folder,framewidth,trim_video=False,time_w
 	width=int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
 	height=int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
+	capture.release()
+
 	if framewidth is not None:
 		w_resize=int(framewidth)
 		h_resize=int(framewidth*height/width)
+	else:
+		w_resize=h_resize=None
 
 	if crop_frame:
 		w=int(right-left)
@@ -1099,6 +2466,7 @@ def preprocess_video(path_to_video,out_folder,framewidth,trim_video=False,time_w
 		fps_new=fps
 
 	writer=cv2.VideoWriter(os.path.join(out_folder,name+added_name+'_processed.avi'),cv2.VideoWriter_fourcc(*'MJPG'),int(fps_new),(w,h),True)
+	capture=FrameReader(path_to_video,framewidth=w_resize,frameheight=h_resize,queue_size=queue_size)
 	frame_count=0
 
 	while True:
@@ -1113,9 +2481,6 @@ def preprocess_video(path_to_video,out_folder,framewidth,trim_video=False,time_w
 		if frame_count-1 in dropped_frames:
 			continue
 
-		if framewidth is not None:
-			frame=cv2.resize(frame,(w_resize,h_resize),interpolation=cv2.INTER_AREA)
-
 		if crop_frame:
 			frame=frame[top:bottom,left:right,:]
 
@@ -0,0 +1,52 @@
+'''
+Copyright (C)
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see https://tldrlegal.com/license/gnu-general-public-license-v3-(gpl-3)#fulltext.
+
+For license issues, please contact:
+
+Dr. Bing Ye
+Life Sciences Institute
+University of Michigan
+210 Washtenaw Avenue, Room 5403
+Ann Arbor, MI 48109-2216
+USA
+
+Email: bingye@umich.edu
+'''
+
+
+
+
+
+import pytest
+
+np=pytest.importorskip('numpy')
+pytest.importorskip('torch')
+
+from LabGym.detector import DetectorWorker  # noqa: E402
+
+
+
+class FailingDetector():
+
+	def inference(self,inputs):
+
+		raise ValueError('inference failed')
+
+
+@pytest.mark.parametrize('queue_size',[0,2])
+def test_detector_worker_raises_errors_of_the_detector(queue_size):
+
+	worker=DetectorWorker(FailingDetector(),queue_size=queue_size)
+
+	try:
+		with pytest.raises(ValueError,match='inference failed'):
+			worker.submit([np.zeros((8,8,3),dtype='uint8')],0)
+			worker.get()
+	finally:
+		worker.release()
+
+	if worker.thread is not None:
+		assert not worker.thread.is_alive()
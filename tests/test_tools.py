@@ -0,0 +1,356 @@
+'''
+Copyright (C)
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see https://tldrlegal.com/license/gnu-general-public-license-v3-(gpl-3)#fulltext.
+
+For license issues, please contact:
+
+Dr. Bing Ye
+Life Sciences Institute
+University of Michigan
+210 Washtenaw Avenue, Room 5403
+Ann Arbor, MI 48109-2216
+USA
+
+Email: bingye@umich.edu
+'''
+
+
+
+
+
+import os
+import pytest
+
+np=pytest.importorskip('numpy')
+cv2=pytest.importorskip('cv2')
+
+from LabGym.tools import FrameReader,close_mask,estimate_constants,extract_background,filter_short_runs,get_categorizable_frames,get_exclusion_mask,get_short_runs,get_std_mask,interpolate_predictions,match_centers,predict_centers,prune_cache,sample_frames,update_velocities  # noqa: E402
+
+
+
+def stacked_background(frames,animal_vs_bg):
+
+	# the window-by-window background extraction that 'extract_background' replaces
+
+	frames=np.array(frames,dtype='float32')
+	mean_overall=frames.mean(0)
+	frames_mean=[]
+	check_frames=[]
+	n=0
+
+	while n<len(frames)-101:
+		frames_temp=frames[n:n+100]
+		mean=frames_temp.mean(0)
+		frames_mean.append(mean)
+		if animal_vs_bg==2:
+			check_frames.append(abs(mean-mean_overall)+frames_temp.std(0))
+		elif animal_vs_bg==1:
+			frames_temp_inv=255-frames_temp
+			check_frames.append(frames_temp_inv.mean(0)+frames_temp_inv.std(0))
+		else:
+			check_frames.append(mean+frames_temp.std(0))
+		n+=30
+
+	frames_mean=np.array(frames_mean,dtype='float32')
+	check_frames=np.array(check_frames,dtype='float32')
+
+	return np.uint8(np.take_along_axis(frames_mean,np.argsort(check_frames,axis=0),axis=0)[0])
+
+
+@pytest.mark.parametrize('len_frames',[102,131,250,400])
+@pytest.mark.parametrize('animal_vs_bg',[0,1,2])
+def test_extract_background_matches_stacked_windows(len_frames,animal_vs_bg):
+
+	rng=np.random.default_rng(len_frames)
+	frames=[rng.integers(0,256,(24,32,3),dtype='uint8') for i in range(len_frames)]
+
+	np.testing.assert_array_equal(extract_background(frames,stable_illumination=False,animal_vs_bg=animal_vs_bg),stacked_background(frames,animal_vs_bg))
+
+
+def test_sampled_background_finds_the_stimulation_start_time(tmp_path):
+
+	path_to_video=str(tmp_path/'stimulation.avi')
+	writer=cv2.VideoWriter(path_to_video,cv2.VideoWriter_fourcc(*'MJPG'),10,(64,64))
+	for i in range(60):
+		frame=np.full((64,64,3),200 if i>=37 else 80,dtype='uint8')
+		cv2.rectangle(frame,(10+i//2,20),(20+i//2,30),(0,0,0),-1)
+		writer.write(frame)
+	writer.release()
+
+	stim_t=estimate_constants(path_to_video,1.5,1,queue_size=0)[3]
+
+	assert stim_t==3.8
+	assert estimate_constants(path_to_video,1.5,1,queue_size=0,background_samples=7)[3]==stim_t
+
+
+@pytest.mark.parametrize('queue_size',[0,4])
+def test_frame_reader_raises_errors_of_reading(tmp_path,queue_size):
+
+	path_to_video=str(tmp_path/'frames.avi')
+	writer=cv2.VideoWriter(path_to_video,cv2.VideoWriter_fourcc(*'MJPG'),10,(64,64))
+	for i in range(5):
+		writer.write(np.full((64,64,3),i*40,dtype='uint8'))
+	writer.release()
+
+	reader=FrameReader(path_to_video,framewidth=16,frameheight=None,queue_size=queue_size)
+
+	try:
+		with pytest.raises(cv2.error):
+			reader.read()
+	finally:
+		reader.release()
+
+	if reader.thread is not None:
+		assert not reader.thread.is_alive()
+
+
+class UnseekableCapture():
+
+	# a video capture whose reached frame index never matches the frame index to seek to
+
+	grabs=0
+	video_capture=cv2.VideoCapture
+
+	def __init__(self,path_to_video):
+		self.capture=UnseekableCapture.video_capture(path_to_video)
+
+	def set(self,prop,value):
+		return False
+
+	def get(self,prop):
+		return -1
+
+	def grab(self):
+		UnseekableCapture.grabs+=1
+		return self.capture.grab()
+
+	def read(self):
+		return self.capture.read()
+
+	def release(self):
+		self.capture.release()
+
+
+def test_frame_reader_skips_forward_when_the_video_is_not_seekable(tmp_path,monkeypatch):
+
+	path_to_video=str(tmp_path/'frames.avi')
+	writer=cv2.VideoWriter(path_to_video,cv2.VideoWriter_fourcc(*'MJPG'),10,(64,64))
+	for i in range(50):
+		writer.write(np.full((64,64,3),i*5,dtype='uint8'))
+	writer.release()
+
+	monkeypatch.setattr(cv2,'VideoCapture',UnseekableCapture)
+	reader=FrameReader(path_to_video,queue_size=0,frame_indices=[3,10,11,30,48])
+	frames=[]
+
+	while True:
+		retval,frame=reader.read()
+		if frame is None:
+			break
+		frames.append((reader.frame_index,int(frame.mean()/5+0.5)))
+	reader.release()
+
+	assert frames==[(3,3),(10,10),(11,11),(30,30),(48,48)]
+	assert UnseekableCapture.grabs==3+6+18+17
+
+
+def test_prune_cache_deletes_the_least_recently_used_files(tmp_path):
+
+	for i in range(5):
+		(tmp_path/(str(i)+'.npz')).write_bytes(bytes(1000))
+		os.utime(str(tmp_path/(str(i)+'.npz')),(1000+i,1000+i))
+	os.utime(str(tmp_path/'0.npz'),(2000,2000))
+
+	prune_cache(str(tmp_path),3000)
+
+	assert sorted(os.listdir(str(tmp_path)))==['0.npz','3.npz','4.npz']
+
+
+def test_get_categorizable_frames_matches_window_scan():
+
+	rng=np.random.default_rng(0)
+	contours=[None if rng.random()<0.4 else np.zeros((3,1,2),dtype='int32') for i in range(200)]
+	length=15
+	expected=[i for i in range(20,180) if contours[i] is not None and sum(c is None for c in contours[i-length+1:i+1])<=length/2]
+
+	assert list(get_categorizable_frames(contours,20,180,length))==expected
+
+
+def test_get_short_runs_skips_the_last_run():
+
+	labels=['NA','a','a','b','a','a','a','b']
+
+	assert get_short_runs(labels,3)==[(0,1),(1,3),(3,4)]
+
+
+def frame_by_frame_short_runs(events,start,end,continued_length,min_length):
+
+	# the frame-by-frame filter of short runs that 'filter_short_runs' replaces
+
+	i=start
+	while i<end:
+		if events[i][0]==events[i-1][0]:
+			continued_length+=1
+		else:
+			if continued_length<min_length:
+				events[i-continued_length:i]=[['NA',-1]]*continued_length
+			continued_length=1
+		i+=1
+
+	return continued_length
+
+
+def test_filter_short_runs_matches_frame_by_frame_filter():
+
+	rng=np.random.default_rng(0)
+	labels=rng.choice(['a','b','c'],size=300,p=[0.6,0.3,0.1])
+	labels[100:140]='a'
+	events=[[str(label),0.9] for label in labels]
+	expected=[list(event) for event in events]
+	continued_length=expected_length=1
+
+	for (start,end) in [(11,40),(40,41),(41,120),(120,130),(130,300)]:
+		continued_length=filter_short_runs(events,start,end,continued_length,4)
+		expected_length=frame_by_frame_short_runs(expected,start,end,expected_length,4)
+		assert continued_length==expected_length
+		assert events==expected
+
+
+def test_get_exclusion_mask_matches_pairwise_overlap():
+
+	rng=np.random.default_rng(1)
+	masks=np.zeros((6,40,50),dtype='uint8')
+	for m in masks[:5]:
+		y,x=rng.integers(0,30),rng.integers(0,40)
+		m[y:y+rng.integers(2,15),x:x+rng.integers(2,15)]=1
+	masks[1]=0
+	masks[1,2:8,3:9]=1
+	masks[2]=0
+	masks[2,3:7,4:8]=1
+	mask_area=np.sum(masks,axis=(1,2))
+	expected=np.zeros(len(masks),dtype=bool)
+	with np.errstate(divide='ignore',invalid='ignore'):
+		expected[np.where((np.sum(np.logical_and(masks[:,None],masks),axis=(2,3))/mask_area[:,None]>0.8) & (mask_area[:,None]<mask_area[None,:]))[0]]=True
+
+	np.testing.assert_array_equal(get_exclusion_mask(masks),expected)
+	assert get_exclusion_mask(masks)[2]
+
+
+def test_get_exclusion_mask_matches_pairwise_overlap_of_many_instances():
+
+	rng=np.random.default_rng(2)
+	masks=np.zeros((60,60,80),dtype='uint8')
+	for m in masks:
+		y,x=rng.integers(0,45),rng.integers(0,65)
+		h,w=rng.integers(1,15),rng.integers(1,15)
+		m[y:y+h,x:x+w]=1
+		if rng.random()<0.5:
+			m[y+h//2:y+h,x:x+w//2]=0
+	masks[30:40]=masks[20:30]
+	masks[30:40,:,:40]=0
+	mask_area=np.sum(masks,axis=(1,2))
+	expected=np.zeros(len(masks),dtype=bool)
+	with np.errstate(divide='ignore',invalid='ignore'):
+		expected[np.where((np.sum(np.logical_and(masks[:,None],masks),axis=(2,3))/mask_area[:,None]>0.8) & (mask_area[:,None]<mask_area[None,:]))[0]]=True
+
+	assert expected.sum()>=5
+	np.testing.assert_array_equal(get_exclusion_mask(masks),expected)
+
+
+@pytest.mark.parametrize('kernel',[1,4,9])
+def test_close_mask_matches_full_frame_closing(kernel):
+
+	mask=np.zeros((60,80),dtype='uint8')
+	mask[5:20,0:12]=1
+	mask[5:20,15:18]=1
+	mask[40:59,50:70]=1
+	expected=cv2.morphologyEx(mask,cv2.MORPH_CLOSE,np.ones((kernel,kernel),np.uint8))
+	cnts,_=cv2.findContours((expected*255).astype(np.uint8),cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_NONE)
+
+	(contour,area,box)=close_mask(mask,kernel)
+
+	np.testing.assert_array_equal(mask,expected)
+	assert area==max(cv2.contourArea(i) for i in cnts)
+	assert cv2.contourArea(contour)==area
+
+
+@pytest.mark.parametrize('method',['greedy','kdtree','hungarian'])
+def test_match_centers(method):
+
+	rng=np.random.default_rng(2)
+	existing_centers=rng.uniform(0,500,(30,2))
+	centers=existing_centers[3:]+rng.normal(0,0.5,(27,2))
+	existing_centers[:3]=-10000
+
+	(matches,unused_existing_indices)=match_centers(existing_centers,centers,method=method,radius=10)
+
+	assert sorted(matches)==[(i,i-3) for i in range(3,30)]
+	assert unused_existing_indices==[0,1,2]
+
+
+def test_motion_prediction_keeps_identities_of_crossing_animals():
+
+	existing_centers=[(-10000,-10000),(-10000,-10000)]
+	velocities=np.zeros((2,2))
+	missed_counts=[0,0]
+
+	for t in range(8):
+		centers=[(10+12*t,50),(110-12*t,54)]
+		predicted_centers=predict_centers(existing_centers,velocities,missed_counts)
+		(matches,unused_existing_indices)=match_centers(predicted_centers,centers)
+		update_velocities(velocities,existing_centers,centers,matches,missed_counts)
+		existing_centers=list(existing_centers)
+		for index_in_existing,index_in_new in matches:
+			existing_centers[index_in_existing]=centers[index_in_new]
+		if t==0:
+			identities={index_in_new:index_in_existing for index_in_existing,index_in_new in matches}
+
+	assert {index_in_new:index_in_existing for index_in_existing,index_in_new in matches}==identities
+
+
+def test_interpolate_predictions_of_sampled_frames():
+
+	frames=np.array([3,4,5,6,7,8,9,12,13])
+	predictions=np.stack([frames*0.05,1-frames*0.05],axis=1).astype('float32')
+
+	positions=sample_frames(frames,3)
+	assert list(positions)==[0,3,6,8]
+	assert np.array_equal(interpolate_predictions(frames,sample_frames(frames,1),predictions),predictions)
+	assert np.allclose(interpolate_predictions(frames,positions,predictions[positions]),predictions)
+
+
+@pytest.mark.parametrize('length',[15,120,300])
+def test_get_std_mask_matches_stacked_masks(length):
+
+	rng=np.random.default_rng(5)
+	masks=(rng.random((length,20,30))<rng.random((20,30))).astype('uint8')
+
+	std_image=(masks*255).std(0)
+
+	for std in [1,30,50,102,127,128]:
+		assert np.array_equal(get_std_mask(masks.sum(0,dtype='int32'),length,std),std_image<std)
+
+
+
+def test_motion_prediction_keeps_identities_of_animals_crossing_unseen():
+
+	existing_centers=[(-10000,-10000),(-10000,-10000)]
+	velocities=np.zeros((2,2))
+	lastseen=np.full(2,-1)
+
+	for t in [0,1,2,3,7]:
+		centers=[(10+12*t,50),(110-12*t,54)]
+		missed_counts=t-lastseen-1
+		predicted_centers=predict_centers(existing_centers,velocities,missed_counts)
+		(matches,unused_existing_indices)=match_centers(predicted_centers,centers)
+		update_velocities(velocities,existing_centers,centers,matches,missed_counts)
+		lastseen[[index_in_existing for index_in_existing,index_in_new in matches]]=t
+		existing_centers=list(existing_centers)
+		for index_in_existing,index_in_new in matches:
+			existing_centers[index_in_existing]=centers[index_in_new]
+		if t==0:
+			identities={index_in_new:index_in_existing for index_in_existing,index_in_new in matches}
+
+	assert {index_in_new:index_in_existing for index_in_existing,index_in_new in matches}==identities